@@ -0,0 +1,67 @@
+"""
+Import time benchmark of queuedownloader. Fail if the import take more
+than the budget or load a heavy dependency that should be lazy.
+
+    $ python benchmarks/import_time.py --budget 100
+"""
+from subprocess import run, PIPE
+from os import path
+import argparse
+import sys
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+# modules that only should be loaded when a service (or verify_files) use them
+HEAVY_MODULES = ["mega", "youtube_dl", "requests", "tqdm", "Crypto", "google.protobuf", "multiprocessing",
+                 "queuedownloader.services.playstore.playstore",
+                 "queuedownloader.services.playstore.playstore_proto_pb2"]
+
+CODE = """
+import sys
+import %s
+print(",".join(m for m in %r if m in sys.modules))
+"""
+
+
+def measure(module):
+    """
+    Return the cumulative import time (ms) of module and the heavy modules loaded
+    """
+    p = run([sys.executable, "-X", "importtime", "-c", CODE % (module, HEAVY_MODULES)],
+            stdout=PIPE, stderr=PIPE, cwd=ROOT, universal_newlines=True, check=True)
+
+    cumulative = 0
+    for line in p.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [f.strip() for f in line.split(":", 1)[-1].split("|")]
+
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative = int(fields[1])
+
+    loaded = [m for m in p.stdout.strip().split(",") if m]
+    return cumulative / 1000.0, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="queuedownloader.manager")
+    parser.add_argument("--budget", type=float, default=100.0, help="max milliseconds")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    # best of runs for avoid noise of os
+    results = [measure(args.module) for _ in range(args.runs)]
+    best = min(ms for ms, _ in results)
+    loaded = sorted(set(m for _, ms in results for m in ms))
+
+    print("import %s: %.1f ms (budget %.1f ms)" % (args.module, best, args.budget))
+
+    if loaded:
+        print("heavy modules loaded at import: %s" % ", ".join(loaded))
+
+    if best > args.budget or loaded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Benchmark of the write path of downloads. Compare the old loop of the
+services (read of 1KiB chunks like response.iter_content(1024), write and
+flush of each chunk) with StreamWriter (readinto in buffers of a pool and
+positional writes). The data is read from a local socket. The allocations
+are the memory blocks allocated by the reads of each loop (the buffers of
+pool are in the peak of memory).
+
+    $ python benchmarks/stream_write.py --size 256
+"""
+from threading import Thread
+from time import perf_counter
+from os import path
+import argparse
+import socket
+import tempfile
+import tracemalloc
+import sys
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from queuedownloader.partfile import PartFile  # noqa: E402
+from queuedownloader.stream import BufferPool, StreamWriter  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def source(size):
+    """
+    Return a file object of a socket that receive size bytes
+    """
+    a, b = socket.socketpair()
+
+    def send():
+        block = b"x" * 65536
+
+        with a:
+            left = size
+            while left > 0:
+                a.sendall(block[:left])
+                left -= len(block)
+
+    Thread(target=send, daemon=True).start()
+    return b.makefile("rb"), b
+
+
+class Counted(object):
+    """
+    Stream that count the memory blocks allocated by its reads (the blocks
+    live after each call that were not before, like the bytes returned by
+    read). Both loops are measured with it, so the counts are comparable
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.blocks = 0
+        # blocks of the measure itself (the int of count before the call)
+        self.overhead = min(self._delta(lambda: None)[0] for _ in range(100))
+
+    def _delta(self, call, *args):
+        blocks = sys.getallocatedblocks()
+        result = call(*args)
+        return sys.getallocatedblocks() - blocks, result
+
+    def read(self, n):
+        delta, data = self._delta(self.stream.read, n)
+        self.blocks += max(delta - self.overhead, 0)
+        return data
+
+    def readinto(self, buffer):
+        delta, n = self._delta(self.stream.readinto, buffer)
+        self.blocks += max(delta - self.overhead, 0)
+        return n
+
+
+def before(stream, directory, size):
+    # new bytes object by chunk, write and flush of each chunk
+    writes = 0
+
+    with open(path.join(directory, "before"), "wb") as f:
+        for chunk in iter(lambda: stream.read(1024), b""):
+            if chunk:
+                f.write(chunk)
+                f.flush()
+                writes += 1
+
+    return writes
+
+
+def after(stream, directory, size):
+    pool = BufferPool()
+    part = PartFile(path.join(directory, "after"), preallocate=False)
+    part.open(size)
+    writes = [0]
+    write = part.write
+
+    def counted(offset, data, extra=None):
+        writes[0] += 1
+        write(offset, data, extra)
+
+    part.write = counted
+    StreamWriter(part, 0, pool=pool).write_from(stream.readinto)
+    part.commit()
+
+    return writes[0]
+
+
+def measure(fun, size, trace=False):
+    stream, sock = source(size)
+
+    with tempfile.TemporaryDirectory() as directory, sock, stream:
+        if trace:
+            stream = Counted(stream)
+            tracemalloc.start()
+
+        start = perf_counter()
+        writes = fun(stream, directory, size)
+        elapsed = perf_counter() - start
+        allocations = peak = 0
+
+        if trace:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            allocations = stream.blocks
+
+    return elapsed, allocations, writes, peak
+
+
+def run(name, fun, size):
+    elapsed, _, writes, _ = measure(fun, size)
+    # the count of allocations and tracemalloc slow down the loop, are measured apart
+    _, allocations, _, peak = measure(fun, size, trace=True)
+
+    print("%-7s %9.1f MB/s %12.3f allocs/MB %10.1f writes/MB %10.1f KiB peak" %
+          (name, size / MB / elapsed, allocations / (size / MB), writes / (size / MB), peak / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=256, help="MiB downloaded")
+    args = parser.parse_args()
+    size = args.size * MB
+
+    run("before", before, size)
+    run("after", after, size)
+
+
+if __name__ == "__main__":
+    main()
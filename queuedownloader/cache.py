@@ -0,0 +1,230 @@
+from collections import OrderedDict
+from threading import Lock
+from json import dumps, loads
+from time import time
+from os import replace
+from os.path import exists
+
+from .services import ProbeInfo
+
+
+class ProbeCache(object):
+    """
+    LRU cache with time to live of the probes of files (size, ETag and
+    Last-Modified) keyed by service and url. Shared by all services.
+    If path is specific the cache is loaded from file and can be saved
+    for start warm the next time.
+
+    :param maxsize: max number of entries
+    :param ttl: seconds that an entry is valid
+    :param path: path of json file for persist the cache
+    """
+
+    def __init__(self, maxsize=4096, ttl=3600, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (service, url) -> (expires, ProbeInfo)
+        self._lock = Lock()
+
+        if path is not None:
+            self.load(path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, service, url):
+        """
+        Return the ProbeInfo cached or None
+        """
+        key = (service.name, url)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                if entry[0] > time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+
+                del self._entries[key]
+
+            self.misses += 1
+            return None
+
+    def put(self, service, url, info, expires=None):
+        with self._lock:
+            self._put((service.name, url), info, expires or time() + self.ttl)
+
+    def _put(self, key, info, expires):
+        self._entries[key] = (expires, info)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def probe(self, service, url, authuser=None, authpasswd=None):
+        """
+        Return the ProbeInfo of url from cache or probing with service.
+        Only the probes with known size are cached
+        """
+        info = self.get(service, url)
+
+        if info is None:
+            info = service.probe(url, authuser, authpasswd)
+
+            if info.size is not None:
+                self.put(service, url, info)
+
+        return info
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._entries))
+
+    def save(self, path=None):
+        """
+        Save the valid entries to json file
+        """
+        path = path or self.path
+        now = time()
+
+        with self._lock:
+            data = [[name, url, expires] + list(info)
+                    for (name, url), (expires, info) in self._entries.items()
+                    if expires > now]
+
+        # write in temporal file for don't corrupt the cache if fail
+        with open(path + ".tmp", "w") as f:
+            f.write(dumps(data))
+
+        replace(path + ".tmp", path)
+
+    def load(self, path=None):
+        """
+        Load the valid entries from json file (if exists)
+        """
+        path = path or self.path
+
+        if not path or not exists(path):
+            return
+
+        with open(path, "r") as f:
+            data = loads(f.read())
+
+        now = time()
+
+        with self._lock:
+            for name, url, expires, size, etag, modified in data:
+                if expires > now:
+                    self._put((name, url), ProbeInfo(size, etag, modified), expires)
+
+
+class HashCache(object):
+    """
+    LRU cache of the hashes of files on disk keyed by (inode, size, mtime),
+    so a file that did not change is never hashed again. Each entry is a
+    dict of algorithm -> hex digest with the algorithms computed. If path
+    is specific the cache is loaded from file and can be saved.
+    >>> st = os.stat(file)
+    >>> cache.get(st)  # None if the file changed
+
+    :param maxsize: max number of entries
+    :param path: path of json file for persist the cache
+    """
+
+    def __init__(self, maxsize=65536, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (inode, size, mtime) -> {algorithm: hex digest}
+        self._lock = Lock()
+
+        if path is not None:
+            self.load(path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(st):
+        """
+        Return the key of the stat result of file
+        """
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, st):
+        """
+        Return the dict of hashes cached of file (a copy) or None
+        """
+        key = self.key(st)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry)
+
+    def put(self, st, hashes):
+        """
+        Add the hashes of file to its entry
+        """
+        with self._lock:
+            self._put(self.key(st), hashes)
+
+    def _put(self, key, hashes):
+        self._entries.setdefault(key, {}).update(hashes)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._entries))
+
+    def save(self, path=None):
+        """
+        Save the entries to json file
+        """
+        path = path or self.path
+
+        with self._lock:
+            data = [list(key) + [hashes] for key, hashes in self._entries.items()]
+
+        # write in temporal file for don't corrupt the cache if fail
+        with open(path + ".tmp", "w") as f:
+            f.write(dumps(data))
+
+        replace(path + ".tmp", path)
+
+    def load(self, path=None):
+        """
+        Load the entries from json file (if exists)
+        """
+        path = path or self.path
+
+        if not path or not exists(path):
+            return
+
+        with open(path, "r") as f:
+            data = loads(f.read())
+
+        with self._lock:
+            for inode, size, mtime, hashes in data:
+                self._put((inode, size, mtime), hashes)
@@ -0,0 +1,94 @@
+from urllib.parse import urlsplit, urlunsplit
+from json import dumps
+from shutil import copyfile
+import errno
+import os
+
+# params of task that don't change the file downloaded
+TRANSFER_PARAMS = ("username", "url", "service", "retrycount", "priority", "filesize", "etag",
+                   "last_modified", "engine", "segments", "min_segment_size", "fsync")
+
+# errors of copy_file_range when the files can't be copied by the kernel
+COPY_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL)
+
+DEFAULT_PORTS = {"http": 80, "https": 443, "ftp": 21}
+
+
+def normalize_url(url):
+    """
+    Return url with scheme and host in lowercase and without default port.
+    The fragment is kept (some services have the file in it, e.g. the
+    links of Mega). The resources that are not urls are returned as is
+    """
+    parts = urlsplit(url)
+
+    if not parts.scheme or not parts.netloc:
+        return url
+
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+
+    if ":" in netloc:
+        netloc = "[%s]" % netloc
+
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc += ":%d" % parts.port
+
+    if parts.username is not None:
+        netloc = "%s@%s" % (parts.username if parts.password is None else
+                            "%s:%s" % (parts.username, parts.password), netloc)
+
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def coalesce_key(info):
+    """
+    Return the key of the file downloaded by a task (same key is same file)
+    from its service, resource (see DownloaderService.resource_id) and
+    params, or None if the file of service is unknown before the download
+    """
+    service = info["service"]
+
+    if not service.filename(info["url"]):
+        return None
+
+    params = {k: v for k, v in info.items() if k not in TRANSFER_PARAMS}
+    return (service.name, service.resource_id(info["url"]), dumps(params, sort_keys=True, default=str))
+
+
+def link_file(source, target):
+    """
+    Make target a copy of the file source. It is a hard link if the file
+    system allow it, else the file is copied with copy_file_range (that
+    share the blocks, reflink, in btrfs and xfs) or read and written.
+    Return the method used: "link", "copy_file_range" or "copy"
+    """
+    tmp = target + ".link"
+
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+
+    try:
+        os.link(source, tmp)
+        method = "link"
+    except OSError:
+        method = _copy(source, tmp)
+
+    os.replace(tmp, target)
+    return method
+
+
+def _copy(source, target):
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(source, "rb") as src, open(target, "wb") as dst:
+                while os.copy_file_range(src.fileno(), dst.fileno(), 1 << 30):
+                    pass
+
+            return "copy_file_range"
+        except OSError as e:
+            if e.errno not in COPY_ERRORS:
+                raise
+
+    copyfile(source, target)
+    return "copy"
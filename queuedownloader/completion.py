@@ -0,0 +1,111 @@
+from concurrent.futures import TimeoutError
+from threading import Condition, Lock
+from collections import deque
+from time import monotonic
+
+
+class _Watcher(object):
+    __slots__ = ("keys", "done")
+
+    def __init__(self, keys, done):
+        self.keys = keys  # keys still waited by the watcher
+        self.done = done  # keys finished but not consumed yet
+
+
+class CompletionTracker(object):
+    """
+    Keep track of the pending tasks of the queue and wake up the
+    threads waiting for them. Nobody spin, all waits are done on a
+    condition variable.
+    """
+
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._pending = set()
+        self._watchers = []
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, key):
+        return key in self._pending
+
+    def add(self, key):
+        with self._cond:
+            self._pending.add(key)
+
+    def finish(self, key):
+        """
+        Mark the task as finished. Return False if the task was not pending
+        """
+        with self._cond:
+            if key not in self._pending:
+                return False
+
+            self._pending.remove(key)
+
+            for w in self._watchers:
+                if key in w.keys:
+                    w.keys.remove(key)
+                    w.done.append(key)
+
+            self._cond.notify_all()
+            return True
+
+    def waitall(self, timeout=None):
+        """
+        Wait until don't have pending tasks. Return False if timeout expire
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def wait_any(self, keys=None, timeout=None):
+        """
+        Wait until any task (of keys if specific) finish and return its key.
+        Return None if timeout expire or don't have tasks to wait
+        """
+        try:
+            return next(self.as_completed(keys, timeout), None)
+        except TimeoutError:
+            return None
+
+    def as_completed(self, keys=None, timeout=None):
+        """
+        Iterator over the keys of tasks (all pending by default) when they finish.
+        The keys that already are finished are yielded first.
+
+        :param keys: keys of tasks to wait
+        :param timeout: max seconds to wait for all tasks. Raise TimeoutError
+        """
+        end = None if timeout is None else monotonic() + timeout
+
+        with self._cond:
+            if keys is None:
+                keys = set(self._pending)
+            else:
+                keys = set(keys)
+
+            done = deque(k for k in keys if k not in self._pending)
+            watcher = _Watcher(keys.difference(done), done)
+            self._watchers.append(watcher)
+
+        try:
+            while True:
+                with self._cond:
+                    while not watcher.done and watcher.keys:
+                        remaining = None if end is None else end - monotonic()
+
+                        if remaining is not None and remaining <= 0:
+                            raise TimeoutError("%d tasks are not finished" % len(watcher.keys))
+
+                        self._cond.wait(remaining)
+
+                    if not watcher.done:
+                        return
+
+                    key = watcher.done.popleft()
+
+                yield key
+        finally:
+            with self._cond:
+                self._watchers.remove(watcher)
@@ -0,0 +1,309 @@
+from threading import Thread, Event, Lock, Condition
+from collections import namedtuple, deque
+from time import monotonic, time
+
+import logging
+
+logger = logging.getLogger("queuedownloader")
+
+# decision taken by the controller in a sample
+# host is None for the global limit
+Decision = namedtuple("Decision", ["time", "host", "previous", "limit",
+                                   "throughput", "latency", "reason"])
+
+INCREASE = "increase"
+HOLD = "hold"
+DECREASE = "decrease"
+
+
+class _Window(object):
+    # measures between two samples
+    __slots__ = ("bytes", "latency", "count", "errors")
+
+    def __init__(self):
+        self.bytes = 0
+        self.latency = 0.0
+        self.count = 0
+        self.errors = 0
+
+
+class _State(object):
+    __slots__ = ("limit", "throughput", "latency", "action")
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.throughput = 0.0  # throughput of last sample
+        self.latency = None  # smoothed latency of tasks
+        self.action = HOLD  # last action
+
+
+class ConcurrencyController(object):
+    """
+    Additive increase / multiplicative decrease controller of the number
+    of concurrent downloads. Each interval sample the bytes/sec and the
+    latency of tasks (global and by host) and:
+
+    * decrease the limit if some task fail, the latency grow more than
+      latency_factor or the throughput drop after the last increase
+    * increase the limit if all workers are busy and the throughput don't drop
+    * otherwise keep the limit
+
+    Every decision is saved in history and published to the stream.
+    >>> c = ConcurrencyController(min_workers=2, max_workers=32)
+    >>> m = DownloadQueueManager(controller=c)
+    >>> for d in c.stream():
+    ...     print (d)
+
+    :param min_workers: min global limit
+    :param max_workers: max global limit
+    :param interval: seconds between samples
+    :param increase: workers added in a increase
+    :param decrease: factor applied to limit in a decrease
+    :param tolerance: relative variation of throughput considered noise
+    :param latency_factor: growth of latency considered congestion
+    :param host_limit: initial (and max) limit of each host, None for don't limit hosts
+    :param history: number of decisions saved
+    """
+
+    def __init__(self, min_workers=1, max_workers=32, interval=5.0, increase=1,
+                 decrease=0.5, tolerance=0.05, latency_factor=2.0, host_limit=None,
+                 history=1024):
+        if min_workers <= 0 or max_workers < min_workers:
+            raise ValueError("should be 0 < min_workers <= max_workers")
+
+        if not 0 < decrease < 1:
+            raise ValueError("'decrease' param should be in (0, 1)")
+
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.latency_factor = latency_factor
+        self.host_max = host_limit
+
+        self.history = deque(maxlen=history)
+        self._cond = Condition(Lock())
+        self._generation = 0  # number of decisions published
+        self._subscribers = []
+
+        self._lock = Lock()
+        self._window = {}  # host -> _Window
+        self._global = None
+        self._hosts = {}  # host -> _State
+        self._last = monotonic()
+        self._manager = None
+        self._stop = Event()
+        self._thread = None
+
+    def attach(self, manager):
+        """
+        Start to control the manager
+        """
+        self._manager = manager
+        self._global = _State(manager.max_workers)
+        self._last = monotonic()
+        self._thread = Thread(target=self._run, daemon=True,
+                              name="queuedownloader-controller")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.exception("controller sample fail: %s", e)
+
+    def host_limit(self, host):
+        """
+        Max tasks running at same time for host, None if is unlimited
+        """
+        if self.host_max is None or not host:
+            return None
+
+        state = self._hosts.get(host)
+        return self.host_max if state is None else state.limit
+
+    def _measure(self, host):
+        w = self._window.get(host)
+
+        if w is None:
+            w = self._window[host] = _Window()
+
+        return w
+
+    def record(self, host, nbytes):
+        """
+        Report bytes transferred
+        """
+        with self._lock:
+            self._measure(host).bytes += nbytes
+
+    def finished(self, host, latency, ok=True, nbytes=0):
+        """
+        Report a task end
+
+        :param latency: seconds that the task was running
+        :param ok: False if the task fail
+        :param nbytes: bytes transferred don't reported with record
+        """
+        with self._lock:
+            w = self._measure(host)
+            w.bytes += nbytes
+            w.latency += latency
+            w.count += 1
+
+            if not ok:
+                w.errors += 1
+
+    def _decide(self, state, w, elapsed, saturated, lower, upper):
+        throughput = w.bytes / elapsed if elapsed > 0 else 0.0
+        latency = w.latency / w.count if w.count else None
+        previous = state.limit
+
+        if w.errors:
+            action, reason = DECREASE, "errors"
+        elif latency is not None and state.latency is not None and \
+                latency > state.latency * self.latency_factor:
+            action, reason = DECREASE, "latency"
+        elif state.action == INCREASE and throughput < state.throughput * (1 - self.tolerance):
+            action, reason = DECREASE, "throughput"
+        elif saturated and throughput >= state.throughput * (1 - self.tolerance):
+            action, reason = INCREASE, "saturated"
+        else:
+            action, reason = HOLD, "idle" if not saturated else "stable"
+
+        if action == DECREASE:
+            state.limit = max(lower, int(state.limit * self.decrease))
+        elif action == INCREASE:
+            state.limit = min(upper, state.limit + self.increase)
+
+        if state.limit == previous:
+            action = HOLD
+
+        if latency is not None:
+            # smoothed latency, the congestion don't enter in baseline
+            if state.latency is None:
+                state.latency = latency
+            elif reason != "latency":
+                state.latency = 0.8 * state.latency + 0.2 * latency
+
+        state.action = action
+        state.throughput = throughput
+        return previous, throughput, latency, reason
+
+    def sample(self):
+        """
+        Take a sample and update the limits. Normally called by the
+        controller thread each interval
+        """
+        now = monotonic()
+
+        with self._lock:
+            elapsed, self._last = now - self._last, now
+            window, self._window = self._window, {}
+
+        manager = self._manager
+        total = _Window()
+
+        for w in window.values():
+            total.bytes += w.bytes
+            total.latency += w.latency
+            total.count += w.count
+            total.errors += w.errors
+
+        decisions = []
+
+        # global limit
+        state = self._global
+        state.limit = manager.max_workers  # can be changed by user
+        saturated = manager.running >= state.limit
+        previous, throughput, latency, reason = self._decide(
+            state, total, elapsed, saturated, self.min_workers, self.max_workers)
+        decisions.append(Decision(time(), None, previous, state.limit,
+                                  throughput, latency, reason))
+
+        if state.limit != previous:
+            manager.set_max_workers(state.limit)
+
+        # limits by host
+        if self.host_max is not None:
+            for host, w in window.items():
+                if not host:
+                    continue
+
+                state = self._hosts.get(host)
+
+                if state is None:
+                    state = self._hosts[host] = _State(self.host_max)
+
+                saturated = manager._hostrunning.get(host, 0) >= state.limit
+                previous, throughput, latency, reason = self._decide(
+                    state, w, elapsed, saturated, 1, self.host_max)
+                decisions.append(Decision(time(), host, previous, state.limit,
+                                          throughput, latency, reason))
+
+                if state.limit > previous:
+                    manager._unpark(host)
+
+            # forget the hosts without activity that return to max limit
+            for host in [h for h, s in self._hosts.items()
+                            if h not in window and s.limit >= self.host_max]:
+                del self._hosts[host]
+
+        self._publish(decisions)
+        return decisions
+
+    def _publish(self, decisions):
+        with self._cond:
+            self.history.extend(decisions)
+            self._generation += len(decisions)
+            self._cond.notify_all()
+
+        for d in decisions:
+            if d.limit != d.previous:
+                logger.debug("concurrency of %s %d -> %d (%s)",
+                             d.host or "queue", d.previous, d.limit, d.reason)
+
+            for callback in list(self._subscribers):
+                callback(d)
+
+    def subscribe(self, callback):
+        """
+        Call callback(decision) for each new decision
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def stream(self, timeout=None):
+        """
+        Iterator over the new decisions. Block until the next sample.
+        Stop if timeout expire without new decisions or the controller stop
+
+        :param timeout: max seconds to wait each decision
+        """
+        with self._cond:
+            generation = self._generation
+
+        while not self._stop.is_set():
+            with self._cond:
+                if not self._cond.wait_for(
+                        lambda: self._generation != generation or self._stop.is_set(), timeout):
+                    return
+
+                # decisions lost if the consumer is slower than history size
+                new = min(self._generation - generation, len(self.history))
+                items = list(self.history)[len(self.history) - new:]
+                generation = self._generation
+
+            for d in items:
+                yield d
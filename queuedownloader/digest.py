@@ -0,0 +1,84 @@
+from threading import Lock
+import hashlib
+
+from .services.errors import IntegrityError
+
+# algorithms that can be checked, the task params with these names are the hex digests expected
+HASH_ALGORITHMS = ("sha1", "sha256", "md5", "blake2b")
+
+
+class Digest(object):
+    """
+    Hashes of a file computed while is downloaded. The bytes are hashed in
+    order from start of file when they are written (see PartFile), so at end
+    the file is verified without read it again. offset is the number of
+    bytes hashed, the object is kept by the task between the retries so a
+    resumed download only hash the bytes fetched after.
+    >>> digest = Digest({"sha256": "9f86d0..."})
+    >>> PartFile(output, digest=digest)
+    >>> digest.verify()  # raise IntegrityError if the file is not the expected
+
+    :param expected: dict of algorithm -> hex digest expected
+    """
+
+    def __init__(self, expected):
+        for name in expected:
+            if name not in HASH_ALGORITHMS:
+                raise ValueError("unsupported hash algorithm %r" % (name,))
+
+        self.expected = {name: value.lower() for name, value in expected.items()}
+        self.lock = Lock()  # held while the bytes are hashed in order
+        self.verified = False
+        self.reset()
+
+    @classmethod
+    def fromparams(cls, params):
+        """
+        Return the Digest of the hash params of a task (None if it don't have any)
+        """
+        expected = {name: params[name] for name in HASH_ALGORITHMS if params.get(name)}
+        return cls(expected) if expected else None
+
+    @staticmethod
+    def size(name):
+        """
+        Return the bytes of the digest of algorithm name
+        """
+        return hashlib.new(name).digest_size
+
+    def reset(self):
+        """
+        Start the hashes again from start of file
+        """
+        self.offset = 0
+        self.verified = False
+        self._hashes = {name: hashlib.new(name) for name in self.expected}
+
+    def update(self, data):
+        """
+        Hash data, the next bytes of file
+        """
+        for h in self._hashes.values():
+            h.update(data)
+
+        self.offset += len(data)
+
+    def hexdigests(self):
+        """
+        Return a dict of algorithm -> hex digest of the bytes hashed
+        """
+        return {name: h.hexdigest() for name, h in self._hashes.items()}
+
+    def verify(self, size=None):
+        """
+        Check the hashes of file of size bytes. Raise IntegrityError if
+        any don't match
+        """
+        if size is not None and self.offset != size:
+            raise IntegrityError("Only %d of %d bytes were hashed." % (self.offset, size))
+
+        for name, value in self.hexdigests().items():
+            if value != self.expected[name]:
+                raise IntegrityError("%s of file is %s, expected %s." % (name, value, self.expected[name]))
+
+        self.verified = True
@@ -0,0 +1,630 @@
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlsplit, urljoin
+from threading import Thread, Condition, Lock
+from collections import deque
+from base64 import b64encode
+from time import monotonic
+import socket
+import ssl
+
+import logging
+
+from .partfile import PartFile, FSYNC_SAVE
+from .stream import StreamWriter, default_pool
+from .services.errors import DownloadError, NetworkError, AuthError, HTTPError
+
+logger = logging.getLogger("queuedownloader")
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+# errors of a idle connection closed by server, the request can be sent again
+STALE_ERRORS = (ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+# max seconds that a probe wait a connection of pool, then it use a new connection
+PROBE_ACQUIRE_TIMEOUT = 1.0
+
+
+class ConnectionPool(object):
+    """
+    Pool of keep-alive connections shared by the downloads, with a
+    limit of connections open by host. acquire() block while the host
+    have max_per_host connections in use. The connections of connect()
+    are not of pool (release them with key None).
+
+    :param max_per_host: max connections in use by host
+    :param max_idle_per_host: max idle connections kept by host
+    :param timeout: timeout of socket operations in seconds
+    :param idle_timeout: seconds that a idle connection is kept
+    """
+
+    def __init__(self, max_per_host=8, max_idle_per_host=8, timeout=30.0, idle_timeout=60.0):
+        self.max_per_host = max_per_host
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+
+        self._idle = {}  # (scheme, host, port) -> deque of (time, connection)
+        self._used = {}  # (scheme, host, port) -> connections in use
+        self._cond = Condition(Lock())
+        self._context = ssl.create_default_context()
+
+    def acquire(self, scheme, host, port, timeout=None):
+        """
+        Return (connection, reused) for host, reused is True if the connection was idle
+        """
+        key = (scheme, host, port)
+
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._used.get(key, 0) < self.max_per_host, timeout):
+                raise NetworkError("Timeout waiting a connection to %s." % host)
+
+            self._used[key] = self._used.get(key, 0) + 1
+            idle = self._idle.get(key)
+            now = monotonic()
+
+            while idle:
+                since, conn = idle.pop()
+
+                if now - since < self.idle_timeout:
+                    return conn, True
+
+                conn.close()
+
+        try:
+            conn = self.connect(scheme, host, port)
+        except Exception:
+            self.release(key, None)
+            raise
+
+        return conn, False
+
+    def connect(self, scheme, host, port):
+        """
+        Return a new connection to host, that is not counted in the limit of host
+        """
+        if scheme == "https":
+            return HTTPSConnection(host, port, timeout=self.timeout, context=self._context)
+
+        return HTTPConnection(host, port, timeout=self.timeout)
+
+    def release(self, key, conn, reuse=True):
+        """
+        Return the connection of host key (scheme, host, port) to pool.
+        If reuse is False the connection is closed. If key is None the
+        connection is not of pool (see connect) and it is closed
+        """
+        if key is None:
+            if conn is not None:
+                conn.close()
+            return
+
+        with self._cond:
+            self._used[key] -= 1
+
+            if not self._used[key]:
+                del self._used[key]
+
+            if conn is not None:
+                idle = self._idle.setdefault(key, deque())
+
+                if reuse and len(idle) < self.max_idle_per_host:
+                    idle.append((monotonic(), conn))
+                    conn = None
+
+            self._cond.notify_all()
+
+        if conn is not None:
+            conn.close()
+
+    def clear(self):
+        """
+        Close all idle connections
+        """
+        with self._cond:
+            idle, self._idle = self._idle, {}
+
+        for conns in idle.values():
+            for _, conn in conns:
+                conn.close()
+
+
+class _Segment(object):
+    """
+    Range [pos, end) of file that is downloaded by a connection
+    """
+    __slots__ = ("first", "pos", "end", "started")
+
+    def __init__(self, start, end):
+        self.first = start  # first byte downloaded by this connection
+        self.pos = start  # next byte to download
+        self.end = end
+        self.started = monotonic()
+
+
+class Response(object):
+    """
+    Response of HTTPEngine.open(). Close it for return the connection to pool
+    """
+
+    def __init__(self, engine, key, conn, response, url):
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+        self._engine = engine
+        self._key = key
+        self._conn = conn
+        self._response = response
+
+    @property
+    def length(self):
+        """
+        Length of body, None if unknown
+        """
+        return self._response.length
+
+    def range(self):
+        """
+        Return (start, total) of a partial response (206), total can be None
+        """
+        value = self.headers.get("content-range", "")
+
+        try:
+            unit, spec = value.split(" ", 1)
+            start, total = spec.split("/", 1)
+            start = int(start.split("-", 1)[0])
+            return start, None if total.strip() == "*" else int(total)
+        except ValueError:
+            raise HTTPError("Invalid Content-Range header: %s." % value, self.status)
+
+    def readinto(self, buffer):
+        """
+        Read the body into buffer, return the bytes read (0 at end)
+        """
+        try:
+            return self._response.readinto(buffer)
+        except (socket.timeout, OSError, HTTPException) as e:
+            raise NetworkError("Error reading response: %s." % e)
+
+    def abort(self):
+        """
+        Close the connection (can be called from other thread, the
+        reader receive an error)
+        """
+        try:
+            self._conn.sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+
+    def close(self):
+        if self._conn is None:
+            return
+
+        # the connection can be reused only if the body was read
+        reuse = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        self._engine.pool.release(self._key, self._conn, reuse)
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+class HTTPEngine(object):
+    """
+    Download engine in process for http and https. The connections are
+    kept alive in a pool shared by all downloads and the body is read
+    with readinto in reusable buffers of a BufferPool. The downloads are
+    written in a PartFile and resumed with Range requests.
+    >>> HTTPEngine().download("https://example.com/file", "file", progress=progress)
+
+    :param pool: ConnectionPool used (a new pool by default)
+    :param buffers: BufferPool of read buffers (default_pool() by default)
+    :param max_redirects: max number of redirects followed
+    :param preallocate: reserve the space of files in disk before download
+                them (else the files are sparse)
+    """
+
+    user_agent = "queuedownloader"
+
+    def __init__(self, pool=None, buffers=None, max_redirects=5, preallocate=True):
+        self.pool = pool if pool is not None else ConnectionPool()
+        self.buffers = buffers if buffers is not None else default_pool()
+        self.max_redirects = max_redirects
+        self.preallocate = preallocate
+
+    def open(self, url, method="GET", start=None, end=None, auth=None, headers=None, wait=None):
+        """
+        Send a request and return the Response (following redirects).
+        Raise AuthError, HTTPError or NetworkError if fail
+
+        :param start: first byte requested (Range), None for all
+        :param end: last byte requested (inclusive), None until end
+        :param auth: (user, password) for basic authentication
+        :param wait: max seconds waiting a connection of pool, after it a new
+                    connection out of pool is used (None for wait always)
+        """
+        h = {"User-Agent": self.user_agent, "Accept-Encoding": "identity"}
+
+        if start is not None:
+            h["Range"] = "bytes=%d-%s" % (start, "" if end is None else end)
+
+        if auth and auth[0] and auth[1]:
+            h["Authorization"] = "Basic " + b64encode(("%s:%s" % auth).encode()).decode("ascii")
+
+        h.update(headers or {})
+
+        for _ in range(self.max_redirects + 1):
+            response = self._request(url, method, h, wait)
+
+            if response.status not in REDIRECTS or "location" not in response.headers:
+                break
+
+            location = urljoin(url, response.headers["location"])
+
+            # the credentials are not sent to other host
+            if urlsplit(location).hostname != urlsplit(url).hostname:
+                h.pop("Authorization", None)
+
+            url = location
+            response.close()
+        else:
+            response.close()
+            raise HTTPError("Too many redirects.", response.status)
+
+        if response.status in (401, 407):
+            response.close()
+            raise AuthError("Username/password authentication failure.")
+
+        if response.status >= 400 and response.status != 416:
+            response.close()
+            raise HTTPError("Server issued an error response (%d)." % response.status, response.status)
+
+        return response
+
+    def _request(self, url, method, headers, wait=None):
+        parts = urlsplit(url)
+
+        if parts.scheme not in ("http", "https"):
+            raise DownloadError("Unsupported scheme %s." % parts.scheme)
+
+        try:
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+        except ValueError:
+            raise DownloadError("Invalid url %s." % url)
+
+        key = (parts.scheme, parts.hostname, port)
+        target = parts.path or "/"
+
+        if parts.query:
+            target += "?" + parts.query
+
+        while True:
+            pooled = key
+
+            try:
+                conn, reused = self.pool.acquire(*key, timeout=wait)
+            except NetworkError:
+                if wait is None:
+                    raise
+
+                # the connections of host are used by downloads
+                pooled, reused = None, False
+                conn = self.pool.connect(*key)
+
+            try:
+                conn.request(method, target, headers=headers)
+                response = conn.getresponse()
+            except ssl.SSLError as e:
+                self.pool.release(pooled, conn, reuse=False)
+                raise DownloadError("SSL verification failure: %s." % e)
+            except (OSError, HTTPException) as e:
+                self.pool.release(pooled, conn, reuse=False)
+
+                # the server closed the idle connection, use a new connection
+                if reused and isinstance(e, STALE_ERRORS + (HTTPException,)):
+                    continue
+
+                raise NetworkError("Network failure: %s." % e)
+
+            if method == "HEAD":
+                response.close()
+
+            return Response(self, pooled, conn, response, url)
+
+    def download(self, url, output, progress=None, auth=None, resume=True, cancelled=None,
+                 onresponse=None, segments=1, min_segment_size=4 * 1024 * 1024, writer=None,
+                 fsync=FSYNC_SAVE, digest=None):
+        """
+        Download url to output file. The data is written in a PartFile
+        renamed to output at end, if resume is True the download continue
+        with the ranges missing of the part file (if the file did not change
+        in server). Return True if is complete, False if was cancelled
+
+        :param progress: Progress where the bytes downloaded are reported
+        :param auth: (user, password) for basic authentication
+        :param cancelled: called without params, return True if should stop
+        :param onresponse: called with each Response when is opened (for abort it)
+        :param segments: max connections used for download the file by ranges
+                    (only if the server accept ranges)
+        :param min_segment_size: min bytes of a range
+        :param writer: WriteBehind that write the data (None for write it in
+                    the threads that download)
+        :param fsync: fsync policy of part file (see PartFile)
+        :param digest: Digest of file checked at end (raise IntegrityError if don't match)
+        """
+        part = PartFile(output, preallocate=self.preallocate, fsync=fsync, digest=digest)
+
+        if not resume:
+            part.reset()
+
+        try:
+            complete = None
+
+            if segments > 1:
+                headers = self.probe(url, auth, wait=None)
+                total = headers.get("content-length", "")
+
+                if headers.get("accept-ranges", "").lower() == "bytes" and total.isdigit() and \
+                        int(total) >= 2 * min_segment_size:
+                    part.validate(int(total), headers.get("etag"))
+                    complete = self._segmented(url, part, int(total), progress, auth, cancelled,
+                                               onresponse, segments, min_segment_size, writer)
+
+            if complete is None:
+                complete = self._single(url, part, progress, auth, cancelled, onresponse, writer)
+
+            if complete:
+                part.commit()
+
+            return complete
+        finally:
+            try:
+                # the writer threads can't write after the file is closed
+                if writer is not None:
+                    writer.wait(part)
+            finally:
+                part.close()
+
+    def _single(self, url, part, progress, auth, cancelled, onresponse, writer):
+        # download the file in one request from the end of data at start of part file
+        start = part.offset()
+        headers = {"If-Range": part.etag} if start and part.etag else None
+
+        with self.open(url, start=start or None, auth=auth, headers=headers) as r:
+            if onresponse is not None:
+                onresponse(r)
+
+            if r.status == 416:
+                # the file is already complete or it changed in server
+                if r.headers.get("content-range", "").strip() == "bytes */%d" % start:
+                    return True
+
+                r.close()
+                part.reset()
+                return self._single(url, part, progress, auth, cancelled, onresponse, writer)
+
+            if r.status == 206:
+                start, total = r.range()
+
+                if not part.validate(total, r.headers.get("etag")):
+                    r.close()
+                    return self._single(url, part, progress, auth, cancelled, onresponse, writer)
+            else:
+                # the server don't support ranges or the file changed, download all again
+                start, total = 0, r.length
+                part.reset()
+                part.validate(total, r.headers.get("etag"))
+
+            if progress is not None:
+                progress.reset(start, total)
+
+            # reserve the space of file before download it
+            part.open(total)
+            part.truncate(start)
+            stream = StreamWriter(part, start, progress, self.buffers, writer)
+
+            try:
+                if not stream.write_from(r.readinto, cancelled):
+                    return False
+            except NetworkError:
+                if cancelled is not None and cancelled():
+                    return False
+                raise
+
+            if total is not None and stream.position < total:
+                raise NetworkError("Connection closed before end of file.")
+
+        return True
+
+    def _segmented(self, url, part, total, progress, auth, cancelled, onresponse,
+                   segments, min_segment_size, writer):
+        # download the ranges missing of file in parallel, when a connection
+        # end its range and there are not more it take the half of the range
+        # that will end the last
+        count = max(1, min(segments, total // min_segment_size))
+        pending = deque(_Segment(s, e) for s, e in part.missing(total))
+        active = []
+        responses = []
+        errors = []
+        lock = Lock()
+
+        # split the ranges missing until there are one by connection
+        while pending and len(pending) < count:
+            largest = max(pending, key=lambda s: s.end - s.pos)
+
+            if largest.end - largest.pos < 2 * min_segment_size:
+                break
+
+            pending.append(self._split([largest], min_segment_size))
+
+        pending = deque(sorted(pending, key=lambda s: s.pos))
+        count = min(count, len(pending))
+
+        if progress is not None:
+            progress.reset(part.done(), total)
+
+        if not pending:
+            return True
+
+        def opened(r):
+            with lock:
+                responses.append(r)
+
+                # other connection fail
+                if errors:
+                    r.abort()
+
+            if onresponse is not None:
+                onresponse(r)
+
+        def take():
+            with lock:
+                if errors or (cancelled is not None and cancelled()):
+                    return None
+
+                segment = pending.popleft() if pending else self._split(active, min_segment_size)
+
+                if segment is not None:
+                    segment.started = monotonic()
+                    active.append(segment)
+
+                return segment
+
+        def worker():
+            try:
+                while True:
+                    segment = take()
+
+                    if segment is None:
+                        return
+
+                    try:
+                        self._fetch(url, auth, segment, part, writer, lock, progress, cancelled, opened)
+                    finally:
+                        with lock:
+                            active.remove(segment)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+
+                    # stop the other connections
+                    for r in responses:
+                        r.abort()
+
+        # file of final size, the ranges missing are written in any order
+        part.open(total)
+
+        threads = [Thread(target=worker, daemon=True, name="queuedownloader-segment-%d" % i)
+                   for i in range(1, count)]
+
+        for t in threads:
+            t.start()
+
+        worker()
+
+        for t in threads:
+            t.join()
+
+        if cancelled is not None and cancelled():
+            return False
+
+        if errors:
+            raise errors[0]
+
+        if writer is not None:
+            writer.wait(part)
+
+        return True
+
+    @staticmethod
+    def _split(active, min_segment_size):
+        # split the range that will end the last (by the rate of its connection)
+        now = monotonic()
+        slowest, eta = None, -1
+
+        for segment in active:
+            remaining = segment.end - segment.pos
+
+            if remaining < 2 * min_segment_size:
+                continue
+
+            elapsed = now - segment.started
+            rate = (segment.pos - segment.first) / elapsed if elapsed > 0 else 0
+            t = remaining / rate if rate > 0 else float("inf")
+
+            if t > eta:
+                slowest, eta = segment, t
+
+        if slowest is None:
+            return None
+
+        middle = slowest.pos + (slowest.end - slowest.pos) // 2
+        segment = _Segment(middle, slowest.end)
+        slowest.end = middle
+        return segment
+
+    def _fetch(self, url, auth, segment, part, writer, lock, progress, cancelled, onresponse):
+        # download the range of segment
+        with self.open(url, start=segment.pos, end=segment.end - 1, auth=auth) as r:
+            onresponse(r)
+
+            if r.status != 206:
+                raise HTTPError("Server don't support ranges.", r.status)
+
+            # the file changed while is downloaded
+            if r.headers.get("etag") and part.etag and r.headers.get("etag") != part.etag:
+                raise NetworkError("File changed in server while is downloaded.")
+
+            stream = StreamWriter(part, segment.pos, None, self.buffers, writer)
+
+            try:
+                while segment.pos < segment.end:
+                    if cancelled is not None and cancelled():
+                        return
+
+                    n = r.readinto(stream.free())
+
+                    if not n:
+                        raise NetworkError("Connection closed before end of range.")
+
+                    with lock:
+                        # the end can be reduced by a split
+                        n = min(n, segment.end - segment.pos)
+                        segment.pos += n
+
+                        if progress is not None:
+                            progress.add(n)
+
+                    stream.advance(n)
+            finally:
+                stream.close()
+
+    def probe(self, url, auth=None, wait=PROBE_ACQUIRE_TIMEOUT):
+        """
+        Return the response headers of a HEAD request. If the connections of
+        host are in use (e.g. by long downloads) more than wait seconds the
+        request use a new connection, so the probes never wait the downloads
+        """
+        with self.open(url, method="HEAD", auth=auth, wait=wait) as r:
+            return r.headers
+
+
+_engine = None
+_lock = Lock()
+
+
+def default_engine():
+    """
+    Return the HTTPEngine shared by the services
+    """
+    global _engine
+
+    with _lock:
+        if _engine is None:
+            _engine = HTTPEngine()
+
+        return _engine
@@ -0,0 +1,282 @@
+from threading import Thread, Condition, Lock
+from collections import OrderedDict
+from json import dumps, loads
+from os import path, fsync, replace, open as osopen, close as osclose, O_RDONLY
+import os
+
+import logging
+
+logger = logging.getLogger("queuedownloader")
+
+# operations of journal
+ADD = "add"
+UPDATE = "update"
+START = "start"
+CHECKPOINT = "checkpoint"
+COMPLETE = "complete"
+FAIL = "fail"
+CANCEL = "cancel"
+
+# operations that remove the task
+END = (COMPLETE, FAIL, CANCEL)
+
+
+def _serialize(info):
+    t = dict(info)
+
+    if isinstance(t.get("service"), type):
+        t["service"] = t["service"].name
+
+    return t
+
+
+class Journal(object):
+    """
+    Append-only log of the changes of queue (json lines) for recover it
+    after a crash. The records are written by a thread that commit them
+    in groups (one write and fsync for all records appended while the
+    last commit was running) and when the log is much bigger than the
+    live tasks it is compacted (rewritten with only the live tasks).
+    >>> m = DownloadQueueManager(journal=Journal("queue.journal"))
+
+    :param path: path of journal file
+    :param sync_interval: max seconds between commits
+    :param fsync: fsync the file on each commit
+    :param compact_min: min number of records for compact
+    :param compact_ratio: compact when records > compact_ratio * live tasks
+    """
+
+    def __init__(self, path, sync_interval=0.05, fsync=True, compact_min=10000, compact_ratio=4.0):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.fsync = fsync
+        self.compact_min = compact_min
+        self.compact_ratio = compact_ratio
+
+        self._live = OrderedDict()  # key -> [add line, updates]
+        self._records = 0  # records in file
+        self._buffer = []
+        self._appended = 0  # number of records appended
+        self._synced = 0  # number of records durable
+        self._cond = Condition(Lock())
+        self._io = Lock()  # writes and compactions of file
+        self._closed = False
+        self._file = None
+        self._thread = None
+
+    def __len__(self):
+        return len(self._live)
+
+    def recover(self):
+        """
+        Read the journal and open it for append. Return the live tasks as
+        a list of (key, info, state) in order of queue, state is a dict with
+        the attempts and the bytes downloaded at last checkpoint ("checkpoint")
+        """
+        tasks = OrderedDict()  # key -> (info, state)
+
+        if path.exists(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        record = loads(line)
+                    except ValueError:
+                        # the last line can be truncated by a crash
+                        logger.warning("journal %s: ignoring corrupted record", self.path)
+                        continue
+
+                    self._records += 1
+                    self._apply(tasks, record)
+
+        for key, (info, state) in tasks.items():
+            self._live[key] = [dumps({"op": ADD, "key": key, "info": info}, default=str), dict(state)]
+
+        # remove the corrupted and old records
+        self._file = open(self.path, "a")
+        self.compact()
+
+        self._thread = Thread(target=self._run, daemon=True, name="queuedownloader-journal")
+        self._thread.start()
+
+        return [(key, info, state) for key, (info, state) in tasks.items()]
+
+    @staticmethod
+    def _apply(tasks, record):
+        op, key = record.get("op"), record.get("key")
+
+        if op == ADD:
+            tasks[key] = (record["info"], {})
+        elif key not in tasks:
+            return
+        elif op == UPDATE:
+            tasks[key][0].update(record["fields"])
+        elif op == START:
+            tasks[key][1]["attempts"] = record["attempts"]
+        elif op == CHECKPOINT:
+            tasks[key][1]["checkpoint"] = record["bytes"]
+        elif op in END:
+            del tasks[key]
+
+    def _append(self, record, line=None):
+        with self._cond:
+            if self._closed:
+                return
+
+            key, op = record["key"], record["op"]
+            line = line or dumps(record, default=str)
+
+            if op == ADD:
+                self._live[key] = [line, {}]
+            elif key not in self._live:
+                return
+            elif op == UPDATE:
+                self._live[key][1].update(record["fields"])
+            elif op == START:
+                self._live[key][1]["attempts"] = record["attempts"]
+            elif op == CHECKPOINT:
+                self._live[key][1]["checkpoint"] = record["bytes"]
+            elif op in END:
+                del self._live[key]
+
+            self._buffer.append(line)
+            self._appended += 1
+            self._cond.notify_all()
+
+    def add(self, key, info):
+        self._append({"op": ADD, "key": str(key), "info": _serialize(info)})
+
+    def update(self, key, **fields):
+        self._append({"op": UPDATE, "key": str(key), "fields": fields})
+
+    def start(self, key, attempts):
+        self._append({"op": START, "key": str(key), "attempts": attempts})
+
+    def checkpoint(self, key, nbytes):
+        self._append({"op": CHECKPOINT, "key": str(key), "bytes": nbytes})
+
+    def complete(self, key):
+        self._append({"op": COMPLETE, "key": str(key)})
+
+    def fail(self, key):
+        self._append({"op": FAIL, "key": str(key)})
+
+    def cancel(self, key):
+        self._append({"op": CANCEL, "key": str(key)})
+
+    def sync(self, timeout=None):
+        """
+        Wait until all records appended are durable. Return False if timeout expire
+        """
+        if self._thread is None:
+            return True
+
+        with self._cond:
+            target = self._appended
+            return self._cond.wait_for(lambda: self._synced >= target or self._closed, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer or self._closed)
+
+                if not self._buffer and self._closed:
+                    return
+
+                lines, self._buffer = self._buffer, []
+                target = self._appended
+
+            try:
+                self._commit(lines)
+
+                if self._records > max(self.compact_min, self.compact_ratio * len(self._live)):
+                    self.compact()
+            except Exception as e:
+                logger.exception("cannot write journal %s: %s", self.path, e)
+
+            with self._cond:
+                self._synced = max(self._synced, target)
+                self._cond.notify_all()
+
+            # wait more records for the next group
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed, self.sync_interval)
+
+    def _commit(self, lines):
+        with self._io:
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+
+            if self.fsync:
+                fsync(self._file.fileno())
+
+            self._records += len(lines)
+
+    def compact(self):
+        """
+        Rewrite the journal with only the live tasks
+        """
+        with self._io, self._cond:
+            # the buffered records are included in the live tasks
+            lines = []
+
+            for key, (line, updates) in self._live.items():
+                lines.append(line)
+
+                fields = {k: v for k, v in updates.items() if k not in ("attempts", "checkpoint")}
+
+                if fields:
+                    lines.append(dumps({"op": UPDATE, "key": key, "fields": fields}, default=str))
+                if "attempts" in updates:
+                    lines.append(dumps({"op": START, "key": key, "attempts": updates["attempts"]}))
+                if "checkpoint" in updates:
+                    lines.append(dumps({"op": CHECKPOINT, "key": key, "bytes": updates["checkpoint"]}))
+
+            self._buffer = []
+            target = self._appended
+
+            tmp = self.path + ".tmp"
+
+            with open(tmp, "w") as f:
+                if lines:
+                    f.write("\n".join(lines) + "\n")
+
+                f.flush()
+                fsync(f.fileno())
+
+            self._file.close()
+            replace(tmp, self.path)
+            _fsyncdir(path.dirname(path.abspath(self.path)))
+
+            self._file = open(self.path, "a")
+            self._records = len(lines)
+            self._synced = max(self._synced, target)
+            self._cond.notify_all()
+
+    def close(self):
+        """
+        Commit the pending records and close the journal
+        """
+        self.sync()
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        if self._file is not None:
+            self._file.close()
+
+
+def _fsyncdir(directory):
+    # make durable the rename (only posix)
+    if os.name != "posix":
+        return
+
+    fd = osopen(directory, O_RDONLY)
+
+    try:
+        fsync(fd)
+    finally:
+        osclose(fd)
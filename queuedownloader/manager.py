@@ -1,81 +1,412 @@
-from concurrent.futures.thread import ThreadPoolExecutor
 from uuid import uuid1, UUID
-from threading import Lock, RLock
-from os import stat, path, getcwd, makedirs
+from threading import RLock
+from os import path, getcwd, makedirs
 from json import dumps, loads
 import contextlib
-from datetime import datetime
-from collections import namedtuple
+from collections import deque
+from time import monotonic, time
 
-import sys
 import logging
 
-from .services import (DownloaderService, DefaultService, 
-                        MegaService, PlayStoreService)
+from .services import DownloaderService, registry as default_registry
 from .utils import memoize_when_activated
-
-DEFAULT_SERVICES = [MegaService, PlayStoreService]
+from .completion import CompletionTracker
+from .tasks import Task, QUEUED, RUNNING, RETRYING, CANCELLED, COALESCED
+from .scheduler import FairScheduler
+from .pool import WorkerPool
+from .probe import ProbePool
+from .cache import ProbeCache, HashCache
+from .retry import RetryScheduler
+from .progress import Progress
+from .journal import Journal
+from .store import MemoryTaskStore
+from .status import StatusView, TaskIterator
+from .stream import WriteBehind
+from .partfile import FSYNC_POLICIES
+from .digest import Digest, HASH_ALGORITHMS
+from .verify import verify_files
+from .coalesce import coalesce_key, link_file
 
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger("queuedownloader")
 logger.setLevel(logging.DEBUG)
 
+# bytes downloaded between checkpoints of journal
+CHECKPOINT_BYTES = 8 * 1024 * 1024
+
+# seconds between the updates of progress of a task in the status view
+STATUS_PROGRESS_INTERVAL = 0.2
+
 class DownloadQueueManager(object):
-    def __init__(self, max_threads=4, oncts=None):
-        self._queue = []  # list
-        self._executor = ThreadPoolExecutor(max_workers=max_threads)
-        self._tasks_info = {}
-        self._tasks = {}
-        self._services = {}
+    def __init__(self, max_threads=4, oncts=None, scheduler=None, controller=None,
+                 max_probes=4, probe_cache=None, registry=None, retry=None, journal=None,
+                 store=None, write_behind=None, hash_cache=None, coalesce=True):
+        """
+        :param max_threads: max downloads running at same time
+        :param oncts: callback called as oncts(event, (username, url)) when
+                    a task is completed, retried or failed
+        :param scheduler: Scheduler instance used for decide the order of
+                    execution of tasks (FairScheduler by default)
+        :param controller: ConcurrencyController instance used for adjust the
+                    number of workers (and running tasks by host) at runtime
+        :param max_probes: max file size probes running at same time
+        :param probe_cache: ProbeCache shared by services for the probes, by default
+                    a cache in memory. If the cache have path it is saved on shutdown
+        :param registry: ServiceRegistry used for detect the service of urls
+        :param retry: RetryScheduler used for delay the retries of failed tasks
+        :param journal: Journal (or path of journal file) where the changes of queue
+                    are logged. The tasks of journal are recovered at start
+        :param store: TaskStore where the tasks of queue are kept (in memory by default).
+                    The tasks of a persistent store are recovered at start if don't have journal
+        :param write_behind: WriteBehind (or number of writer threads) that write the data
+                    downloaded, so the threads of network don't wait the disk. None for
+                    write it in the threads of downloads
+        :param hash_cache: HashCache of the hashes of files on disk used by verify_existing, by
+                    default a cache in memory. If the cache have path it is saved on shutdown
+        :param coalesce: the tasks that download the same file (same url normalized, service
+                    and params) while other is in progress wait it, and the file is linked
+                    (or copied) to the directory of their users
+        """
+        self._table = store if store is not None else MemoryTaskStore()  # all tasks of queue in order
+        self._pool = WorkerPool(max_workers=max_threads)
+        self._scheduler = scheduler if scheduler is not None else FairScheduler()
+        self._max_workers = max_threads
+        self._running = 0  # tasks submitted to pool
+        self._hostrunning = {}  # host -> tasks submitted to pool
+        self._parked = {}  # host -> tasks waiting for a free slot of host
         self._directorySaveBase = path.join(getcwd(), "downloaded")
-        # use for retries downloads and cannot cancelled because the task always are beging
-        # use set for best perfomace (hash)
-        self._cancelled_task = set()
+        self._registry = registry if registry is not None else default_registry
         self._oncts = oncts
         self._lock = RLock()
+        self._completion = CompletionTracker()
+        self._status = StatusView()
+        self._probecache = probe_cache if probe_cache is not None else ProbeCache()
+        self._probes = ProbePool(self._probed, max_workers=max_probes, cache=self._probecache)
+        self._hashcache = hash_cache if hash_cache is not None else HashCache()
+        self._coalesce = coalesce
+        self._leaders = {}  # group -> task that download the file
+        self._followers = {}  # group -> tasks waiting the file
+        self._controller = controller
+        self._retry = retry if retry is not None else RetryScheduler()
+        self._retry.start(self._retryfire)
+
+        if isinstance(write_behind, int):
+            write_behind = WriteBehind(threads=write_behind)
+
+        self._writer = write_behind
+
+        if isinstance(journal, str):
+            journal = Journal(journal)
+
+        self._journal = journal
+
+        if controller is not None:
+            controller.attach(self)
+
+        # the journal have the last state of queue, else the tasks of store are
+        # added again with their keys (the rows saved are replaced by them)
+        if journal is not None:
+            entries = journal.recover()
+            self._table.clear()
+        else:
+            entries = self._table.load()
 
-    def getservice(self, url):
-        for service in DEFAULT_SERVICES:
-            if service.supported(url):
-                return service
+        if entries:
+            self._recover(entries)
 
-        #raise Exception("dont are service available to download this resource")
-        return DefaultService
+    def getservice(self, url):
+        return self._registry.lookup(url)
 
-    def _worker(self, key):
-        t = self._tasks_info[key]
+    def _worker(self, task):
+        t = task.info
         user_directory = path.join(self._directorySaveBase, t["username"])
 
         if issubclass(t["service"], DownloaderService):
-            if not path.exists(user_directory):
-                makedirs(user_directory)
+            makedirs(user_directory, exist_ok=True)
+
+            with t["service"](t["url"], user_directory,
+                              **dict(t, progress=task.progress, writer=self._writer,
+                                     digest=task.digest)) as s:
+                with self._lock:
+                    # cancelled before the service was started
+                    if task.state == CANCELLED:
+                        return False
+
+                    task.service = s
+                    task.state = RUNNING
+                    self._touch(task)
 
-            with t["service"](t["url"], user_directory, **t) as s:
-                self._services[key] = s
                 return s.execute()
         else:
             raise TypeError(
                 "'service' param should be a DownloaderService subclass")
 
-    def _addservicetask(self, **kwargs):
+    def _newtask(self, kwargs, key=None):
         #setting default values
-        kwargs["service"] = kwargs.get("service", self.getservice(kwargs["url"]))
+        if kwargs.get("service") is None:
+            kwargs["service"] = self.getservice(kwargs["url"])
+
         kwargs["retrycount"] = kwargs.get("retrycount", 4)
-        kwargs["filesize"] = kwargs.get("filesize", kwargs["service"].filesize(kwargs["url"]))
-        
-        key = uuid1()
+        kwargs["filesize"] = kwargs.get("filesize")
+
+        task = Task(key or uuid1(), kwargs)
+        task.probing = kwargs["filesize"] is None
+        task.progress = Progress(kwargs["filesize"], callback=self._progresscallback(task))
+        task.digest = Digest.fromparams(kwargs)
+        task.group = coalesce_key(kwargs) if self._coalesce else None
+        return task
+
+    def _progresscallback(self, task):
+        # the bytes downloaded are reported to controller, journal and status
+        # view (called by the thread of service without lock)
+        controller, journal, status = self._controller, self._journal, self._status
+        checkpoint = [0]
+        tick = [monotonic()]
+
+        def callback(nbytes):
+            if controller is not None:
+                controller.record(task.host, nbytes)
+
+            if journal is not None and abs(task.progress.done - checkpoint[0]) >= CHECKPOINT_BYTES:
+                checkpoint[0] = task.progress.done
+                journal.checkpoint(task.key, checkpoint[0])
+
+            now = monotonic()
+
+            if now - tick[0] >= STATUS_PROGRESS_INTERVAL:
+                tick[0] = now
+                status.progress(task)
+
+        return callback
+
+    def _inserttasks(self, tasks, journal=True):
+        # the tasks are logged before they can be started
+        if journal and self._journal is not None:
+            for task in tasks:
+                self._journal.add(task.key, task.info)
+
+        # add the tasks to queue with only one scheduling pass
+        with self._lock:
+            self._table.add_many(tasks)
+
+            for task in tasks:
+                self._completion.add(task.key)
+                task.state = QUEUED
+                self._status.update(task)
+                self._scheduler.push(task)
+
+            self._dispatch()
+
+        # the sizes are resolved in background
+        self._probes.submit_many(task for task in tasks if task.probing)
+
+    def _addservicetask(self, **kwargs):
+        task = self._newtask(kwargs)
+        self._inserttasks((task,))
+        return task.key
+
+    def _probed(self, task, info):
+        if info is not None:
+            task.info["filesize"] = info.size
+
+            if task.progress.total is None:
+                task.progress.total = info.size
+
+            # validators of resource
+            if info.etag:
+                task.info["etag"] = info.etag
+            if info.last_modified:
+                task.info["last_modified"] = info.last_modified
+
+            if self._journal is not None:
+                self._journal.update(task.key, filesize=info.size,
+                                     etag=info.etag, last_modified=info.last_modified)
+
+        with self._lock:
+            task.probing = False
+            self._touch(task)
 
-        self._queue.append(key)
-        self._tasks_info[key] = kwargs
+    def _touch(self, task):
+        # the state or params of task changed
+        if task.key in self._table:
+            self._table.update(task)
+            self._status.update(task)
 
-        w = self._executor.submit(self._worker, key)
-        w.add_done_callback(lambda x: self._completework(x, key))
+    def _recover(self, entries):
+        # add the tasks of journal (or store) with their keys, the files
+        # with known size are not probed again
+        tasks = []
 
-        # if task is running, set a task value
-        if not w.done():
-            self._tasks[key] = w
+        for key, info, state in entries:
+            service = self._registry.byname(info.get("service"))
 
-        return key
+            if service is None:
+                logger.warning("task %s of journal skipped, unknown service %s", key, info.get("service"))
+                continue
+
+            info["service"] = service
+            task = self._newtask(info, UUID(key))
+            task.attempts = state.get("attempts", 0)
+
+            # bytes downloaded at the last checkpoint, the service resume
+            # from the part file and reset the progress when is started
+            if state.get("checkpoint"):
+                task.progress.reset(state["checkpoint"])
+
+            tasks.append(task)
+
+        if tasks:
+            logger.info("%d tasks recovered", len(tasks))
+            self._inserttasks(tasks, journal=False)
+
+    def _admit(self, task):
+        # queue the task in scheduler and run it when is possible
+        with self._lock:
+            task.state = QUEUED
+            task.service = None
+            task.future = None
+            task.retry_at = None
+            self._touch(task)
+            self._scheduler.push(task)
+            self._dispatch()
+
+    def _delay(self, task, delay):
+        # wait delay seconds before queue the task again
+        task.state = RETRYING
+        task.service = None
+        task.future = None
+        task.retry_at = monotonic() + delay
+        self._touch(task)
+        self._retry.schedule(task, task.retry_at)
+
+    def _retryfire(self, task, due):
+        with self._lock:
+            # skip cancelled or restarted tasks
+            if task.state == RETRYING and task.retry_at == due:
+                self._admit(task)
+
+    def _dispatch(self):
+        # submit the next tasks of scheduler while have free workers
+        with self._lock:
+            while self._running < self._max_workers:
+                task = self._scheduler.pop()
+
+                if task is None:
+                    break
+
+                # other task is downloading the same file, wait it
+                if task.group is not None:
+                    leader = self._leaders.get(task.group)
+
+                    if leader is not None and leader is not task:
+                        self._scheduler.done(task)
+                        task.state = COALESCED
+                        self._followers.setdefault(task.group, []).append(task)
+                        self._touch(task)
+                        continue
+
+                    self._leaders[task.group] = task
+
+                if self._controller is not None:
+                    limit = self._controller.host_limit(task.host)
+
+                    if limit is not None and self._hostrunning.get(task.host, 0) >= limit:
+                        # the host is busy, wait a free slot of host
+                        self._scheduler.done(task)
+                        self._parked.setdefault(task.host, deque()).append(task)
+                        continue
+
+                # the host is unavailable (circuit breaker open)
+                wait = self._retry.blocked(task.host, owner=task.key)
+
+                if wait > 0:
+                    self._scheduler.done(task)
+                    self._delay(task, wait)
+                    continue
+
+                self._running += 1
+                task.attempts += 1
+                self._hostrunning[task.host] = self._hostrunning.get(task.host, 0) + 1
+                task.started = monotonic()
+
+                if self._journal is not None:
+                    self._journal.start(task.key, task.attempts)
+
+                self._status.update(task)
+
+                task.future = self._pool.submit(self._worker, task)
+                task.future.add_done_callback(lambda x, task=task: self._completework(x, task))
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def probe_cache(self):
+        return self._probecache
+
+    @property
+    def hash_cache(self):
+        return self._hashcache
+
+    @property
+    def running(self):
+        """
+        Number of tasks running
+        """
+        return self._running
+
+    def set_max_workers(self, max_workers):
+        """
+        Change the max number of downloads running at same time. If the number
+        grow the queued tasks are started immediately, if shrink the running
+        tasks are not cancelled, the workers are retired when their task end.
+
+        :param max_workers: new number of workers
+        """
+        if not isinstance(max_workers, int):
+            raise TypeError("'max_workers' param should be a int")
+
+        with self._lock:
+            self._pool.set_max_workers(max_workers)
+            self._max_workers = max_workers
+            self._dispatch()
+
+    def _release(self, task):
+        # free the worker used by task
+        self._running -= 1
+        self._hostrunning[task.host] -= 1
+
+        if not self._hostrunning[task.host]:
+            del self._hostrunning[task.host]
+
+        self._scheduler.done(task)
+        self._unpark(task.host)
+
+    def _unpark(self, host):
+        # return to scheduler the tasks waiting for free slots of host
+        with self._lock:
+            parked = self._parked.get(host)
+
+            if parked is None:
+                return
+
+            limit = self._controller.host_limit(host)
+            free = len(parked) if limit is None else limit - self._hostrunning.get(host, 0)
+
+            while parked and free > 0:
+                task = parked.popleft()
+
+                # skip cancelled or restarted tasks
+                if task.state == QUEUED and task.future is None and task.ticket is None and \
+                        task.key in self._table:
+                    self._scheduler.push(task)
+                    free -= 1
+
+            if not parked:
+                del self._parked[host]
+
+            self._dispatch()
 
     def __enter__(self):
         return self
@@ -85,26 +416,39 @@ class DownloadQueueManager(object):
         return False
 
     @memoize_when_activated
-    def queueinfo(self):
+    def queueinfo(self, username=None, status=None, service=None, offset=0, limit=None):
+        """
+        Return the info of tasks in queue. The tasks can be filtered by username,
+        status (queued, running, retrying, coalesced) and service name, and paginated
+
+        :param offset: number of tasks to skip
+        :param limit: max number of tasks to return
+        """
         ret = []
 
-        for key in self._queue:
-            t = self._tasks_info[key]
+        with self._lock:
+            if username is None and status is None and service is None and \
+                    not offset and limit is None:
+                tasks = list(self._table)
+            else:
+                tasks = self._table.query(username, status, service, offset, limit)
+
+        for task in tasks:
+            t = task.info
             # dict in following order:
-            # uuid, username, url, progress, file size, running
+            # uuid, username, url, progress, file size, probing, running,
+            # attempts, time of next retry
             # dont use yield because don't know if generator is cachable
-            run = False
-
-            if key in self._tasks:
-                run = self._tasks[key].running()
-
             ret.append(dict(
-                id=key,
+                id=task.key,
                 username=t["username"],
                 url=t["url"],
-                progress=None,  # implement this
+                progress=task.progress.info(),
                 filesize=t["filesize"],
-                running=run
+                probing=task.probing,
+                running=task.state == RUNNING,
+                attempts=task.attempts,
+                retry_at=None if task.retry_at is None else time() + task.retry_at - monotonic()
             ))
 
         return ret
@@ -128,33 +472,112 @@ class DownloadQueueManager(object):
                 finally:
                     self.queueinfo.cache_deactivate(self)
 
-    """ def _sha1check(self, path, hash):
-        if isinstance(hash, str) and isinstance(path, str):        
-            with open(path, 'rb', buffering=0) as f:
-                return hashlib.sha1(f.readall()).hexdigest() == hash.lower()
-        else:
-            raise TypeError("'hash' and 'path' params should be a str")   """
+    def status(self):
+        """
+        Return the StatusSnapshot of queue: the generation and a tuple of
+        TaskStatus in order of queue. The snapshot is immutable and is
+        built only once per generation
+        >>> s = q.status()
+        >>> for task in s.tasks:
+        ...     print (task.url, task.state)
+        """
+        return self._status.snapshot()
+
+    def changes_since(self, generation):
+        """
+        Return the Changes of queue after generation (the TaskStatus of tasks
+        updated and the keys of tasks removed) and the current generation.
+        If reset is True the generation is too old, read status() again
+        >>> c = q.changes_since(s.generation)
+
+        :param generation: generation of last snapshot or changes read
+        """
+        return self._status.changes_since(generation)
+
+    def iter_tasks(self, username=None, status=None, service=None, limit=None, cursor=None):
+        """
+        Return a lazy iterator over the TaskStatus of tasks filtered, in order of
+        queue. Only the tasks that match are read (by indexes of user, service and status).
+        The cursor of iterator is the position of the last task returned
+        >>> it = q.iter_tasks(username="user1", limit=20)
+        >>> for task in it:
+        ...     print (task.url, task.state)
+        >>> it = q.iter_tasks(username="user1", limit=20, cursor=it.cursor)
+
+        :param username: only the tasks of user
+        :param status: only the tasks in status (queued, running, retrying)
+        :param service: only the tasks of service (name)
+        :param limit: max number of tasks, None for all
+        :param cursor: cursor of previous iterator, for continue after its last task
+        """
+        if cursor is not None and not isinstance(cursor, int):
+            raise TypeError("'cursor' param should be a int")
+
+        def fetch(after, count):
+            with self._lock:
+                tasks = self._table.scan(username, status, service, after, count)
+                return [(seq, self._status.get(task.key)) for seq, task in tasks]
 
-    def _completework(self, x, key):
-        if x.cancelled() or key in self._cancelled_task:
-            self._cancelled_task.remove(key)
+        return TaskIterator(fetch, limit, cursor)
+
+    def task_counts(self, username=None):
+        """
+        Return a dict of status -> number of tasks in queue
+
+        :param username: count only the tasks of user
+        """
+        with self._lock:
+            return self._table.counts(username)
+
+    def user_counts(self):
+        """
+        Return a dict of username -> dict of status -> number of tasks in queue
+        """
+        with self._lock:
+            return self._table.users()
+
+    def write_stats(self):
+        """
+        Return the WriteStats of write behind (None if is not used). If the
+        blocked_time grow the disk is slower than the network
+        """
+        return self._writer.stats() if self._writer is not None else None
+
+    def _completework(self, x, task):
+        key = task.key
+
+        with self._lock:
+            # callback of old execution (task was restarted)
+            if x is not task.future:
+                return
+
+            self._release(task)
+            self._dispatch()
+
+        complete = None
+
+        if x.cancelled() or task.state == CANCELLED:
             logger.info("task %s cancelled", key)
+
+            # the task can be testing its host (also if was cancelled before run)
+            self._retry.abort(task.host, key)
         else:
-            t = self._tasks_info[key]
-            complete = None
+            t = task.info
 
             try:
                 complete = x.result()
 
-                # sha1 comprobation
-                """ if complete and t.sha1:
-                    #files very long are very slow
-                    outputpath = path.join(self._directorySave % t.usernamemk, path.basename(t.url))
-                    if stat(output).st_size <= 500000000: #50MB
-                        complete = self._sha1check(outputpath, t.sha1) """
+                # the hashes are checked by the service while the file is downloaded
+                if complete and task.digest is not None and not task.digest.verified:
+                    logger.warning("task %s: service %s don't verify the hashes of file",
+                                   key, t["service"].name)
+
+                if self._controller is not None:
+                    self._reportcontroller(task, complete)
 
                 if complete:
                     logger.info("task %s completed", key)
+                    self._retry.success(task.host)
 
                     if callable(self._oncts):  # called if complete task
                         self._oncts('complete', (t["username"], t["url"]))
@@ -164,9 +587,23 @@ class DownloadQueueManager(object):
             if not complete:
                 e = x.exception()
 
-                if t["retrycount"] > 1 and self.restarttask(key):
-                    logger.info("task %s fail attempt %d with exception: %s", key, 
-                            t["retrycount"] + 1, e)
+                if e is not None and self._controller is not None:
+                    self._reportcontroller(task, False)
+
+                delay = self._retry.delay(task, e)
+
+                if delay is not None and t["retrycount"] > 1:
+                    with self._lock:
+                        t["retrycount"] -= 1
+                        self._table.move_to_end(key)  # move to right side
+                        self._status.move_to_end(key)
+                        self._delay(task, delay)
+
+                    if self._journal is not None:
+                        self._journal.update(key, retrycount=t["retrycount"])
+
+                    logger.info("task %s fail attempt %d with exception: %s (retry in %.1f seconds)",
+                            key, task.attempts, e, delay)
 
                     if callable(self._oncts):  # called if task was restarted
                         self._oncts('retry', (t["username"], t["url"]))
@@ -178,18 +615,100 @@ class DownloadQueueManager(object):
                     if callable(self._oncts):  # called if full fail task
                         self._oncts('fail', (t["username"], t["url"]))
 
-        try:
-            # remove all if task is complete or cannot retry
-            self._queue.remove(key)  # remove from queue of tasks
-            self._tasks_info.pop(key)  # remove from information list
-            self._tasks.pop(key)  # remove task from currents tasks
-            self._services.pop(key)  # remove from services running list
-        except Exception:
-            pass
+        # remove if task is complete or cannot retry
+        self._finish(task, complete)
+
+    def _finish(self, task, complete):
+        key = task.key
+
+        with self._lock:
+            self._table.remove(key)
+            self._status.remove(key)
+            task.service = None
+            task.probing = False
+
+        if self._journal is not None:
+            if task.state == CANCELLED:
+                self._journal.cancel(key)
+            elif complete:
+                self._journal.complete(key)
+            else:
+                self._journal.fail(key)
+
+        # wake up all waiters of this task
+        self._completion.finish(key)
+        self._settle(task, complete)
+
+    def _settle(self, task, complete):
+        # end the group of tasks led by task: the file downloaded is linked to
+        # the directories of the followers, or they are queued again if failed
+        with self._lock:
+            if task.group is None or self._leaders.get(task.group) is not task:
+                return
+
+            del self._leaders[task.group]
+            followers = self._followers.pop(task.group, [])
+
+            if not complete:
+                # the first follower dispatched take the place of leader
+                for follower in followers:
+                    self._admit(follower)
+
+                return
+
+        t = task.info
+        directory = path.join(self._directorySaveBase, t["username"])
+        name = t["service"].filename(t["url"])
+
+        for follower in followers:
+            with self._lock:
+                # cancelled or restarted while the leader was running
+                if follower.state != COALESCED:
+                    continue
+
+            f = follower.info
+            target = path.join(self._directorySaveBase, f["username"])
+
+            try:
+                if target != directory:
+                    makedirs(target, exist_ok=True)
+
+                    for n in t["service"].outputs(t["url"], directory, t):
+                        # the name of file of follower can be other (e.g. the url have fragment)
+                        method = link_file(path.join(directory, n),
+                                           path.join(target, f["service"].filename(f["url"]) if n == name else n))
+                        logger.debug("file %s of task %s shared with task %s (%s)", n, task.key, follower.key, method)
+            except OSError as e:
+                logger.warning("file of task %s can't be shared with task %s: %s", task.key, follower.key, e)
+
+                with self._lock:
+                    if follower.state == COALESCED:
+                        self._admit(follower)
+
+                continue
+
+            logger.info("task %s completed", follower.key)
+
+            if callable(self._oncts):
+                self._oncts('complete', (follower.info["username"], follower.info["url"]))
+
+            self._finish(follower, True)
+
+    def _reportcontroller(self, task, ok):
+        nbytes = 0
+
+        # the services that don't report progress
+        if ok and not task.progress.done:
+            try:
+                nbytes = int(task.info["filesize"] or 0)
+            except (TypeError, ValueError):
+                pass
+
+        self._controller.finished(task.host, monotonic() - task.started, bool(ok), nbytes)
 
     def canceltask(self, key):
         """
-        Cancel the task
+        Cancel the task. Return True if the task was cancelled
 
         :param key: uuid of task
         """
@@ -198,23 +717,56 @@ class DownloadQueueManager(object):
         if not isinstance(key, UUID):
             key = UUID(key)
 
-        try:
-            # not always the download service are started
-            if key in self._services:
-                # remove from services running list and cancel
-                self._services.pop(key).cancel()
-
-            self._cancelled_task.add(key)
+        with self._lock:
+            task = self._table.get(key)
 
-            # remove from tasks list and return if is cancellable
-            if self._tasks.pop(key).cancel():
-                self._queue.remove(key)  # remove from queue of tasks
-                self._tasks_info.pop(key)  # remove from information list
-                return True
-            else:
+            if task is None or task.state == CANCELLED:
                 return False
-        except:
-            return False
+
+            task.state = CANCELLED
+            self._touch(task)
+            future, service = task.future, task.service
+
+            # the task is waiting in scheduler
+            if future is None:
+                self._unfollow(task)
+                self._scheduler.discard(task)
+                self._table.remove(key)
+                self._status.remove(key)
+                task.probing = False
+
+        if future is None:
+            logger.info("task %s cancelled", key)
+
+            if self._journal is not None:
+                self._journal.cancel(key)
+
+            self._completion.finish(key)
+            self._settle(task, False)
+            return True
+
+        # if the task don't begin, the cancellation remove it from queue
+        if future.cancel():
+            return True
+
+        # not always the download service are started
+        if service is not None:
+            service.cancel()
+
+        # the task can be testing its host
+        self._retry.abort(task.host, key)
+
+        return True
+
+    def _unfollow(self, task):
+        # the task don't wait the file of other task
+        followers = self._followers.get(task.group)
+
+        if followers is not None and task in followers:
+            followers.remove(task)
+
+            if not followers:
+                del self._followers[task.group]
 
     def restarttask(self, key):
         """
@@ -228,66 +780,117 @@ class DownloadQueueManager(object):
         if not isinstance(key, UUID):
             key = UUID(key)
 
-        # if task don't contained in queue cannot restarted
-        if not key in self._queue:
-            return False
+        with self._lock:
+            task = self._table.get(key)
 
-        # if task are cancelled
-        if key in self._cancelled_task:
-            self._cancelled_task.remove(key)
-            return False
+            # if task don't contained in queue or are cancelled cannot restarted
+            if task is None or task.state == CANCELLED:
+                return False
 
-        try:
-            # if task is running stop
-            if key in self._tasks:
-                # if task cancelled cannot restart taks
-                if self._tasks[key].cancelled():
-                    return False
+            future = task.future
 
-                # if task is begin execution (is not completed and can be canceled)
-                if not self._tasks[key].done() and not self._tasks[key].cancel():
+            # if task is begin execution (is not completed and can be canceled)
+            if future is not None and not future.done():
+                # detach the execution for ignore its callback
+                task.future = None
+
+                if not future.cancel():
+                    task.future = future
                     return False
 
-                # wait end task
-                while not self._tasks[key].done():
-                    pass
+                self._release(task)
+                # the execution was dropped before run, it can be testing the host
+                self._retry.abort(task.host, key)
 
-            self._queue.remove(key)  # delete from left side
-            self._queue.append(key)  # insert at right
+            self._table.move_to_end(key)  # move to right side
+            self._status.move_to_end(key)
+            task.info["retrycount"] -= 1
+            self._unfollow(task)
+            self._admit(task)
 
-            self._tasks_info[key]["retrycount"] -= 1
+        if self._journal is not None:
+            self._journal.update(key, retrycount=task.info["retrycount"])
 
-            w = self._executor.submit(self._worker, key)
-            w.add_done_callback(lambda x: self._completework(x, key))
+        return True
 
-            # if task is running, set a task value
-            if not w.done():
-                self._tasks[key] = w
+    def waitall(self, timeout=None):
+        """
+        Wait while all tasks are completed. Return False if timeout expire
 
-            return True
-        except Exception:
-            return False
+        :param timeout: max seconds to wait, None for wait forever
+        """
+        return self._completion.waitall(timeout)
+
+    def wait_any(self, timeout=None):
+        """
+        Wait until any task of queue is completed (or cancelled) and return its key.
+        Return None if timeout expire or queue is empty
+
+        :param timeout: max seconds to wait, None for wait forever
+        """
+        return self._completion.wait_any(timeout=timeout)
 
-    def waitall(self):
-        while len(self._tasks) > 0:
-            pass
+    def as_completed(self, keys=None, timeout=None):
+        """
+        Iterator over the keys of tasks while they are completed (or cancelled)
+        >>> for key in q.as_completed():
+        ...     print (key)
+
+        :param keys: uuid of tasks to wait, by default all tasks in queue
+        :param timeout: max seconds to wait for all tasks. Raise TimeoutError
+        """
+        if keys is not None:
+            #for safe calls
+            keys = [k if isinstance(k, UUID) else UUID(k) for k in keys]
+
+        return self._completion.as_completed(keys, timeout)
 
     def shutdown(self, wait=True):
         """
         Shutdown the queue. After call this method 
         you cannot add task to queue
 
-        :param wait: wait while all tasks are completed
+        :param wait: wait while all tasks are completed. If False the tasks
+                    are cancelled, but they are kept in journal for recover them
         """
         if wait:
             self.waitall()
         else:
+            # the pending tasks are recovered at next start
+            if self._journal is not None:
+                self._journal.close()
+
+            self._table.close()
+
             # cancell all tasks
-            for key in self._queue:
+            with self._lock:
+                keys = [task.key for task in self._table]
+
+            for key in keys:
                 self.canceltask(key)
 
+        if self._controller is not None:
+            self._controller.stop()
+
+        self._retry.stop()
+
         # turn off worker
-        self._executor.shutdown(wait)
+        self._probes.shutdown(wait)
+
+        if self._probecache.path is not None:
+            self._probecache.save()
+
+        if self._hashcache.path is not None:
+            self._hashcache.save()
+        self._pool.shutdown(wait)
+
+        if self._writer is not None:
+            self._writer.close()
+
+        if self._journal is not None:
+            self._journal.close()
+
+        self._table.close()
 
     def savequeue(self, path):
         """
@@ -297,58 +900,225 @@ class DownloadQueueManager(object):
         """
         data = []
 
-        for key in self._queue:
-            t = self._tasks_info[key].copy()
+        with self._lock:
+            tasks = list(self._table)
+
+        for task in tasks:
+            t = task.info.copy()
             t["service"] = t["service"].name
             data.append(t)
 
         with open(path, "w") as f:
             f.write(dumps(data))
 
-    def loadqueue(self, path):
+    def loadqueue(self, path, verify=False):
         """
         Load queue save from json file and add to current queue
 
         :param path: path of the json to load queue info
+        :param verify: the tasks with hashes whose file already is downloaded with
+                    the hashes expected are completed without add them to queue (see verify_existing)
         """
         data = []
         with open(path, "r") as file:
             data = loads(file.read())
 
+        tasks = []
+
         for info in data:          
-            for service in DEFAULT_SERVICES:
-                if service.name == info["service"]:
-                    self._addservicetask(**info)
-                    break
+            service = self._registry.byname(info["service"])
 
-    def addtask(self, username, url, **kwargs):
-        """
-        Add download task to queue.
-        Warning: This call can block by 5 seconds for get size of file if this is don't specific.
+            if service is not None:
+                info["service"] = service
+                tasks.append(self._newtask(info))
 
-        :param username: used for identificate.
-        :param url: uri of resource to download.
-        :param service: download service to use (class)
-        :param sha1: sha1 for check if download is successful [Algorithm SHA1].
-        :param authuser: [opcional] used for resources protected with authentication service.
-        :param username: [opcional] used for resources protected with authentication service.
-        :param retrycount: - Used for restart download if fail.
+        if verify:
+            existing = set(self._existing(tasks))
+
+            for task in existing:
+                logger.info("task %s skipped, the file is already downloaded", task.key)
+
+                if callable(self._oncts):
+                    self._oncts('complete', (task.info["username"], task.info["url"]))
+
+            tasks = [task for task in tasks if task not in existing]
+
+        if tasks:
+            self._inserttasks(tasks)
+
+    def verify_existing(self, keys=None, max_workers=None):
         """
-        for i in [username, url, kwargs.get("sha1"), kwargs.get("authuser"), kwargs.get("authpasswd")]:
+        Complete the tasks with hashes (not started yet) whose file already
+        is in the directory of user with the hashes expected, without download
+        it. The files are hashed in parallel by a pool of processes and the
+        hashes are cached (see hash_cache), a file that did not change is not
+        hashed again. Return the keys of tasks completed. As the processes
+        are not forked the main script must be guarded by `if __name__ == "__main__":`
+
+        :param keys: uuid of tasks to check, by default all tasks in queue
+        :param max_workers: max processes that hash the files (number of cpus by default)
+        """
+        with self._lock:
+            if keys is None:
+                tasks = list(self._table)
+            else:
+                tasks = [self._table.get(k if isinstance(k, UUID) else UUID(k)) for k in keys]
+
+            tasks = [task for task in tasks if task is not None and task.future is None and
+                     task.state in (QUEUED, RETRYING)]
+
+        completed = []
+
+        for task in self._existing(tasks, max_workers):
+            with self._lock:
+                # the task was started or removed while the files were hashed
+                if task.future is not None or task.state not in (QUEUED, RETRYING) or \
+                        task.key not in self._table:
+                    continue
+
+                self._scheduler.discard(task)
+                task.retry_at = None
+
+            logger.info("task %s completed, the file is already downloaded", task.key)
+
+            if callable(self._oncts):
+                self._oncts('complete', (task.info["username"], task.info["url"]))
+
+            self._finish(task, True)
+            completed.append(task.key)
+
+        return completed
+
+    def _existing(self, tasks, max_workers=None):
+        # return the tasks whose file is in directory of user with the hashes expected
+        candidates = []
+
+        for task in tasks:
+            t = task.info
+            name = t["service"].filename(t["url"]) if task.digest is not None else None
+
+            if name:
+                candidates.append((task, path.join(self._directorySaveBase, t["username"], name)))
+
+        if not candidates:
+            return []
+
+        results = verify_files([(file, task.digest.expected) for task, file in candidates],
+                               cache=self._hashcache, max_workers=max_workers)
+
+        return [task for (task, _), ok in zip(candidates, results) if ok]
+
+    def _checktask(self, username, url, kwargs):
+        for i in [username, url, kwargs.get("authuser"), kwargs.get("authpasswd")]:
             if i and not isinstance(i, str):
                 raise TypeError(
-                    "username, url, sha1, authuser, authpasswd params should be a str")
+                    "username, url, authuser, authpasswd params should be a str")
+
+        for i in HASH_ALGORITHMS:
+            value = kwargs.get(i)
+
+            if value and (not isinstance(value, str) or len(value) != Digest.size(i) * 2 or
+                          any(c not in "0123456789abcdefABCDEF" for c in value)):
+                raise TypeError("'%s' param should be a hex digest of %d characters" % (i, Digest.size(i) * 2))
 
         if not isinstance(kwargs.get("retrycount", 0), int):
             raise TypeError("'retrycount' param should be a int")
 
+        if not isinstance(kwargs.get("priority", 0), int):
+            raise TypeError("'priority' param should be a int")
+
+        for i in ["segments", "min_segment_size"]:
+            if not isinstance(kwargs.get(i, 1), int) or kwargs.get(i, 1) <= 0:
+                raise TypeError("'%s' param should be a int greater than 0" % i)
+
+        fsync = kwargs.get("fsync", "save")
+        if fsync not in FSYNC_POLICIES and not (isinstance(fsync, int) and fsync > 0):
+            raise TypeError("'fsync' param should be %s or a int greater than 0" % ", ".join(FSYNC_POLICIES))
+
         if "service" in kwargs and\
             issubclass(kwargs["service"], DownloaderService) and\
             not kwargs["service"].supported(url):
-                raise Exception("this service cannot support for this url")            
+                raise Exception("this service cannot support for this url")
+
+    def addtask(self, username, url, **kwargs):
+        """
+        Add download task to queue and return its key.
+        This call don't block, if the size of file is don't specific it is
+        resolved in background (queueinfo show the task as probing until then).
+
+        :param username: used for identificate.
+        :param url: uri of resource to download.
+        :param service: download service to use (class)
+        :param sha1: sha1 for check if download is successful [Algorithm SHA1].
+        :param sha256, md5, blake2b: hex digest of file with these algorithms. The hashes
+                    are computed while the file is downloaded and checked at end (the
+                    download fail and is retried if they don't match).
+        :param authuser: [opcional] used for resources protected with authentication service.
+        :param username: [opcional] used for resources protected with authentication service.
+        :param retrycount: - Used for restart download if fail.
+        :param priority: tasks with greater priority are executed first (default 0).
+        :param engine: [DefaultService] "native" (default) or "wget".
+        :param segments: [DefaultService] max connections used for download the file by ranges.
+        :param min_segment_size: [DefaultService] min bytes of each range (default 4 MiB).
+        :param fsync: when the file is flushed to disk: "save" (default, before each save of
+                    the ranges downloaded), "complete" (at end), "never" or each that number of bytes.
+        """
+        self._checktask(username, url, kwargs)
 
         return self._addservicetask(
                 username=username,
                 url=url,                
                 **kwargs
-            )    
\ No newline at end of file
+            )
+
+    def addtasks(self, specs, stream=False, batch_size=1000):
+        """
+        Add many download tasks to queue and return their keys in the same order.
+        The specs are consumed lazily (can be a generator) and the tasks are admitted
+        to the scheduler by batches, the sizes are probed in background.
+        >>> keys = q.addtasks({"username": "user1", "url": url} for url in urls)
+
+        :param specs: iterable of dicts with the params of addtask
+                    or (username, url) tuples
+        :param stream: return an iterator of keys instead of a list. The tasks
+                    are added while the iterator is consumed
+        :param batch_size: number of tasks admitted at once
+        """
+        keys = self._addtasks(specs, batch_size)
+        return keys if stream else list(keys)
+
+    def _addtasks(self, specs, batch_size):
+        batch = []
+
+        for spec in specs:
+            if isinstance(spec, dict):
+                kwargs = dict(spec)
+                username, url = kwargs.pop("username"), kwargs.pop("url")
+            else:
+                (username, url), kwargs = spec, {}
+
+            self._checktask(username, url, kwargs)
+            kwargs["username"], kwargs["url"] = username, url
+            batch.append(kwargs)
+
+            if len(batch) >= batch_size:
+                for key in self._addbatch(batch):
+                    yield key
+
+                batch = []
+
+        if batch:
+            for key in self._addbatch(batch):
+                yield key
+
+    def _addbatch(self, batch):
+        # classify all urls without service at once
+        pending = [kwargs for kwargs in batch if kwargs.get("service") is None]
+        services = self._registry.classify([kwargs["url"] for kwargs in pending])
+
+        for kwargs, service in zip(pending, services):
+            kwargs["service"] = service
+
+        tasks = [self._newtask(kwargs) for kwargs in batch]
+        self._inserttasks(tasks)
+        return [task.key for task in tasks]
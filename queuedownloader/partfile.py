@@ -0,0 +1,476 @@
+from threading import Lock
+from bisect import bisect_right
+from json import dumps, loads
+from time import monotonic
+from os import path, fsync, replace
+from shutil import disk_usage
+import errno
+import os
+
+import logging
+
+from .services.errors import DiskSpaceError, IntegrityError
+
+logger = logging.getLogger("queuedownloader")
+
+PART_SUFFIX = ".part"
+SIDECAR_SUFFIX = ".part.json"
+
+# errors of posix_fallocate when the file system don't support it
+UNSUPPORTED_ERRORS = (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS)
+SPACE_ERRORS = (errno.ENOSPC, getattr(errno, "EDQUOT", errno.ENOSPC))
+
+# fsync policies of part files (or a int, fsync each that number of bytes)
+FSYNC_NEVER = "never"
+FSYNC_COMPLETE = "complete"  # only when the download is complete
+FSYNC_SAVE = "save"  # before each save of sidecar
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_COMPLETE, FSYNC_SAVE)
+
+
+def _pwrite(f, lock, data, offset):
+    # positional write, the threads share the file
+    if hasattr(os, "pwrite"):
+        while data:
+            n = os.pwrite(f.fileno(), data, offset)
+            data, offset = data[n:], offset + n
+    else:
+        with lock:
+            f.seek(offset)
+            f.write(data)
+
+
+def _pread(f, lock, size, offset):
+    # positional read, the threads share the file
+    if hasattr(os, "pread"):
+        return os.pread(f.fileno(), size, offset)
+
+    with lock:
+        f.seek(offset)
+        return f.read(size)
+
+
+class PartFile(object):
+    """
+    File in download. The data is written in <output>.part and the ranges
+    completed with the validator of file (size and etag) are saved in the
+    sidecar <output>.part.json, so the download can be resumed only from
+    the bytes missing after a retry, a restart or a crash. When the file is
+    complete commit() rename it to output.
+    The sidecar is saved each sync_interval seconds, by default after the
+    fsync of the data so it never have ranges that are not in disk (see
+    the param fsync).
+    When the size is known open(size) check the free space of disk and
+    reserve the blocks of file (fail before download if the disk is full
+    and the file is not fragmented), the ranges are written in any order.
+    >>> part = PartFile("file.zip")
+    >>> part.validate(size, etag)  # False if the file changed (it start again)
+    >>> part.open(); part.write(part.offset(), data)
+    >>> part.commit()
+
+    With a Digest the bytes are hashed in order while are written (the bytes
+    written after a range missing are read again from file when it is
+    completed) and commit() verify the file.
+
+    :param output: path of the file downloaded
+    :param sync_interval: seconds between saves of sidecar while is written
+    :param preallocate: reserve the blocks of file with posix_fallocate,
+                if False (or not supported) the file is sparse
+    :param fsync: when the data is flushed to disk, FSYNC_SAVE (before each
+                save of sidecar), FSYNC_COMPLETE (only at end, a crash of
+                system can lose data of the ranges saved), FSYNC_NEVER or
+                a number of bytes (fsync and save the sidecar each that bytes
+                written and before each save)
+    :param digest: Digest of file (see digest.Digest), None for don't hash it
+    :param adopt: an output file without part file is taken as the data at start
+                of file (only for the downloads of wget --continue, nothing check
+                that it is the same file), else it is replaced at end
+    """
+
+    read_size = 1024 * 1024  # bytes read at once for hash the data written before
+
+    def __init__(self, output, sync_interval=1.0, preallocate=True, fsync=FSYNC_SAVE, digest=None,
+                 adopt=False):
+        if fsync not in FSYNC_POLICIES and not (isinstance(fsync, int) and fsync > 0):
+            raise ValueError("invalid fsync policy %r" % (fsync,))
+
+        self.output = output
+        self.path = output + PART_SUFFIX
+        self.sidecar = output + SIDECAR_SUFFIX
+        self.sync_interval = sync_interval
+        self.preallocate = preallocate
+        self.fsync = fsync
+        self.digest = digest
+        self.adopt = adopt
+
+        self.size = None
+        self.etag = None
+        self.extra = {}  # state of service saved with the ranges
+        self.ranges = []  # sorted list of [start, end) completed
+
+        self._file = None
+        self._lock = Lock()
+        self._io = Lock()  # saves of sidecar
+        self._saved = monotonic()
+        self._unsynced = 0  # bytes written after the last save
+        self._dirty = False
+        self._load()
+
+        # the digest was computed with data that is not in file
+        if digest is not None and digest.offset > self.offset():
+            digest.reset()
+
+    def _load(self):
+        if path.exists(self.sidecar) and path.exists(self.path):
+            try:
+                with open(self.sidecar, "r") as f:
+                    state = loads(f.read())
+
+                length = path.getsize(self.path)
+                self.size = state.get("size")
+                self.etag = state.get("etag")
+                self.extra = state.get("extra") or {}
+                self.ranges = [[s, min(e, length)] for s, e in state.get("ranges", ()) if s < min(e, length)]
+            except (ValueError, TypeError, AttributeError, OSError) as e:
+                logger.warning("Invalid sidecar %s, download start again: %s" % (self.sidecar, e))
+                self.reset()
+        elif self.adopt and path.exists(self.output) and not path.exists(self.path):
+            # file of a download without part file (e.g. wget --continue),
+            # the data at start is valid
+            replace(self.output, self.path)
+            length = path.getsize(self.path)
+            self.ranges = [[0, length]] if length else []
+        else:
+            self.reset()
+
+    def offset(self):
+        """
+        Return the bytes completed from start of file
+        """
+        with self._lock:
+            return self.ranges[0][1] if self.ranges and self.ranges[0][0] == 0 else 0
+
+    def done(self):
+        """
+        Return the number of bytes completed
+        """
+        with self._lock:
+            return sum(e - s for s, e in self.ranges)
+
+    def missing(self, size=None):
+        """
+        Return the ranges [start, end) not completed of file of size bytes
+        """
+        size = self.size if size is None else size
+        missing = []
+        pos = 0
+
+        with self._lock:
+            for s, e in self.ranges:
+                if s > pos:
+                    missing.append((pos, min(s, size)))
+
+                pos = max(pos, e)
+
+        if pos < size:
+            missing.append((pos, size))
+
+        return [(s, e) for s, e in missing if s < e]
+
+    def validate(self, size=None, etag=None):
+        """
+        Check that the file in server is the same that was downloaded
+        before, if it changed the ranges are discarded. Save the validator
+        for next resumes. Return False if the data downloaded was discarded
+        """
+        ok = (self.size is None or size is None or self.size == size) and \
+            (not self.etag or not etag or self.etag == etag)
+
+        if not ok:
+            logger.info("File %s changed in server, download start again" % self.output)
+            self.reset()
+
+        if size is not None:
+            self.size = size
+        if etag:
+            self.etag = etag
+
+        return ok
+
+    def reset(self):
+        """
+        Discard the data downloaded
+        """
+        with self._lock:
+            self.ranges = []
+            self.extra = {}
+            self.size = self.etag = None
+            self._dirty = True
+
+            if self.digest is not None:
+                self.digest.reset()
+
+            if self._file is not None:
+                self._file.truncate(0)
+
+    def truncate(self, offset):
+        """
+        Discard the data after offset
+        """
+        with self._lock:
+            self.ranges = [[s, min(e, offset)] for s, e in self.ranges if s < offset]
+            self._dirty = True
+
+            # the hashes can't go back, they are computed again from start
+            if self.digest is not None and self.digest.offset > offset:
+                self.digest.reset()
+
+    def open(self, size=None):
+        """
+        Open the part file for write, if size is given the space of file
+        is reserved (see reserve)
+        """
+        if self._file is None:
+            self._file = open(self.path, "r+b" if path.exists(self.path) else "w+b")
+
+            if not self.ranges:
+                self._file.truncate(0)
+
+        if size is not None:
+            self.reserve(size)
+
+        return self._file
+
+    def reserve(self, size):
+        """
+        Extend the part file to size bytes. If preallocate is True the
+        blocks are allocated in disk, else the file is sparse (the ranges
+        not written don't use space). Raise DiskSpaceError if the disk
+        don't have space for the file
+        """
+        self.check_space(size)
+        fd = self._file.fileno()
+
+        if self.preallocate and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, size)
+                return
+            except OSError as e:
+                if e.errno in SPACE_ERRORS:
+                    raise DiskSpaceError("Not enough space in disk for %s." % self.output)
+                if e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+
+        if os.fstat(fd).st_size < size:
+            self._file.truncate(size)
+
+    def check_space(self, size):
+        """
+        Raise DiskSpaceError if the free space of disk is less than the
+        bytes of file of size bytes that are not allocated yet
+        """
+        try:
+            st = os.stat(self.path)
+            allocated = st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+        except FileNotFoundError:
+            allocated = 0
+
+        needed = size - allocated
+        free = disk_usage(path.dirname(path.abspath(self.path))).free
+
+        if needed > free:
+            raise DiskSpaceError("Not enough space in disk for %s: %d bytes needed, %d available." %
+                                 (self.output, needed, free))
+
+    def write(self, offset, data, extra=None):
+        """
+        Write data at offset and mark it as completed. It can be called
+        by several threads. extra update the state of service (saved with
+        the ranges)
+        """
+        _pwrite(self._file, self._lock, data, offset)
+        self.add(offset, offset + len(data), extra)
+
+        if self.digest is not None:
+            self.hash(offset, data)
+
+    def hash(self, offset=None, data=None):
+        """
+        Update the digest with the bytes completed from start of file that
+        are not hashed. data (written at offset) is hashed without read it
+        from file, the other bytes are read
+        """
+        digest = self.digest
+
+        with digest.lock:
+            end = self.offset()
+
+            while digest.offset < end:
+                pos = digest.offset
+
+                if data is not None and offset <= pos < offset + len(data):
+                    chunk = data[pos - offset:min(end, offset + len(data)) - offset]
+                else:
+                    chunk = _pread(self._file, self._lock, min(end - pos, self.read_size), pos)
+
+                    if not chunk:
+                        break
+
+                digest.update(chunk)
+
+    def add(self, start, end, extra=None):
+        """
+        Mark the range [start, end) as completed
+        """
+        with self._lock:
+            ranges = self.ranges
+
+            # common case, the data is appended after a range
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            elif start < end:
+                i = bisect_right(ranges, [start, end])
+
+                # merge with the previous and next ranges
+                if i > 0 and ranges[i - 1][1] >= start:
+                    i -= 1
+                    ranges[i][1] = max(ranges[i][1], end)
+                else:
+                    ranges.insert(i, [start, end])
+
+                while i + 1 < len(ranges) and ranges[i + 1][0] <= ranges[i][1]:
+                    ranges[i][1] = max(ranges[i][1], ranges.pop(i + 1)[1])
+
+            if extra:
+                self.extra.update(extra)
+
+            self._dirty = True
+            self._unsynced += end - start
+            save = monotonic() - self._saved >= self.sync_interval or \
+                (isinstance(self.fsync, int) and self._unsynced >= self.fsync)
+
+            # only a thread save it
+            if save:
+                self._saved = monotonic()
+                self._unsynced = 0
+
+        if save:
+            self.save()
+
+    def save(self):
+        """
+        Save the sidecar (after the fsync of data written if the policy is
+        FSYNC_SAVE or a number of bytes)
+        """
+        with self._io:
+            with self._lock:
+                if not self._dirty:
+                    return
+
+                # the ranges are copied before the fsync, so all of them are in disk
+                state = {"size": self.size, "etag": self.etag, "extra": dict(self.extra),
+                         "ranges": [list(r) for r in self.ranges]}
+                self._saved = monotonic()
+                self._unsynced = 0
+                self._dirty = False
+
+            if self._file is not None and self.fsync not in (FSYNC_NEVER, FSYNC_COMPLETE):
+                self._file.flush()
+                fsync(self._file.fileno())
+
+            tmp = self.sidecar + ".tmp"
+
+            with open(tmp, "w") as f:
+                f.write(dumps(state))
+
+            replace(tmp, self.sidecar)
+
+    def close(self):
+        """
+        Close the part file and save the ranges completed for resume it
+        """
+        if self._file is None and not self._dirty:
+            return
+
+        if path.exists(self.path) or self._file is not None:
+            self.save()
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def commit(self):
+        """
+        Rename the part file to output (the download is complete). With a
+        digest the file is verified before, if the hashes don't match the
+        part file is removed and IntegrityError is raised
+        """
+        if self.digest is not None:
+            self.verify()
+
+        if self._file is None and not path.exists(self.path):
+            # empty file never opened
+            open(self.path, "wb").close()
+
+        if self.fsync != FSYNC_NEVER:
+            # the services can close the file before commit it
+            if self._file is None:
+                self._file = open(self.path, "r+b")
+
+            self._file.flush()
+            fsync(self._file.fileno())
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        replace(self.path, self.output)
+        self._dirty = False
+
+        try:
+            os.remove(self.sidecar)
+        except FileNotFoundError:
+            pass
+
+    def verify(self):
+        """
+        Hash the bytes of file not hashed yet (written by other process,
+        e.g. wget, or downloaded before a restart) and check the digest
+        """
+        opened = self._file is None and path.exists(self.path)
+
+        if opened:
+            self._file = open(self.path, "rb")
+
+        try:
+            if self._file is not None:
+                self.hash()
+
+            self.digest.verify(self.offset())
+        except IntegrityError:
+            logger.warning("File %s is corrupt, download start again" % self.output)
+            self.discard()
+            raise
+        finally:
+            if opened and self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def discard(self):
+        """
+        Remove the part file and its sidecar
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        for p in (self.path, self.sidecar):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+        self.ranges = []
+        self._dirty = False
+
+        if self.digest is not None:
+            self.digest.reset()
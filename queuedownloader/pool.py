@@ -0,0 +1,138 @@
+from concurrent.futures import Future
+from threading import Thread, Lock, current_thread
+from queue import SimpleQueue
+from itertools import count
+
+
+class WorkerPool(object):
+    """
+    Pool of worker threads whose size can be changed at runtime.
+    When the pool grow the new workers are started immediately, when shrink
+    the workers are retired when they end their current work (nothing is
+    cancelled).
+
+    :param max_workers: number of worker threads
+    :param name: prefix of the name of threads
+    """
+
+    def __init__(self, max_workers=4, name="queuedownloader"):
+        if max_workers <= 0:
+            raise ValueError("'max_workers' param should be greater than 0")
+
+        self._queue = SimpleQueue()
+        self._lock = Lock()
+        self._workers = set()
+        self._max_workers = max_workers
+        self._shutdown = False
+        self._name = name
+        self._counter = count()
+
+        self._adjust()
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    def __len__(self):
+        """
+        Number of alive workers (can be greater than max_workers while
+        the retired workers end their work)
+        """
+        return len(self._workers)
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot submit work after shutdown")
+
+            self._queue.put((future, fn, args, kwargs))
+
+        return future
+
+    def set_max_workers(self, max_workers):
+        """
+        Change the number of workers
+        """
+        if max_workers <= 0:
+            raise ValueError("'max_workers' param should be greater than 0")
+
+        with self._lock:
+            self._max_workers = max_workers
+            self._adjust()
+
+    def _adjust(self):
+        # start the missing workers or wake up the idle ones for retire
+        if self._shutdown:
+            return
+
+        excess = len(self._workers) - self._max_workers
+
+        for _ in range(-excess):
+            t = Thread(target=self._run, daemon=True,
+                    name="%s-%d" % (self._name, next(self._counter)))
+            self._workers.add(t)
+            t.start()
+
+        for _ in range(excess):
+            self._queue.put(None)
+
+    def _retire(self, wakeup):
+        with self._lock:
+            if (self._shutdown and wakeup) or len(self._workers) > self._max_workers:
+                self._workers.discard(current_thread())
+                return True
+
+            return False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+
+            if item is None:
+                if self._retire(True):
+                    return
+                continue
+
+            future, fn, args, kwargs = item
+            del item
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+
+            del future, fn, args, kwargs
+
+            if self._retire(False):
+                return
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """
+        Stop the workers after they end the submitted works
+
+        :param wait: wait until all workers exit
+        :param cancel_futures: cancel the works that are not started
+        """
+        with self._lock:
+            self._shutdown = True
+            workers = list(self._workers)
+
+            if cancel_futures:
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+
+                    if item is not None:
+                        item[0].cancel()
+
+            for _ in workers:
+                self._queue.put(None)
+
+        if wait:
+            for t in workers:
+                if t is not current_thread():
+                    t.join()
@@ -0,0 +1,91 @@
+from threading import Thread, Condition, Lock
+from collections import deque
+
+import logging
+
+logger = logging.getLogger("queuedownloader")
+
+
+class ProbePool(object):
+    """
+    Resolve in background the metadata (file size) of the tasks using a
+    bounded number of threads, so add a task never block by the network.
+    The pending tasks are kept in a deque (only a reference by task) and
+    the probe threads take them in order.
+
+    :param callback: called as callback(task, info) when the probe of a
+                    task end. The info is a ProbeInfo or None if cannot be resolved
+    :param max_workers: max probes running at same time
+    :param cache: ProbeCache used for avoid probe the same url again
+    """
+
+    def __init__(self, callback, max_workers=4, cache=None):
+        if max_workers <= 0:
+            raise ValueError("'max_workers' param should be greater than 0")
+
+        self._callback = callback
+        self._cache = cache
+        self._pending = deque()
+        self._cond = Condition(Lock())
+        self._shutdown = False
+        self._threads = [Thread(target=self._run, daemon=True,
+                                name="queuedownloader-probe-%d" % i)
+                         for i in range(max_workers)]
+
+        for t in self._threads:
+            t.start()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, task):
+        """
+        Probe the task. Skipped if task.probing is False when its turn come
+        """
+        with self._cond:
+            self._pending.append(task)
+            self._cond.notify()
+
+    def submit_many(self, tasks):
+        with self._cond:
+            self._pending.extend(tasks)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._shutdown)
+
+                if self._shutdown:
+                    return
+
+                task = self._pending.popleft()
+
+            # the task end or is cancelled before the probe
+            if not task.probing:
+                continue
+
+            self._callback(task, self._probe(task))
+
+    def _probe(self, task):
+        t = task.info
+
+        try:
+            if self._cache is not None:
+                return self._cache.probe(t["service"], t["url"], t.get("authuser"), t.get("authpasswd"))
+
+            return t["service"].probe(t["url"], t.get("authuser"), t.get("authpasswd"))
+        except Exception as e:
+            logger.debug("cannot get file size of %s: %s", t["url"], e)
+            return None
+
+    def shutdown(self, wait=True):
+        # the pending probes are useless after shutdown
+        with self._cond:
+            self._shutdown = True
+            self._pending.clear()
+            self._cond.notify_all()
+
+        if wait:
+            for t in self._threads:
+                t.join()
@@ -0,0 +1,103 @@
+from collections import namedtuple
+from time import monotonic
+
+# rate and smoothed_rate in bytes/second, eta in seconds (None if unknown)
+ProgressInfo = namedtuple("ProgressInfo", ["done", "total", "fraction", "rate", "smoothed_rate", "eta"])
+
+
+class Progress(object):
+    """
+    Progress of a download. It has only one writer (the thread that
+    download) that update the counters without locks, the readers
+    take a ProgressInfo with info(). The rate is measured by intervals
+    and smoothed with an exponential moving average.
+
+    :param total: bytes to download, None if unknown
+    :param interval: seconds of each measure of rate
+    :param alpha: weight of last measure in smoothed rate
+    :param callback: called as callback(nbytes) with the bytes transferred
+    """
+    __slots__ = ("done", "total", "rate", "smoothed_rate", "interval", "alpha", "callback",
+                 "_time", "_done")
+
+    def __init__(self, total=None, interval=1.0, alpha=0.3, callback=None):
+        self.done = 0
+        self.total = total
+        self.rate = 0.0
+        self.smoothed_rate = None
+        self.interval = interval
+        self.alpha = alpha
+        self.callback = callback
+        self._time = monotonic()
+        self._done = 0
+
+    def reset(self, done=0, total=None):
+        """
+        Start a new transfer (e.g. a retry) with done bytes already downloaded
+        """
+        self.done = self._done = done
+
+        if total is not None:
+            self.total = total
+
+        self._time = monotonic()
+
+    def add(self, nbytes):
+        """
+        Report nbytes downloaded
+        """
+        self.done += nbytes
+
+        if self.callback is not None:
+            self.callback(nbytes)
+
+        now = monotonic()
+        elapsed = now - self._time
+
+        if elapsed >= self.interval:
+            self._measure(now, elapsed)
+
+    def update(self, done, total=None):
+        """
+        Report the bytes downloaded until now (for the services that only
+        know the total)
+        """
+        if total is not None:
+            self.total = total
+
+        if done > self.done:
+            self.add(done - self.done)
+
+    def _measure(self, now, elapsed):
+        rate = (self.done - self._done) / elapsed
+
+        if self.smoothed_rate is None:
+            self.smoothed_rate = rate
+        else:
+            self.smoothed_rate += self.alpha * (rate - self.smoothed_rate)
+
+        self.rate = rate
+        self._time, self._done = now, self.done
+
+    def info(self):
+        """
+        Return the current ProgressInfo
+        """
+        done, total = self.done, self.total
+        rate, smoothed = self.rate, self.smoothed_rate
+        elapsed = monotonic() - self._time
+
+        # the first measure is not done or the writer is stalled
+        if (smoothed is None and elapsed > 0) or elapsed >= 2 * self.interval:
+            rate = (done - self._done) / elapsed
+            smoothed = rate if smoothed is None else smoothed + self.alpha * (rate - smoothed)
+
+        fraction = eta = None
+
+        if total:
+            fraction = min(1.0, done / total)
+
+            if smoothed:
+                eta = max(0.0, (total - done) / smoothed)
+
+        return ProgressInfo(done, total, fraction, rate, smoothed, eta)
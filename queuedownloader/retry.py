@@ -0,0 +1,292 @@
+from threading import Thread, Condition, Lock
+from heapq import heappush, heappop
+from itertools import count
+from time import monotonic
+import random
+
+import logging
+
+from .services.errors import NetworkError, AuthError, HTTPError, DiskSpaceError
+from .partfile import SPACE_ERRORS
+
+logger = logging.getLogger("queuedownloader")
+
+# classes of errors
+NETWORK = "network"
+AUTH = "auth"
+CLIENT = "client"  # 4xx responses
+SERVER = "server"  # 5xx or unknown responses
+DISK = "disk"  # disk full
+OTHER = "other"
+
+# errors that tell that the host is unhealthy
+HOST_ERRORS = (NETWORK, SERVER)
+
+# 4xx responses that can be retried (request timeout, too many requests)
+RETRIABLE_STATUS = (408, 429)
+
+
+def classify(e):
+    """
+    Return the class of error of exception
+    """
+    if isinstance(e, AuthError):
+        return AUTH
+
+    if isinstance(e, DiskSpaceError) or (isinstance(e, OSError) and e.errno in SPACE_ERRORS):
+        return DISK
+
+    # requests.HTTPError keep the status in response
+    status = getattr(e, "status", None) or \
+        getattr(getattr(e, "response", None), "status_code", None)
+
+    if isinstance(status, int):
+        if status in (401, 407):
+            return AUTH
+        if 400 <= status < 500 and status not in RETRIABLE_STATUS:
+            return CLIENT
+        return SERVER
+
+    if isinstance(e, HTTPError):
+        return SERVER
+
+    if isinstance(e, (NetworkError, ConnectionError, TimeoutError)):
+        return NETWORK
+
+    # requests and socket errors are OSError, but not the local file errors
+    if isinstance(e, OSError) and not isinstance(e, (FileNotFoundError, PermissionError,
+                                                       IsADirectoryError, NotADirectoryError)):
+        return NETWORK
+
+    return OTHER
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with jitter. The delay of attempt n is
+    min(max_delay, base * factor ** (n - 1)) reduced randomly until a jitter fraction.
+
+    :param retry: False for never retry
+    :param max_attempts: max attempts (None for use only the retrycount of task)
+    """
+
+    def __init__(self, base=1.0, factor=2.0, max_delay=300.0, jitter=0.5,
+                 max_attempts=None, retry=True):
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.retry = retry
+
+    def delay(self, attempt):
+        """
+        Seconds to wait before retry after the failed attempt (starting in 1)
+        or None if don't should be retried
+        """
+        if not self.retry or (self.max_attempts is not None and attempt >= self.max_attempts):
+            return None
+
+        delay = min(self.max_delay, self.base * self.factor ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+
+DEFAULT_POLICIES = {
+    NETWORK: RetryPolicy(base=2.0),
+    SERVER: RetryPolicy(base=5.0, max_delay=600.0),
+    AUTH: RetryPolicy(retry=False),
+    CLIENT: RetryPolicy(retry=False),
+    # wait that the space is freed
+    DISK: RetryPolicy(base=60.0, max_delay=600.0),
+    OTHER: RetryPolicy(base=1.0),
+}
+
+
+class _Breaker(object):
+    __slots__ = ("failures", "opened", "trial")
+
+    def __init__(self):
+        self.failures = 0  # consecutive failures
+        self.opened = None  # time when the breaker was opened
+        self.trial = None  # key of the task that is testing the host (half-open)
+
+
+class RetryScheduler(object):
+    """
+    Delay the retries of failed tasks with a heap of timers served by one
+    thread. The delay depend of the class of error (see RetryPolicy) and
+    of the circuit breaker of host: after failure_threshold consecutive
+    network/server errors the host is open (no task is started) during
+    reset_timeout seconds, then a task test the host (half-open).
+
+    :param policies: dict of error class -> RetryPolicy (merged with defaults)
+    :param failure_threshold: consecutive failures that open the breaker of host
+    :param reset_timeout: seconds that the breaker of host is open
+    :param recheck: seconds that wait the tasks of a host in test
+    """
+
+    def __init__(self, policies=None, failure_threshold=5, reset_timeout=60.0, recheck=1.0):
+        self.policies = dict(DEFAULT_POLICIES)
+        self.policies.update(policies or {})
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.recheck = recheck
+
+        self._breakers = {}  # host -> _Breaker
+        self._lock = Lock()
+        self._cond = Condition(Lock())
+        self._heap = []  # (due, order, task)
+        self._order = count()
+        self._callback = None
+        self._stop = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def start(self, callback):
+        """
+        Start the timer thread. callback(task, due) is called when the delay end
+        """
+        self._callback = callback
+        self._thread = Thread(target=self._run, daemon=True, name="queuedownloader-retry")
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._heap = []
+            self._cond.notify_all()
+
+    def delay(self, task, e):
+        """
+        Return the seconds to wait before retry the failed task, None if
+        don't should be retried
+        """
+        kind = classify(e)
+
+        if kind in HOST_ERRORS:
+            self.failure(task.host)
+        else:
+            # the host respond
+            self.success(task.host)
+
+        delay = self.policies.get(kind, self.policies[OTHER]).delay(task.attempts)
+
+        if delay is not None:
+            # wait until the host can be tested again
+            delay = max(delay, self.blocked(task.host, reserve=False))
+
+        return delay
+
+    def schedule(self, task, due):
+        """
+        Call the callback with the task at time due (monotonic)
+        """
+        with self._cond:
+            heappush(self._heap, (due, next(self._order), task))
+
+            # wake up the timer if is the first
+            if self._heap[0][2] is task:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    now = monotonic()
+
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+                if self._stop:
+                    return
+
+                due, _, task = heappop(self._heap)
+
+            try:
+                self._callback(task, due)
+            except Exception as e:
+                logger.exception("retry of task %s fail: %s", task.key, e)
+
+    def blocked(self, host, reserve=True, owner=True):
+        """
+        Seconds that the tasks of host should wait (0 if can start).
+        If the breaker of host is half-open and reserve is True, the first
+        caller is allowed to test the host (owner is the key of its task,
+        see abort)
+        """
+        if not host:
+            return 0
+
+        with self._lock:
+            b = self._breakers.get(host)
+
+            if b is None or b.opened is None:
+                return 0
+
+            remaining = b.opened + self.reset_timeout - monotonic()
+
+            if remaining > 0:
+                return remaining
+
+            if b.trial is not None:
+                return self.recheck
+
+            if reserve:
+                b.trial = owner
+
+            return 0
+
+    def success(self, host):
+        with self._lock:
+            self._breakers.pop(host, None)
+
+    def abort(self, host, owner=None):
+        """
+        The task that test the host was cancelled (or dropped before run),
+        other can test it. If owner is given the test is released only if
+        was reserved by it
+        """
+        with self._lock:
+            b = self._breakers.get(host)
+
+            if b is not None and (owner is None or b.trial == owner):
+                b.trial = None
+
+    def failure(self, host):
+        if not host:
+            return
+
+        with self._lock:
+            b = self._breakers.get(host)
+
+            if b is None:
+                b = self._breakers[host] = _Breaker()
+
+            b.failures += 1
+
+            # a failed test open the breaker again
+            if b.trial is not None or b.failures >= self.failure_threshold:
+                if b.opened is None or b.trial is not None:
+                    logger.info("host %s unavailable for %.0f seconds", host, self.reset_timeout)
+
+                b.opened = monotonic()
+                b.trial = None
+
+    def state(self, host):
+        """
+        State of breaker of host: closed, open or half-open
+        """
+        with self._lock:
+            b = self._breakers.get(host)
+
+            if b is None or b.opened is None:
+                return "closed"
+
+            if b.opened + self.reset_timeout > monotonic():
+                return "open"
+
+            return "half-open"
@@ -0,0 +1,217 @@
+from collections import deque
+from heapq import heappush, heappop
+from itertools import count
+
+
+class Scheduler(object):
+    """
+    Decide the order of execution of the queued tasks. The manager push
+    the tasks when they are queued and pop the next one when a worker is free.
+    """
+
+    def __len__(self):
+        raise NotImplementedError("implement scheduler")
+
+    def push(self, task):
+        """
+        Queue the task. If the task already is queued it is moved to back
+        """
+        raise NotImplementedError("implement scheduler")
+
+    def pop(self):
+        """
+        Return the next task to run or None if don't have runnable tasks
+        """
+        raise NotImplementedError("implement scheduler")
+
+    def discard(self, task):
+        """
+        Remove the task from queue (if is queued)
+        """
+        raise NotImplementedError("implement scheduler")
+
+    def done(self, task):
+        """
+        Called when a task returned by pop end its execution
+        """
+        pass
+
+
+class FifoScheduler(Scheduler):
+    """
+    First in first out scheduler. Ignore usernames and priorities
+    """
+
+    def __init__(self):
+        self._queue = deque()
+        self._tickets = count()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def push(self, task):
+        self.discard(task)
+
+        task.ticket = next(self._tickets)
+        self._queue.append((task.ticket, task))
+        self._count += 1
+
+    def pop(self):
+        while self._queue:
+            ticket, task = self._queue.popleft()
+
+            # skip discarded entries
+            if task.ticket == ticket:
+                task.ticket = None
+                self._count -= 1
+                return task
+
+        return None
+
+    def discard(self, task):
+        # the entry is removed lazily when pop reach it
+        if task.ticket is not None:
+            task.ticket = None
+            self._count -= 1
+
+
+class _UserQueue(object):
+    __slots__ = ("name", "heap", "size", "running", "vtime", "version", "readykey")
+
+    def __init__(self, name, vtime):
+        self.name = name
+        self.heap = []  # (-priority, ticket, task)
+        self.size = 0  # queued tasks (without discarded entries)
+        self.running = 0
+        self.vtime = vtime  # virtual time of next task
+        self.version = 0  # used for invalidate old entries in ready heap
+        self.readykey = None  # current entry in ready heap
+
+
+class FairScheduler(Scheduler):
+    """
+    Weighted fair queuing between usernames (start-time fair queuing).
+    Tasks with greater priority always go first, between tasks with the same
+    priority every user receive a share of workers proportional to its weight.
+    Optionally limit the number of running tasks of each user.
+    All decisions are O(log n)
+
+    :param weights: dict of username -> weight (default 1)
+    :param max_running_per_user: max tasks running at same time by user
+    """
+
+    def __init__(self, weights=None, max_running_per_user=None):
+        self._weights = dict(weights or {})
+        self._limit = max_running_per_user
+        self._users = {}
+        self._ready = []  # heap of (-priority, vtime, order, version, user)
+        self._vtime = 0.0
+        self._tickets = count()
+        self._order = count()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def set_weight(self, username, weight):
+        if weight <= 0:
+            raise ValueError("'weight' param should be positive")
+
+        self._weights[username] = weight
+
+    def set_max_running_per_user(self, limit):
+        self._limit = limit
+
+        for user in list(self._users.values()):
+            self._activate(user)
+
+    def _clean(self, user):
+        # remove discarded entries from head of user queue
+        heap = user.heap
+        while heap and heap[0][2].ticket != heap[0][1]:
+            heappop(heap)
+
+    def _activate(self, user):
+        # update the entry of user in ready heap
+        self._clean(user)
+
+        if not user.heap:
+            key = None
+
+            if not user.running:
+                del self._users[user.name]
+        elif self._limit is not None and user.running >= self._limit:
+            key = None
+        else:
+            key = (user.heap[0][0], user.vtime)
+
+        if key != user.readykey:
+            user.version += 1
+            user.readykey = key
+
+            if key is not None:
+                heappush(self._ready, key + (next(self._order), user.version, user))
+
+    def push(self, task):
+        self.discard(task)
+
+        name = task.info["username"]
+        user = self._users.get(name)
+
+        if user is None:
+            # an idle user don't keep credit of past
+            user = self._users[name] = _UserQueue(name, self._vtime)
+
+        task.ticket = next(self._tickets)
+        heappush(user.heap, (-task.info.get("priority", 0), task.ticket, task))
+        user.size += 1
+        self._count += 1
+
+        self._activate(user)
+
+    def pop(self):
+        while self._ready:
+            _, _, _, version, user = heappop(self._ready)
+
+            if version != user.version:
+                continue  # old entry
+
+            user.readykey = None
+            self._clean(user)
+
+            if not user.heap:
+                continue
+
+            _, _, task = heappop(user.heap)
+            task.ticket = None
+            user.size -= 1
+            user.running += 1
+            self._count -= 1
+
+            # advance virtual time
+            self._vtime = max(self._vtime, user.vtime)
+            user.vtime += 1.0 / self._weights.get(user.name, 1)
+
+            self._activate(user)
+            return task
+
+        return None
+
+    def discard(self, task):
+        if task.ticket is None:
+            return
+
+        user = self._users[task.info["username"]]
+        task.ticket = None
+        user.size -= 1
+        self._count -= 1
+
+        self._activate(user)
+
+    def done(self, task):
+        user = self._users.get(task.info["username"])
+
+        if user is not None:
+            user.running -= 1
+            self._activate(user)
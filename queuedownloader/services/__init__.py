@@ -1,5 +1,13 @@
-from ._base import DownloaderService
+from ._base import DownloaderService, ProbeInfo
+from .errors import DownloadError, NetworkError, AuthError, HTTPError, DiskSpaceError, IntegrityError
 from .mega import MegaService
 from .default import DefaultService
 from .youtube import YouTubeService
-from .playstore import PlayStoreService
\ No newline at end of file
+from .playstore import PlayStoreService
+from .registry import ServiceRegistry
+
+# registry used by default for detect the service of urls
+registry = ServiceRegistry(default=DefaultService)
+
+for service in (MegaService, PlayStoreService, YouTubeService):
+    registry.register(service)
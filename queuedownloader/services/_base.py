@@ -1,4 +1,13 @@
 from functools import wraps
+from threading import Event
+from collections import namedtuple
+from urllib.parse import urlsplit
+import re
+
+from ..progress import Progress
+
+# metadata of a resource, the fields unknown are None
+ProbeInfo = namedtuple("ProbeInfo", ["size", "etag", "last_modified"])
 
 def execute_behaviour(func):
     @wraps(func)
@@ -21,8 +30,15 @@ def execute_behaviour(func):
 class DownloaderService(object):
     # Name of service
     name = "DownloadService"
+    # hostnames (and its subdomains) and url schemes supported by service
+    hosts = ()
+    schemes = ("http", "https")
+    # regular expressions of the resources supported that are not urls
+    patterns = ()
 
     def __init__(self, *args, **kwargs):
+        # set while the service is not executing
+        self._idle = Event()
         self.running = False
 
         if len(args) < 2:
@@ -33,6 +49,24 @@ class DownloaderService(object):
         self.authuser = kwargs.get("authuser", None)
         self.authpasswd = kwargs.get("authpasswd", None)
 
+        # the service report the bytes downloaded here
+        self._progress = kwargs.get("progress")
+
+        if self._progress is None:
+            self._progress = Progress(kwargs.get("filesize"))
+
+        # WriteBehind that write the data downloaded (None for write it in the thread of service)
+        # and fsync policy of file (see PartFile)
+        self.writer = kwargs.get("writer")
+        self.fsync = kwargs.get("fsync", "save")
+
+        # hashes of file checked while is downloaded (the task keep it between retries)
+        self.digest = kwargs.get("digest")
+
+        if self.digest is None:
+            from ..digest import Digest
+            self.digest = Digest.fromparams(kwargs)
+
     @execute_behaviour
     def execute(self):
         """
@@ -46,13 +80,29 @@ class DownloaderService(object):
         """
         pass
 
-    def wait(self):
-        while self.running:
-            pass
+    @property
+    def running(self):
+        return not self._idle.is_set()
+
+    @running.setter
+    def running(self, value):
+        if value:
+            self._idle.clear()
+        else:
+            self._idle.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait until execution end. Return False if timeout expire
+        """
+        return self._idle.wait(timeout)
 
     @property
     def progress(self):
-        raise NotImplementedError("implement download service")
+        """
+        Progress of download
+        """
+        return self._progress
 
     def __enter__(self):
         return self
@@ -61,13 +111,58 @@ class DownloaderService(object):
         self.wait()
         return False
 
-    @staticmethod
-    def supported(url):
-        return False
+    @classmethod
+    def filename(cls, url):
+        """
+        Return the name of file saved in directory for url (None if is
+        unknown before the download)
+        """
+        return None
+
+    @classmethod
+    def resource_id(cls, url):
+        """
+        Return the identity of the resource of url, the urls with the same
+        identity download the same file (by default the url normalized)
+        """
+        from ..coalesce import normalize_url
+        return normalize_url(url)
+
+    @classmethod
+    def outputs(cls, url, directory, params=None):
+        """
+        Return the names of files saved in directory by the download of url
+        with params (called after the download)
+        """
+        name = cls.filename(url)
+        return [name] if name else []
+
+    @classmethod
+    def supported(cls, url):
+        if not isinstance(url, str):
+            raise TypeError("url should be a str")
+
+        parts = urlsplit(url)
+        host = parts.hostname
+
+        if host and parts.scheme in cls.schemes:
+            for h in cls.hosts:
+                if host == h or host.endswith("." + h):
+                    return True
+
+        return any(re.fullmatch(p, url) for p in cls.patterns)
 
     @staticmethod
     def filesize(url, authuser=None, authpasswd=None):
         """
         Get the file size of file
         """
-        return None
\ No newline at end of file
+        return None
+
+    @classmethod
+    def probe(cls, url, authuser=None, authpasswd=None):
+        """
+        Get the metadata of file (ProbeInfo). By default only the file size
+        """
+        size = cls.filesize(url, authuser, authpasswd)
+        return ProbeInfo(None if size is None else int(size), None, None)
\ No newline at end of file
@@ -1,16 +1,41 @@
-from ._base import DownloaderService, execute_behaviour
+from ._base import DownloaderService, ProbeInfo, execute_behaviour
+from .errors import DownloadError, NetworkError, AuthError, HTTPError
 from subprocess import Popen, PIPE
 from os import path, name as osname
+from urllib.parse import urlsplit
 import re
 
+# line of wget progress with style dot:mega, e.g. " 3072K ........ ........ 25%"
+# each dot is 64K, the commas are the part downloaded before (--continue)
+WGET_DOTS = re.compile(rb"^\s*(\d+)K\s+([,. ]+)")
+WGET_DOT_SIZE = 65536
+
 class DefaultService(DownloaderService):
     name = "DefaultService"    
+    schemes = ("http", "https", "ftp")
 
     def __init__(self, *args, **kwargs):
         # setting default values
         super(DefaultService, self).__init__(*args, **kwargs)
 
-        output = path.join(self.directory, path.basename(self.url))
+        # download engine: "native" (http in process) or "wget"
+        self.engine = kwargs.get("engine", "native")
+        self.segments = kwargs.get("segments", 1)
+        self.min_segment_size = kwargs.get("min_segment_size", 4 * 1024 * 1024)
+        # size of file if was probed
+        self.size = kwargs.get("filesize")
+        self.cancelled = False
+        self._responses = []
+
+        # the native engine only support http
+        if urlsplit(self.url).scheme not in ("http", "https"):
+            self.engine = "wget"
+
+        self.output = path.join(self.directory, self.filename(self.url))
+
+        # wget download in the part file (it continue from end of file)
+        from ..partfile import PART_SUFFIX
+        output = self.output + PART_SUFFIX
 
         # if windows os invoke wget instance in windows subsystem linux
         # only for debug
@@ -19,8 +44,8 @@ class DefaultService(DownloaderService):
             output = output.replace("\\", "/")
             output = re.sub(r"(?P<Letter>[A-Z]):/", r"/mnt/\1/", output).lower()
 
-        self.wget_args = ["wget", "--quiet", "--continue",
-                "--output-document=%s" % output]
+        self.wget_args = ["wget", "--quiet", "--show-progress", "--progress=dot:mega",
+                "--continue", "--output-document=%s" % output]
 
         # if windows os invoke wget instance in windows subsystem linux
         # only for debug
@@ -36,43 +61,164 @@ class DefaultService(DownloaderService):
     @execute_behaviour
     def execute(self):
         self.cancelled = False
-        
-        self._wget = Popen(self.wget_args)
+
+        if self.engine == "native":
+            return self._native()
+
+        return self._wget_execute()
+
+    def _native(self):
+        from ..engine import default_engine
+
+        return default_engine().download(
+            self.url, self.output,
+            progress=self.progress,
+            auth=(self.authuser, self.authpasswd),
+            cancelled=lambda: self.cancelled,
+            onresponse=self._setresponse,
+            segments=self.segments,
+            min_segment_size=self.min_segment_size,
+            writer=self.writer,
+            fsync=self.fsync,
+            digest=self.digest
+        )
+
+    def _setresponse(self, response):
+        self._responses.append(response)
+
+        # cancelled before the response
+        if self.cancelled:
+            response.abort()
+
+    def _wget_execute(self):
+        from ..partfile import PartFile
+
+        # wget continue the file downloaded before from its end, so the
+        # data after the first range missing is discarded
+        part = PartFile(self.output, fsync=self.fsync, digest=self.digest, adopt=True)
+        offset = part.offset()
+        part.truncate(offset)
+        part.open().truncate(offset)
+        part.close()
+
+        # wget continue from end of file, the space can't be reserved
+        if self.size:
+            part.check_space(self.size)
+
+        self.progress.reset(offset)
+
+        self._wget = Popen(self.wget_args, stderr=PIPE)
+        self._readprogress(self._wget.stderr)
         self._wget.wait()
 
+        if self._wget.returncode == 0:
+            self.progress.update(path.getsize(part.path))
+            # the file is hashed from the bytes of last commit
+            part.add(offset, path.getsize(part.path))
+            part.commit()
+        elif path.exists(part.path):
+            # save the bytes downloaded for the next time
+            part.add(offset, max(offset, path.getsize(part.path)))
+            part.close()
+
         # if process was cancelled
         if self.cancelled:
             return False
 
         elif self._wget.returncode == 1:
-            raise Exception("Generic error code.")
+            raise DownloadError("Generic error code.")
         elif self._wget.returncode == 2:
-            raise Exception("Parse error.")
+            raise DownloadError("Parse error.")
         elif self._wget.returncode == 3:
-            raise Exception("File I/O error.")
+            raise DownloadError("File I/O error.")
         elif self._wget.returncode == 4:
-            raise Exception("Network failure.")
+            raise NetworkError("Network failure.")
         elif self._wget.returncode == 5:
-            raise Exception("SSL verification failure.")
+            raise DownloadError("SSL verification failure.")
         elif self._wget.returncode == 6:
-            raise Exception("Username/password authentication failure.")
+            raise AuthError("Username/password authentication failure.")
         elif self._wget.returncode == 7:
-            raise Exception("Protocol errors.")
+            raise NetworkError("Protocol errors.")
         elif self._wget.returncode == 8:
-            raise Exception("Server issued an error response.")
+            raise HTTPError("Server issued an error response.")
 
         # return true if wget instance return 0
         return self._wget.returncode == 0
 
+    def _readprogress(self, stream):
+        # parse the progress of wget until it end
+        line = b""
+
+        while True:
+            data = stream.read1(4096)
+
+            if not data:
+                break
+
+            lines = (line + data).split(b"\n")
+            line = lines[-1]
+
+            # the last line can be incomplete (the dots are written while are downloaded)
+            for l in reversed(lines):
+                m = WGET_DOTS.match(l)
+
+                if m is not None:
+                    dots = m.group(2).count(b".") + m.group(2).count(b",")
+                    self.progress.update(int(m.group(1)) * 1024 + dots * WGET_DOT_SIZE)
+                    break
+
     def cancel(self):
-        if self.running:            
-            self._wget.kill()
-            
+        if self.running:
             self.cancelled = True
-            self.running = False
+
+            if self.engine == "native":
+                # unblock the reads of responses
+                for response in self._responses:
+                    response.abort()
+            else:
+                self._wget.kill()
+                self.running = False
+
+    @classmethod
+    def filename(cls, url):
+        return path.basename(url)
+
+    @classmethod
+    def supported(cls, url):
+        if not isinstance(url, str):
+            raise TypeError("url should be a str")
+
+        # wget can download any url
+        return urlsplit(url).scheme in cls.schemes
 
     @staticmethod
     def filesize(url, authuser=None, authpasswd=None):
+        return DefaultService.probe(url, authuser, authpasswd).size
+
+    @staticmethod
+    def probe(url, authuser=None, authpasswd=None):
+        headers = {}
+
+        if urlsplit(url).scheme in ("http", "https"):
+            # use the connections of download engine
+            from ..engine import default_engine
+
+            try:
+                headers = default_engine().probe(url, (authuser, authpasswd))
+            except DownloadError:
+                pass
+        else:
+            headers = DefaultService._probeexternal(url, authuser, authpasswd)
+
+        size = headers.get("content-length")
+
+        return ProbeInfo(int(size) if size and size.isdigit() else None,
+                         headers.get("etag"), headers.get("last-modified"))
+
+    @staticmethod
+    def _probeexternal(url, authuser=None, authpasswd=None):
+        headers = {}
+
         try:
             from requests import head
 
@@ -81,11 +227,7 @@ class DefaultService(DownloaderService):
                 auth = (authuser, authpasswd)
 
             r = head(url, auth=auth, timeout=5) # max wait 5 seconds
-
-            if "content-length" in r.headers:
-                return r.headers['content-length']
-            else:
-                return None
+            headers = r.headers
         except Exception:
             try:
                 # dont have requests module using curl
@@ -97,12 +239,11 @@ class DefaultService(DownloaderService):
                 with Popen(args, stdout=PIPE, stderr=PIPE) as curl:
                     out, err = curl.communicate(
                         timeout=5)  # max wait 5 seconds
-                    for line in out.splitlines():
-                        if b"Content-Length" in line:
-                            length = line.split(b' ')[1]
-                            if length.isdigit():
-                                return int(length)
-
-                    return None
+                    for line in out.decode("latin-1").splitlines():
+                        if ":" in line:
+                            name, value = line.split(":", 1)
+                            headers[name.strip().lower()] = value.strip()
             except Exception:
-                return None
+                pass
+
+        return headers
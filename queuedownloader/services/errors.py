@@ -0,0 +1,43 @@
+class DownloadError(Exception):
+    """
+    Base of errors raised by download services
+    """
+    pass
+
+
+class NetworkError(DownloadError):
+    """
+    Network failure (connection refused, reset, timeout, ...)
+    """
+    pass
+
+
+class AuthError(DownloadError):
+    """
+    Authentication failure
+    """
+    pass
+
+
+class DiskSpaceError(DownloadError):
+    """
+    There is not enough free space in disk for the file
+    """
+    pass
+
+
+class IntegrityError(DownloadError):
+    """
+    The hash of file downloaded is not the expected
+    """
+    pass
+
+
+class HTTPError(DownloadError):
+    """
+    Error response of server. The status is None if is unknown
+    """
+
+    def __init__(self, message, status=None):
+        super(HTTPError, self).__init__(message)
+        self.status = status
@@ -1,18 +1,27 @@
 from ._base import DownloaderService, execute_behaviour
+from .errors import DownloadError, NetworkError
 from os import path
-from mega import Mega
+import re
+
+# handle and key of file in the links of Mega: /#!handle!key or /file/handle#key
+MEGA_FILE = re.compile(r"(?:#!|/file/)([\w-]+)[!#]([\w-]+)")
 
 class MegaService(DownloaderService):
     name = "MegaService"
+    hosts = ("mega.nz", "mega.co.nz")
+    schemes = ("https",)
 
     def __init__(self, *args, **kwargs):
         super(MegaService, self).__init__(*args, **kwargs)
 
         self.accounts = kwargs.get("accounts", [])
-        self.output = path.join(self.directory, path.basename(self.url))
+        self.output = path.join(self.directory, self.filename(self.url))
+        self.cancelled = False
 
     @execute_behaviour
     def execute(self):
+        from mega import Mega
+
         api = Mega()
 
         if self.authuser and self.authpasswd:
@@ -20,19 +29,144 @@ class MegaService(DownloaderService):
         else:
             api.login_anonymous()
 
-        api.download_url(self.url, dest_filename=self.output)
+        return self._download(api)
+
+    def _download(self, api):
+        # same protocol that Mega.download_url, but the chunks are
+        # written to a part file while are decrypted for report the progress
+        # and resume the download
+        import requests
+        from Crypto.Cipher import AES
+        from Crypto.Util import Counter
+        from mega.crypto import base64_to_a32, a32_to_str, str_to_a32, get_chunks
+        from ..partfile import PartFile
+        from ..stream import StreamWriter, default_pool
+
+        handle, key = api._parse_url(self.url).split("!")
+        key = base64_to_a32(key)
+        data = api._api_request({"a": "g", "g": 1, "p": handle})
+
+        if isinstance(data, int):
+            raise DownloadError("Mega error code %d." % data)
+        if "g" not in data:
+            raise DownloadError("File not accessible anymore.")
+
+        k = a32_to_str((key[0] ^ key[4], key[1] ^ key[5], key[2] ^ key[6], key[3] ^ key[7]))
+        iv = key[4:6] + (0, 0)
+        meta_mac = key[6:8]
+        size = data["s"]
+
+        part = PartFile(self.output, fsync=self.fsync, digest=self.digest)
+        part.validate(size, "mega:" + handle)
+
+        # the download is resumed from the end of the last chunk saved, the
+        # mac of chunks before is saved with it (the state of CBC is the
+        # last block encrypted)
+        offset = part.extra.get("offset", 0)
+        mac = bytes.fromhex(part.extra["mac"]) if offset else b"\0" * 16
+
+        if not offset or offset > part.offset():
+            offset, mac = 0, b"\0" * 16
+
+        part.truncate(offset)
+
+        # the counter of CTR mode is incremented by each block of 16 bytes
+        counter = Counter.new(128, initial_value=(((iv[0] << 32) + iv[1]) << 64) + offset // 16)
+        aes = AES.new(k, AES.MODE_CTR, counter=counter)
+        mac_encryptor = AES.new(k, AES.MODE_CBC, mac)
+        iv_str = a32_to_str([iv[0], iv[1], iv[0], iv[1]])
+
+        self.progress.reset(offset, size)
+
+        try:
+            if offset < size:
+                # the download url accept a range as suffix /start-end
+                url = data["g"] if not offset else "%s/%d-%d" % (data["g"], offset, size - 1)
+
+                pool = default_pool()
+                stream = StreamWriter(part, offset, self.progress, pool, self.writer)
+
+                with requests.get(url, stream=True, timeout=30) as r, pool.buffer() as scratch:
+                    r.raise_for_status()
+                    part.open(size)
+
+                    try:
+                        for chunk_start, chunk_size in get_chunks(size):
+                            if chunk_start < offset:
+                                continue
+
+                            if self.cancelled:
+                                return False
+
+                            # the chunk is read and decrypted in a buffer of pool (1MiB is the max size)
+                            chunk = stream.free()[:chunk_size]
+                            read = 0
+
+                            while read < chunk_size:
+                                n = r.raw.readinto(chunk[read:])
+
+                                if not n:
+                                    raise NetworkError("Connection closed before end of file.")
+
+                                read += n
+
+                            aes.decrypt(chunk, output=chunk)
+
+                            # the mac of chunk is the last block of chunk (padded with zeros) encrypted
+                            # in CBC mode, it is calculated in other buffer (the chunk can be written
+                            # by other thread)
+                            plain = scratch[:chunk_size]
+                            plain[:] = chunk
+                            cbc = AES.new(k, AES.MODE_CBC, iv_str)
+                            full = chunk_size - chunk_size % 16
+                            cbc.encrypt(plain[:full], output=plain[:full])
+
+                            if full == chunk_size:
+                                block = plain[full - 16:full]
+                            else:
+                                block = cbc.encrypt(bytes(plain[full:]) + b"\0" * (16 - chunk_size % 16))
+
+                            mac = mac_encryptor.encrypt(block)
+
+                            # the chunk is written with the state for resume the download after it
+                            stream.advance(chunk_size, {"offset": chunk_start + chunk_size, "mac": mac.hex()})
+                    finally:
+                        stream.finish()
+        finally:
+            part.close()
+
+        file_mac = str_to_a32(mac)
+
+        if (file_mac[0] ^ file_mac[1], file_mac[2] ^ file_mac[3]) != meta_mac:
+            # the data is not valid, download it again
+            part.discard()
+            raise DownloadError("Mismatched mac.")
+
+        part.commit()
+        return True
+
+    def cancel(self):
+        if self.running:
+            self.cancelled = True
+
+    @classmethod
+    def filename(cls, url):
+        return path.basename(url)
+
+    @classmethod
+    def resource_id(cls, url):
+        m = MEGA_FILE.search(url)
+
+        if m is None:
+            return super(MegaService, cls).resource_id(url)
+
+        return "mega:%s!%s" % m.groups()
 
     @staticmethod
     def filesize(url, authuser=None, authpasswd=None):
+        from mega import Mega
+
         api = Mega()
         info = api.get_public_url_info(url)
-        
-        return info["size"]
 
-    @staticmethod
-    def supported(url):
-        if isinstance(url, str):
-            if url.startswith("https://mega.nz") or url.startswith("https://mega.co.nz"):
-                return True
-        else:
-            raise TypeError("url should be a str")
+        return info["size"]
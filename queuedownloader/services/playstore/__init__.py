@@ -1,16 +1,19 @@
 from .._base import DownloaderService, execute_behaviour
-from os import path, getcwd, remove
+from os import path, getcwd, remove, listdir
 from json import loads, dumps
 from uuid import uuid4
-from re import fullmatch
 
 class PlayStoreService(DownloaderService):   
     name = "PlayStoreService"
+    hosts = ("play.google.com",)
+    schemes = ("https",)
+    # package name of app
+    patterns = (r"[A-Za-z0-9]+\.[A-Za-z0-9]+\.[A-Za-z0-9]+",)
 
     def __init__(self, *args, **kwargs):
         super(PlayStoreService, self).__init__(*args, **kwargs)        
         
-        self.output = path.join(self.directory, path.basename(self.url) + ".apk")
+        self.output = path.join(self.directory, self.filename(self.url))
         self.download_obb = kwargs.get("download_obb", True)
         
         with open(path.abspath(path.join(getcwd(), "config/credentials.json")), "r") as file:
@@ -29,6 +32,21 @@ class PlayStoreService(DownloaderService):
         with open(self.temp_file, "w") as file:
             file.write(dumps([config]))
 
+    @classmethod
+    def filename(cls, url):
+        return path.basename(url) + ".apk"
+
+    @classmethod
+    def outputs(cls, url, directory, params=None):
+        names = [cls.filename(url)]
+
+        # additional files of app, named <main|patch>.<version code>.<package name>.obb
+        if (params or {}).get("download_obb", True):
+            suffix = ".%s.obb" % path.basename(url)
+            names.extend(sorted(n for n in listdir(directory) if n.endswith(suffix)))
+
+        return names
+
     @execute_behaviour
     def execute(self):       
         try:
@@ -49,19 +67,12 @@ class PlayStoreService(DownloaderService):
             }
             
             return api.download(details['package_name'], self.output, 
-                                        download_obb=self.download_obb)
+                                        download_obb=self.download_obb, progress=self.progress,
+                                        writer=self.writer, fsync=self.fsync,
+                                        digest=self.digest)
         finally:
             # remove temp file
             try:
                 remove(temp_file)
             except:
                 pass
-
-    @staticmethod
-    def supported(url):
-        if isinstance(url, str):
-            if url.startswith("https://play.google.com") or fullmatch(r"^[A-Za-z0-9]+\.[A-Za-z0-9]+\.[A-Za-z0-9]+$", url):
-                return True
-        else:
-            raise TypeError("url should be a str")
-        
\ No newline at end of file
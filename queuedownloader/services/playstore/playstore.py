@@ -11,8 +11,11 @@ import requests
 from google.protobuf import json_format
 from requests.exceptions import ChunkedEncodingError
 from tqdm import tqdm
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
 
 from . import playstore_proto_pb2 as playstore_protobuf
+from ...partfile import PartFile
+from ...stream import StreamWriter, default_pool
 from .credentials import EncryptedCredentials
 
 
@@ -264,26 +267,25 @@ class Playstore(object):
         # Execute another query to get the actual apk file.
         response = requests.get(temp_url, headers=headers, cookies=cookies, verify=True, stream=True)
 
-        chunk_size = 1024
         apk_size = int(response.headers['content-length'])
 
         # Download the apk file and save it, showing a progress bar.
         try:
-            with open(file_name, 'wb') as f:
+            with open(file_name, 'wb') as f, default_pool().buffer() as buffer:
                 last_progress = 0
-                for index, chunk in enumerate(response.iter_content(chunk_size=chunk_size)):
-                    current_progress = 100 * index * chunk_size // apk_size
+                downloaded = 0
+                for size in iter(lambda: response.raw.readinto(buffer), 0):
+                    f.write(buffer[:size])
+                    downloaded += size
+
+                    current_progress = 100 * downloaded // apk_size
                     if current_progress > last_progress:
                         last_progress = current_progress
                         yield last_progress
 
-                    if chunk:
-                        f.write(chunk)
-                        f.flush()
-
                 # Download complete.
                 yield 100
-        except ChunkedEncodingError:
+        except (ChunkedEncodingError, ProtocolError, ReadTimeoutError):
             # There was an error during the download so not all the file was written to disk, hence there will
             # be a mismatch between the expected size and the actual size of the downloaded file, but the next
             # code block will handle that.
@@ -300,7 +302,6 @@ class Playstore(object):
                 # Execute another query to get the actual file.
                 response = requests.get(obb.downloadUrl, headers=headers, cookies=cookies, verify=True, stream=True)
 
-                chunk_size = 1024
                 file_size = int(response.headers['content-length'])
 
                 obb_file_name = os.path.join(os.path.dirname(file_name),
@@ -309,21 +310,21 @@ class Playstore(object):
 
                 # Download the additional file and save it, showing a progress bar.
                 try:
-                    with open(obb_file_name, 'wb') as f:
+                    with open(obb_file_name, 'wb') as f, default_pool().buffer() as buffer:
                         last_progress = 0
-                        for index, chunk in enumerate(response.iter_content(chunk_size=chunk_size)):
-                            current_progress = 100 * index * chunk_size // file_size
+                        downloaded = 0
+                        for size in iter(lambda: response.raw.readinto(buffer), 0):
+                            f.write(buffer[:size])
+                            downloaded += size
+
+                            current_progress = 100 * downloaded // file_size
                             if current_progress > last_progress:
                                 last_progress = current_progress
                                 yield last_progress
 
-                            if chunk:
-                                f.write(chunk)
-                                f.flush()
-
                         # Download complete.
                         yield 100
-                except ChunkedEncodingError:
+                except (ChunkedEncodingError, ProtocolError, ReadTimeoutError):
                     # There was an error during the download so not all the file was written to disk, hence there will
                     # be a mismatch between the expected size and the actual size of the downloaded file, but the next
                     # code block will handle that.
@@ -519,7 +520,106 @@ class Playstore(object):
 
         return details
 
-    def download(self, package_name: str, file_name: str = None, download_obb: bool = False) -> bool:
+    def _download_file(self, url: str, headers: dict, cookies: dict, file_name: str,
+                       progress: object = None, desc: str = '', writer: object = None,
+                       fsync: object = 'save', digest: object = None) -> bool:
+        """
+        Download a file in a part file (file_name.part), resuming it from the bytes already downloaded.
+
+        :param url: The url of the file.
+        :param headers: The headers of the request.
+        :param cookies: The cookies of the request.
+        :param file_name: The location where to save the downloaded file.
+        :param progress: Progress object where the bytes downloaded are reported (optional).
+        :param desc: The description of the progress bar.
+        :param writer: WriteBehind object that writes the data in background (optional).
+        :param fsync: The fsync policy of the file (see PartFile).
+        :param digest: Digest object with the hashes expected of the file, checked while it is
+               downloaded (optional).
+        :return: True if the entire file was downloaded, False otherwise.
+        """
+
+        part = PartFile(file_name, fsync=fsync, digest=digest)
+        start = part.offset()
+
+        request_headers = dict(headers)
+        if start:
+            request_headers['Range'] = 'bytes={0}-'.format(start)
+
+        response = requests.get(url, headers=request_headers, cookies=cookies, verify=True, stream=True)
+
+        if response.status_code == 206:
+            # The download continues from the bytes already downloaded.
+            content_range = response.headers.get('content-range', '')
+            file_size = int(content_range.rsplit('/', 1)[-1]) if content_range[-1:].isdigit() else None
+
+            if file_size is None or not part.validate(file_size):
+                # The file changed, so it has to be downloaded again.
+                response.close()
+                part.reset()
+                part.close()
+                return self._download_file(url, headers, cookies, file_name, progress, desc, writer, fsync, digest)
+        elif response.status_code == 416:
+            response.close()
+
+            if start and part.size == start:
+                # The file was already downloaded entirely.
+                part.commit()
+                return True
+
+            if not start:
+                self.logger.error('Invalid range requested when downloading "{0}"'.format(file_name))
+                return False
+
+            part.reset()
+            part.close()
+            return self._download_file(url, headers, cookies, file_name, progress, desc, writer, fsync, digest)
+        else:
+            start, file_size = 0, int(response.headers['content-length'])
+            part.reset()
+            part.validate(file_size)
+
+        if progress is not None:
+            # The bytes already downloaded are not reported as transferred.
+            progress.reset(progress.done + start, (progress.total or 0) + file_size)
+
+        # The response is read in reusable buffers of some MiB and written with positional writes.
+        stream = StreamWriter(part, start, progress, writer=writer)
+
+        try:
+            # Reserve the space of the file in disk before downloading it.
+            part.open(file_size)
+            part.truncate(start)
+
+            with tqdm(initial=start, total=file_size, dynamic_ncols=True, unit='B', unit_scale=True, desc=desc,
+                      bar_format='{l_bar}{bar}|[{elapsed}<{remaining}, {rate_fmt}]') as bar:
+                def readinto(buffer):
+                    n = response.raw.readinto(buffer)
+                    bar.update(n)
+                    return n
+
+                stream.write_from(readinto)
+        except (ChunkedEncodingError, ProtocolError, ReadTimeoutError):
+            # There was an error during the download so not all the file was written to disk, the bytes
+            # downloaded are kept in the part file and the next download will continue from them.
+            pass
+        finally:
+            part.close()
+
+        position = stream.position
+
+        # Check if the entire file was downloaded correctly.
+        if position != file_size:
+            self.logger.error('Download of "{0}" not completed, please retry, the download will continue '
+                              'from {1} bytes'.format(file_name, position))
+            return False
+
+        part.commit()
+        return True
+
+    def download(self, package_name: str, file_name: str = None, download_obb: bool = False,
+                 progress: object = None, writer: object = None, fsync: object = 'save',
+                 digest: object = None) -> bool:
         """
         Download a certain app (identified by the package name) from the Google Play Store.
 
@@ -527,6 +627,10 @@ class Playstore(object):
         :param file_name: The location where to save the downloaded app (by default "package_name.apk").
         :param download_obb: Flag indicating whether to also download the additional .obb files for
                an application (if any).
+        :param progress: Progress object where the bytes downloaded are reported (optional).
+        :param writer: WriteBehind object that writes the data in background (optional).
+        :param fsync: The fsync policy of the files (see PartFile).
+        :param digest: Digest object with the hashes expected of the apk file (optional).
         :return: True if the file was downloaded correctly, False otherwise.
         """
 
@@ -594,63 +698,26 @@ class Playstore(object):
             'Accept-Encoding': ''
         }
 
-        # Execute another query to get the actual apk file.
-        response = requests.get(temp_url, headers=headers, cookies=cookies, verify=True, stream=True)
-
-        chunk_size = 1024
-        apk_size = int(response.headers['content-length'])
+        if progress is not None:
+            progress.reset(0, 0)
 
         # Download the apk file and save it, showing a progress bar.
-        try:
-            with open(file_name, 'wb') as f:
-                for chunk in tqdm(response.iter_content(chunk_size=chunk_size), total=(apk_size // chunk_size),
-                                  dynamic_ncols=True, unit=' KB', desc=('Downloading {0}'.format(package_name)),
-                                  bar_format='{l_bar}{bar}|[{elapsed}<{remaining}, {rate_fmt}]'):
-                    if chunk:
-                        f.write(chunk)
-                        f.flush()
-        except ChunkedEncodingError:
-            # There was an error during the download so not all the file was written to disk, hence there will
-            # be a mismatch between the expected size and the actual size of the downloaded file, but the next
-            # code block will handle that.
-            pass
-
-        # Check if the entire apk was downloaded correctly, otherwise return immediately.
-        if not self._check_entire_file_downloaded(apk_size, file_name):
+        if not self._download_file(temp_url, headers, cookies, file_name, progress,
+                                   'Downloading {0}'.format(package_name), writer, fsync, digest):
             return False
 
         if download_obb:
             # Save the additional files for the apk.
             for obb in additional_files:
 
-                # Execute another query to get the actual file.
-                response = requests.get(obb.downloadUrl, headers=headers, cookies=cookies, verify=True, stream=True)
-
-                chunk_size = 1024
-                file_size = int(response.headers['content-length'])
-
                 obb_file_name = os.path.join(os.path.dirname(file_name),
                                              '{0}.{1}.{2}.obb'.format('main' if obb.fileType == 0 else 'patch',
                                                                       obb.versionCode, package_name))
 
                 # Download the additional file and save it, showing a progress bar.
-                try:
-                    with open(obb_file_name, 'wb') as f:
-                        for chunk in tqdm(response.iter_content(chunk_size=chunk_size), total=(file_size // chunk_size),
-                                          dynamic_ncols=True, unit=' KB',
-                                          desc=('Downloading additional file of {0}'.format(package_name)),
-                                          bar_format='{l_bar}{bar}|[{elapsed}<{remaining}, {rate_fmt}]'):
-                            if chunk:
-                                f.write(chunk)
-                                f.flush()
-                except ChunkedEncodingError:
-                    # There was an error during the download so not all the file was written to disk, hence there will
-                    # be a mismatch between the expected size and the actual size of the downloaded file, but the next
-                    # code block will handle that.
-                    pass
-
-                # Check if the entire additional file was downloaded correctly, otherwise return immediately.
-                if not self._check_entire_file_downloaded(file_size, obb_file_name):
+                if not self._download_file(obb.downloadUrl, headers, cookies, obb_file_name, progress,
+                                           'Downloading additional file of {0}'.format(package_name),
+                                           writer, fsync):
                     return False
 
         # The apk and the additional files (if any) were downloaded correctly.
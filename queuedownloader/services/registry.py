@@ -0,0 +1,154 @@
+from urllib.parse import urlsplit
+from threading import Lock
+import re
+
+import logging
+
+logger = logging.getLogger("queuedownloader")
+
+# entry point group used by third-party packages for register services
+ENTRY_POINT_GROUP = "queuedownloader.services"
+
+
+class ServiceRegistry(object):
+    """
+    Registry of download services indexed by url scheme and hostname,
+    with a precompiled index of patterns as fallback for the resources
+    that are not urls. Lookup a url is O(1) on average.
+    >>> registry.register(MyService, hosts=["example.com"])
+    >>> registry.lookup("https://www.example.com/file")
+    <class 'MyService'>
+
+    :param default: service returned when none is found
+    :param entrypoints: load the services of entry points at first lookup
+    """
+
+    def __init__(self, default=None, entrypoints=True):
+        self.default = default
+        self._hosts = {}  # (scheme, host) -> service
+        self._patterns = []  # (pattern, service)
+        self._index = None  # all patterns compiled in one regex
+        self._names = {}  # name -> service
+        self._entrypoints = entrypoints
+        self._lock = Lock()
+
+        if default is not None:
+            self._names[default.name] = default
+
+    def register(self, service, hosts=None, schemes=None, patterns=None):
+        """
+        Register the service. By default the hosts, schemes and patterns are
+        taken from service attributes. The last service registered win
+        """
+        hosts = service.hosts if hosts is None else hosts
+        schemes = service.schemes if schemes is None else schemes
+        patterns = service.patterns if patterns is None else patterns
+
+        with self._lock:
+            for scheme in schemes:
+                for host in hosts:
+                    self._hosts[(scheme.lower(), host.lower())] = service
+
+            for pattern in patterns:
+                self._patterns.append((pattern, service))
+
+            self._names[service.name] = service
+            self._index = None
+
+    def load_entry_points(self, group=ENTRY_POINT_GROUP):
+        """
+        Register the services published by installed packages, e.g. in setup.py:
+        entry_points={"queuedownloader.services": ["myservice = mypackage:MyService"]}
+        """
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:  # python < 3.8
+            try:
+                from importlib_metadata import entry_points
+            except ImportError:
+                return
+
+        eps = entry_points()
+        eps = eps.select(group=group) if hasattr(eps, "select") else eps.get(group, ())
+
+        for ep in eps:
+            try:
+                self.register(ep.load())
+            except Exception as e:
+                logger.warning("cannot load service %s: %s", ep.name, e)
+
+    def _ready(self):
+        if self._entrypoints:
+            self._entrypoints = False
+            self.load_entry_points()
+
+        index = self._index
+
+        if index is None and self._patterns:
+            index = self._index = re.compile("|".join(
+                "(?P<_%d>%s)" % (i, p) for i, (p, _) in enumerate(self._patterns)))
+
+        return index
+
+    def byname(self, name):
+        """
+        Return the service registered with name or None
+        """
+        self._ready()
+        return self._names.get(name)
+
+    def _lookuphost(self, scheme, host):
+        # try the host and its parent domains
+        while True:
+            service = self._hosts.get((scheme, host))
+
+            if service is not None:
+                return service
+
+            i = host.find(".")
+
+            if i < 0:
+                return None
+
+            host = host[i + 1:]
+
+    def lookup(self, url):
+        """
+        Return the service for url (default service if none is found)
+        """
+        return self._lookup(url, self._ready(), None)
+
+    def _lookup(self, url, index, memo):
+        if not isinstance(url, str):
+            raise TypeError("url should be a str")
+
+        parts = urlsplit(url)
+        host = parts.hostname
+        service = None
+
+        if host:
+            key = (parts.scheme.lower(), host)
+
+            if memo is not None and key in memo:
+                service = memo[key]
+            else:
+                service = self._lookuphost(*key)
+
+                if memo is not None:
+                    memo[key] = service
+
+        if service is None and index is not None:
+            m = index.fullmatch(url)
+
+            if m is not None:
+                service = self._patterns[int(m.lastgroup[1:])][1]
+
+        return service or self.default
+
+    def classify(self, urls):
+        """
+        Return the list of services for urls. The lookups of hosts are
+        shared between urls, use it for bulk ingestion
+        """
+        index, memo = self._ready(), {}
+        return [self._lookup(url, index, memo) for url in urls]
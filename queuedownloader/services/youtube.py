@@ -1,21 +1,50 @@
-from ._base import DownloaderService
-from youtube_dl import YoutubeDL
+from ._base import DownloaderService, execute_behaviour
+from os import path
 
 class YouTubeService(DownloaderService):   
     name = "YouTubeService"
+    hosts = ("youtube.com", "youtu.be")
 
     def __init__(self, *args, **kwargs):
         super(YouTubeService, self).__init__(*args, **kwargs)
         
         self.subtitles = kwargs.get("subtitles", True)
         self.subtitles_lang = kwargs.get("subtitles_lang", "spanish")
+        self.quality = kwargs.get("quality", None)
 
-    
-    @staticmethod
-    def supported(url):
-        if isinstance(url, str):
-            if url.startswith("https://youtube.com/") or url.startswith("https://youtu.be/"):
-                return True
-        else:
-            raise TypeError("url should be a str")
-        
\ No newline at end of file
+    @execute_behaviour
+    def execute(self):
+        from youtube_dl import YoutubeDL
+
+        options = {
+            "outtmpl": path.join(self.directory, "%(title)s.%(ext)s"),
+            "quiet": True,
+            "continuedl": True,
+            "writesubtitles": self.subtitles,
+            "subtitleslangs": [self.subtitles_lang],
+        }
+
+        # youtube-dl format selection
+        if self.quality:
+            options["format"] = self.quality
+
+        if self.authuser and self.authpasswd:
+            options["username"] = self.authuser
+            options["password"] = self.authpasswd
+
+        # the video can have many files (video, audio and subtitles)
+        files = {}  # filename -> (downloaded bytes, total bytes)
+
+        def hook(d):
+            total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
+            done = d.get("downloaded_bytes") or (total if d.get("status") == "finished" else 0)
+            files[d.get("filename")] = (done, total)
+
+            self.progress.update(sum(x[0] for x in files.values()),
+                                 sum(x[1] for x in files.values()) or None)
+
+        options["progress_hooks"] = [hook]
+        self.progress.reset()
+
+        with YoutubeDL(options) as ydl:
+            return ydl.download([self.url]) == 0
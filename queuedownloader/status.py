@@ -0,0 +1,192 @@
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import monotonic, time
+
+# progress is the ProgressInfo of task at the last change or progress tick
+TaskStatus = namedtuple("TaskStatus", ["id", "username", "url", "service", "state", "progress",
+                                       "filesize", "probing", "attempts", "retry_at"])
+
+StatusSnapshot = namedtuple("StatusSnapshot", ["generation", "tasks"])
+
+# reset is True when the changes are too old and the full snapshot should be read again
+Changes = namedtuple("Changes", ["generation", "updated", "removed", "reset"])
+
+
+class StatusView(object):
+    """
+    Status of the tasks of queue updated by the manager on each change of
+    a task, and on progress ticks of the tasks downloading (see progress).
+    Each change increment the generation of view, the readers get an
+    immutable snapshot of the generation (built only once per generation)
+    or only the changes after a generation.
+    >>> s = view.snapshot()
+    >>> changes = view.changes_since(s.generation)
+
+    :param max_removed: number of removed tasks remembered for changes_since
+    """
+
+    def __init__(self, max_removed=100000):
+        self.max_removed = max_removed
+        self.generation = 0
+        self._entries = OrderedDict()  # key -> TaskStatus in order of queue
+        self._changed = OrderedDict()  # key -> generation in order of change
+        self._removed = OrderedDict()  # key -> generation of removal
+        self._horizon = 0  # oldest generation that changes_since can serve
+        self._snapshot = StatusSnapshot(0, ())
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, task):
+        """
+        Save the current status of task
+        """
+        t = task.info
+        status = TaskStatus(
+            id=task.key,
+            username=t["username"],
+            url=t["url"],
+            service=t["service"].name,
+            state=task.state,
+            progress=task.progress.info(),
+            filesize=t["filesize"],
+            probing=task.probing,
+            attempts=task.attempts,
+            retry_at=None if task.retry_at is None else time() + task.retry_at - monotonic()
+        )
+
+        with self._lock:
+            self.generation += 1
+            self._entries[task.key] = status
+            self._changed[task.key] = self.generation
+            self._changed.move_to_end(task.key)
+
+    def progress(self, task):
+        """
+        Save the current progress of task (a change of the task)
+        """
+        info = task.progress.info()
+
+        with self._lock:
+            status = self._entries.get(task.key)
+
+            if status is not None:
+                self.generation += 1
+                self._entries[task.key] = status._replace(progress=info)
+                self._changed[task.key] = self.generation
+                self._changed.move_to_end(task.key)
+
+    def move_to_end(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.generation += 1
+                self._entries.move_to_end(key)
+                self._changed[key] = self.generation
+                self._changed.move_to_end(key)
+
+    def remove(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return
+
+            self.generation += 1
+            self._changed.pop(key, None)
+            self._removed[key] = self.generation
+
+            # forget the oldest removals
+            while len(self._removed) > self.max_removed:
+                _, gen = self._removed.popitem(last=False)
+                self._horizon = gen
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def snapshot(self):
+        """
+        Return the StatusSnapshot of current generation
+        """
+        with self._lock:
+            if self._snapshot.generation != self.generation:
+                self._snapshot = StatusSnapshot(self.generation, tuple(self._entries.values()))
+
+            return self._snapshot
+
+    def changes_since(self, generation):
+        """
+        Return the Changes after generation: the status of the tasks updated
+        and the keys of the tasks removed. If the generation is too old the
+        changes have reset=True and the snapshot should be read again
+        """
+        with self._lock:
+            if generation < self._horizon:
+                return Changes(self.generation, (), (), True)
+
+            updated = []
+
+            # the last changed are at end
+            for key, gen in reversed(self._changed.items()):
+                if gen <= generation:
+                    break
+
+                updated.append(self._entries[key])
+
+            removed = []
+
+            for key, gen in reversed(self._removed.items()):
+                if gen <= generation:
+                    break
+
+                removed.append(key)
+
+            updated.reverse()
+            removed.reverse()
+
+            return Changes(self.generation, tuple(updated), tuple(removed), False)
+
+
+class TaskIterator(object):
+    """
+    Lazy iterator over the status of tasks that read them by pages.
+    The cursor is the position of the last task returned, pass it to
+    iter_tasks for continue after it
+    >>> it = q.iter_tasks(username="user1", limit=20)
+    >>> page = list(it)
+    >>> next_page = list(q.iter_tasks(username="user1", limit=20, cursor=it.cursor))
+
+    :param fetch: called as fetch(after, count) and return a list of (position, TaskStatus)
+    :param limit: max number of tasks, None for all
+    :param cursor: position after which start
+    :param page_size: number of tasks read at once
+    """
+
+    def __init__(self, fetch, limit=None, cursor=None, page_size=256):
+        self.cursor = cursor or 0
+        self._fetch = fetch
+        self._remaining = limit
+        self._page_size = page_size
+        self._page = []
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._page:
+            if self._done or self._remaining == 0:
+                raise StopIteration
+
+            count = self._page_size if self._remaining is None else min(self._page_size, self._remaining)
+            self._page = self._fetch(self.cursor, count)
+            self._page.reverse()
+            self._done = len(self._page) < count
+
+            if not self._page:
+                raise StopIteration
+
+        self.cursor, status = self._page.pop()
+
+        if self._remaining is not None:
+            self._remaining -= 1
+
+        return status
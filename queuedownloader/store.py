@@ -0,0 +1,492 @@
+from collections import OrderedDict
+from threading import Lock, Timer
+from json import dumps, loads
+from itertools import islice
+from bisect import bisect_right
+import sqlite3
+
+
+def _matches(task, username, status, service):
+    if username is not None and task.info["username"] != username:
+        return False
+    if status is not None and task.state != status:
+        return False
+    if service is not None and task.info["service"].name != service:
+        return False
+    return True
+
+
+class TaskStore(object):
+    """
+    Ordered store of tasks indexed by key. The manager keep the tasks of
+    queue in a store and notify it the changes of tasks with update()
+    """
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def __contains__(self, key):
+        raise NotImplementedError()
+
+    def __iter__(self):
+        raise NotImplementedError()
+
+    def get(self, key, default=None):
+        raise NotImplementedError()
+
+    def add(self, task):
+        self.add_many((task,))
+
+    def add_many(self, tasks):
+        raise NotImplementedError()
+
+    def remove(self, key):
+        """
+        Remove the task from store and return it, None if don't exists
+        """
+        raise NotImplementedError()
+
+    def move_to_end(self, key):
+        raise NotImplementedError()
+
+    def update(self, task):
+        """
+        The state or params of task changed
+        """
+        pass
+
+    def query(self, username=None, status=None, service=None, offset=0, limit=None):
+        """
+        Return the tasks in order of queue filtered by username, status
+        (state of task) and service name
+        """
+        raise NotImplementedError()
+
+    def count(self, username=None, status=None, service=None):
+        raise NotImplementedError()
+
+    def scan(self, username=None, status=None, service=None, after=0, count=None):
+        """
+        Return a list of (position, task) of the tasks filtered that are
+        after position in queue (for paginate with cursors)
+        """
+        raise NotImplementedError()
+
+    def counts(self, username=None):
+        """
+        Return a dict of status -> number of tasks (of username if is specific)
+        """
+        raise NotImplementedError()
+
+    def users(self):
+        """
+        Return a dict of username -> dict of status -> number of tasks
+        """
+        raise NotImplementedError()
+
+    def load(self):
+        """
+        Return the tasks saved by a previous execution as a list
+        of (key, info, state) in order of queue
+        """
+        return []
+
+    def clear(self):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class _Index(object):
+    """
+    Positions of the tasks that match a value of a field. The positions
+    are appended in O(1), the ones that are not after the last (a task
+    that change of status keep its position) are merged in order when the
+    index is read. The positions are removed lazily (the readers skip the invalid)
+    """
+    __slots__ = ("_seqs", "_added")
+
+    def __init__(self):
+        self._seqs = []  # sorted
+        self._added = []  # not sorted
+
+    def __len__(self):
+        return len(self._seqs) + len(self._added)
+
+    def add(self, seq):
+        if self._added or (self._seqs and self._seqs[-1] >= seq):
+            self._added.append(seq)
+        else:
+            self._seqs.append(seq)
+
+    def sorted(self):
+        """
+        Return the sorted positions
+        """
+        if self._added:
+            # timsort merge the sorted run in linear time, the repeated positions are removed
+            self._seqs = list(dict.fromkeys(sorted(self._seqs + self._added)))
+            self._added = []
+
+        return self._seqs
+
+    def discard(self, valid):
+        """
+        Remove the positions that are not valid(seq)
+        """
+        self._seqs = [seq for seq in self.sorted() if valid(seq)]
+
+
+class MemoryTaskStore(TaskStore):
+    """
+    Store of tasks in memory (default).
+    Insert, remove, move to back and lookup are O(1). The tasks are indexed
+    by username, service and status, and counted by user and status
+    """
+
+    def __init__(self):
+        self._tasks = OrderedDict()
+        self._seq = 0
+        self._seqs = {}  # key -> position in queue
+        self._byseq = {}  # position -> task
+        self._states = {}  # key -> status counted
+        self._indexes = {}  # (field, value) -> _Index
+        self._counts = {}  # (field, value) -> number of tasks
+        self._userstates = {}  # username -> dict of status -> number of tasks
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def __contains__(self, key):
+        return key in self._tasks
+
+    def __iter__(self):
+        return iter(self._tasks.values())
+
+    def get(self, key, default=None):
+        return self._tasks.get(key, default)
+
+    @staticmethod
+    def _fields(task, state):
+        t = task.info
+        return ((None, None), ("username", t["username"]), ("service", t["service"].name),
+                ("status", state))
+
+    def _valid(self, field, value, seq):
+        task = self._byseq.get(seq)
+
+        if task is None:
+            return False
+        if field == "status":
+            return self._states[task.key] == value
+        return True
+
+    def _index(self, field, value, seq):
+        index = self._indexes.get((field, value))
+
+        if index is None:
+            index = self._indexes[(field, value)] = _Index()
+
+        index.add(seq)
+
+        # remove the invalid positions when are the most
+        if len(index) > 2 * self._counts.get((field, value), 0) + 64:
+            index.discard(lambda s: self._valid(field, value, s))
+
+    def _count(self, task, state, n, keys=None):
+        # keys are the (field, value) counted, all fields of task by default
+        for key in keys or self._fields(task, state):
+            count = self._counts[key] = self._counts.get(key, 0) + n
+
+            if not count:
+                del self._counts[key]
+                self._indexes.pop(key, None)
+
+        username = task.info["username"]
+        states = self._userstates.setdefault(username, {})
+        states[state] = states.get(state, 0) + n
+
+        if not states[state]:
+            del states[state]
+
+            if not states:
+                del self._userstates[username]
+
+    def _link(self, task):
+        # set a new position to task
+        self._seq += 1
+        self._seqs[task.key] = self._seq
+        self._byseq[self._seq] = task
+
+        for field, value in self._fields(task, self._states[task.key]):
+            self._index(field, value, self._seq)
+
+    def add_many(self, tasks):
+        for task in tasks:
+            if task.key in self._tasks:
+                raise KeyError("task %s already exists" % task.key)
+
+            self._tasks[task.key] = task
+            self._states[task.key] = task.state
+            self._count(task, task.state, 1)
+            self._link(task)
+
+    def remove(self, key):
+        task = self._tasks.pop(key, None)
+
+        if task is not None:
+            del self._byseq[self._seqs.pop(key)]
+            self._count(task, self._states.pop(key), -1)
+
+        return task
+
+    def move_to_end(self, key):
+        self._tasks.move_to_end(key)
+        del self._byseq[self._seqs[key]]
+        self._link(self._tasks[key])
+
+    def update(self, task):
+        state = self._states.get(task.key)
+
+        if state is None or state == task.state:
+            return
+
+        # only the status changed, the other counts and indexes are the same
+        self._count(task, state, -1, (("status", state),))
+        self._count(task, task.state, 1, (("status", task.state),))
+        self._states[task.key] = task.state
+        self._index("status", task.state, self._seqs[task.key])
+
+    def _iterate(self, username, status, service, after):
+        # use the most selective index
+        if username is not None:
+            index = self._indexes.get(("username", username))
+        elif service is not None:
+            index = self._indexes.get(("service", service))
+        elif status is not None:
+            index = self._indexes.get(("status", status))
+        else:
+            index = self._indexes.get((None, None))
+
+        if index is None:
+            return
+
+        seqs = index.sorted()
+
+        for i in range(bisect_right(seqs, after), len(seqs)):
+            task = self._byseq.get(seqs[i])
+
+            if task is not None and _matches(task, username, status, service):
+                yield seqs[i], task
+
+    def scan(self, username=None, status=None, service=None, after=0, count=None):
+        return list(islice(self._iterate(username, status, service, after), count))
+
+    def query(self, username=None, status=None, service=None, offset=0, limit=None):
+        tasks = self._iterate(username, status, service, 0)
+        return [task for _, task in islice(tasks, offset, None if limit is None else offset + limit)]
+
+    def count(self, username=None, status=None, service=None):
+        if status is not None and username is None and service is None:
+            return self._counts.get(("status", status), 0)
+
+        if username is not None and service is None:
+            if status is None:
+                return self._counts.get(("username", username), 0)
+            return self._userstates.get(username, {}).get(status, 0)
+
+        if service is not None and username is None and status is None:
+            return self._counts.get(("service", service), 0)
+
+        if username is None and status is None and service is None:
+            return len(self._tasks)
+
+        return sum(1 for _ in self._iterate(username, status, service, 0))
+
+    def counts(self, username=None):
+        if username is not None:
+            return dict(self._userstates.get(username, {}))
+
+        return {value: n for (field, value), n in self._counts.items() if field == "status"}
+
+    def users(self):
+        return {username: dict(states) for username, states in self._userstates.items()}
+
+    def clear(self):
+        self._tasks.clear()
+        self._seqs.clear()
+        self._byseq.clear()
+        self._states.clear()
+        self._indexes.clear()
+        self._counts.clear()
+        self._userstates.clear()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    seq INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    username TEXT,
+    service TEXT,
+    status TEXT,
+    attempts INTEGER,
+    info TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, seq);
+CREATE INDEX IF NOT EXISTS tasks_username ON tasks (username, seq);
+CREATE INDEX IF NOT EXISTS tasks_service ON tasks (service, seq);
+"""
+
+
+class SQLiteTaskStore(MemoryTaskStore):
+    """
+    Store of tasks that is mirrored in a SQLite database (WAL mode), so the
+    queue survive restarts. The tasks are kept in memory too (the queries,
+    counts and scans run over the indexes in memory, and the scheduler
+    hold the tasks queued), so it don't reduce the memory used by queue.
+    The changes are written by batches in one transaction by a timer thread
+    (when batch_size changes are pending or after flush_interval seconds),
+    the threads that change the tasks never wait the disk. The table have
+    indexes by status, username and service for read it from other process.
+    >>> m = DownloadQueueManager(store=SQLiteTaskStore("queue.db"))
+
+    :param path: path of database
+    :param batch_size: changes pending that start a write
+    :param flush_interval: max seconds that a change is pending of write
+    """
+
+    def __init__(self, path, batch_size=1000, flush_interval=1.0):
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._pending = OrderedDict()  # key -> task or None (removed)
+        self._reset = False  # the rows are deleted with the next changes written
+        self._lock = Lock()  # changes pending
+        self._io = Lock()  # writes of database, in order of changes
+        self._timer = None
+
+        # the connection is shared by the threads of manager
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+        row = self._db.execute("SELECT MAX(seq) FROM tasks").fetchone()
+        self._seq = row[0] or 0
+
+    def add_many(self, tasks):
+        super().add_many(tasks)
+
+        with self._lock:
+            for task in tasks:
+                self._pending[task.key] = task
+
+            self._changed()
+
+    def remove(self, key):
+        task = super().remove(key)
+
+        if task is not None:
+            with self._lock:
+                self._pending[key] = None
+                self._changed()
+
+        return task
+
+    def move_to_end(self, key):
+        super().move_to_end(key)
+
+        with self._lock:
+            self._pending[key] = self._tasks[key]
+            self._changed()
+
+    def update(self, task):
+        super().update(task)
+
+        with self._lock:
+            # skip the removed tasks
+            if task.key in self._tasks:
+                self._pending[task.key] = task
+                self._changed()
+
+    def _changed(self):
+        # the batch full is written now (by the timer thread)
+        if len(self._pending) >= self.batch_size:
+            if self._timer is None or self._timer.interval:
+                self._schedule(0)
+        elif self._timer is None:
+            self._schedule(self.flush_interval)
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+
+        self._timer = Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """
+        Write the pending changes
+        """
+        with self._io:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+                pending, self._pending = self._pending, OrderedDict()
+                reset, self._reset = self._reset, False
+
+            if (pending or reset) and self._db is not None:
+                self._write(pending, reset)
+
+    def _write(self, pending, reset):
+        rows, removed = [], []
+
+        for key, task in pending.items():
+            seq = self._seqs.get(key)
+
+            if task is None or seq is None:
+                removed.append((str(key),))
+            else:
+                info = dict(task.info)
+                info["service"] = info["service"].name
+                rows.append((seq, str(key), info["username"], info["service"],
+                             task.state, task.attempts, dumps(info, default=str)))
+
+        # all changes in one transaction
+        with self._db:
+            if reset:
+                self._db.execute("DELETE FROM tasks")
+
+            self._db.executemany("DELETE FROM tasks WHERE key = ?", removed)
+            self._db.executemany("INSERT OR REPLACE INTO tasks (seq, key, username, service, status, "
+                                 "attempts, info) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def load(self):
+        with self._io:
+            rows = self._db.execute("SELECT key, attempts, info FROM tasks ORDER BY seq").fetchall()
+
+        return [(key, loads(info), {"attempts": attempts or 0}) for key, attempts, info in rows]
+
+    def clear(self):
+        # the rows are deleted in the same transaction that write the tasks
+        # added after, so a crash don't lose the queue saved
+        super().clear()
+
+        with self._lock:
+            self._pending.clear()
+            self._reset = True
+            self._changed()
+
+    def close(self):
+        self.flush()
+
+        with self._io:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,342 @@
+from threading import Thread, Condition, Lock
+from collections import namedtuple
+from contextlib import contextmanager
+from queue import Queue, Full
+from time import monotonic
+
+
+class BufferPool(object):
+    """
+    Pool of reusable buffers (memoryview of a bytearray) for read the
+    streams with readinto, so the downloads don't allocate a object by
+    each read. The buffers released are kept until max_free.
+    >>> with pool.buffer() as buffer:
+    ...     n = response.readinto(buffer)
+
+    :param buffer_size: size of buffers
+    :param max_free: max buffers kept in pool
+    """
+
+    def __init__(self, buffer_size=1024 * 1024, max_free=32):
+        self.buffer_size = buffer_size
+        self.max_free = max_free
+        self.allocated = 0  # number of buffers created
+        self._free = []
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._free)
+
+    def acquire(self):
+        """
+        Return a buffer of buffer_size bytes
+        """
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+
+            self.allocated += 1
+
+        return memoryview(bytearray(self.buffer_size))
+
+    def release(self, buffer):
+        """
+        Return the buffer to pool
+        """
+        with self._lock:
+            if len(self._free) < self.max_free and len(buffer) == self.buffer_size:
+                self._free.append(buffer)
+
+    @contextmanager
+    def buffer(self):
+        buffer = self.acquire()
+
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+
+class StreamWriter(object):
+    """
+    Write a stream in a PartFile from position. The stream is read with
+    readinto in a buffer of pool and the buffer is written (with a
+    positional write) when is full or the stream end, the progress is
+    reported by each read. With a WriteBehind the buffers are written by
+    its threads and the reader continue with other buffer of pool.
+    >>> writer = StreamWriter(part, part.offset(), progress)
+    >>> writer.write_from(response.readinto)
+    >>> writer.position  # next byte of file
+
+    :param part: PartFile opened
+    :param position: offset of file where the stream is written
+    :param progress: Progress where the bytes read are reported
+    :param pool: BufferPool used (default_pool() by default)
+    :param writer: WriteBehind that write the buffers (None for write them in this thread)
+    """
+
+    def __init__(self, part, position=0, progress=None, pool=None, writer=None):
+        self.part = part
+        self.position = position
+        self.progress = progress
+        self.pool = pool if pool is not None else default_pool()
+        self.writer = writer
+        self._buffer = None
+        self._filled = 0
+
+    def free(self):
+        """
+        Return the free part of current buffer (where the data is read)
+        """
+        if self._buffer is None:
+            self._buffer = self.pool.acquire()
+
+        return self._buffer[self._filled:]
+
+    def advance(self, nbytes, extra=None):
+        """
+        Report nbytes read in the free part of buffer, it is written when
+        is full. If extra is given the buffer is written now with it (the
+        state of service after these bytes, see PartFile.write)
+        """
+        self._filled += nbytes
+
+        if self.progress is not None:
+            self.progress.add(nbytes)
+
+        if extra is not None or self._filled == len(self._buffer):
+            self.flush(extra)
+
+    def flush(self, extra=None):
+        """
+        Write the data of buffer. extra is the state of service saved with it (see PartFile.write)
+        """
+        if not self._filled:
+            return
+
+        filled, self._filled = self._filled, 0
+
+        if self.writer is not None:
+            # the buffer is released by the writer thread
+            buffer, self._buffer = self._buffer, None
+            self.writer.submit(self.part, self.position, buffer, filled, self.pool, extra)
+        else:
+            self.part.write(self.position, self._buffer[:filled], extra)
+
+        self.position += filled
+
+    def close(self):
+        """
+        Write the data of buffer and release it
+        """
+        try:
+            self.flush()
+        finally:
+            if self._buffer is not None:
+                self.pool.release(self._buffer)
+                self._buffer = None
+
+    def finish(self):
+        """
+        Write the data of buffer and wait until all data is in file
+        """
+        try:
+            self.close()
+        finally:
+            if self.writer is not None:
+                self.writer.wait(self.part)
+
+    def write_from(self, readinto, cancelled=None):
+        """
+        Read the stream until end with readinto(buffer) (return the bytes
+        read, 0 at end). Return False if was cancelled. If the read fail
+        the bytes read before are written and position is updated
+        """
+        try:
+            while True:
+                if cancelled is not None and cancelled():
+                    return False
+
+                n = readinto(self.free())
+
+                if not n:
+                    return True
+
+                self.advance(n)
+        finally:
+            self.finish()
+
+
+# stats of WriteBehind: pending are the buffers in queue, blocked the times that
+# a reader waited because the queue was full and blocked_time the seconds waited
+# (if grow the disk is slower than the network), write_time the seconds writing
+WriteStats = namedtuple("WriteStats", ["pending", "max_pending", "submitted", "written",
+                                       "blocked", "blocked_time", "write_time"])
+
+
+class WriteBehind(object):
+    """
+    Writer threads for the downloads. The readers (threads of network)
+    submit the buffers filled to a bounded queue and continue reading,
+    the buffers are written by the writer threads and returned to pool.
+    When the queue is full the readers wait (backpressure), the time
+    waited is measured in stats().
+    >>> writer = WriteBehind(threads=2)
+    >>> StreamWriter(part, 0, progress, writer=writer).write_from(response.readinto)
+    >>> writer.stats().blocked_time
+
+    :param threads: number of writer threads
+    :param max_pending: max buffers in queue
+    """
+
+    def __init__(self, threads=2, max_pending=32):
+        self.threads = threads
+        self.max_pending = max_pending
+
+        self._queue = Queue(max_pending)
+        self._parts = {}  # part -> [buffers pending, first error]
+        self._cond = Condition(Lock())
+        self._workers = []
+        self._closed = False
+
+        self._submitted = 0
+        self._written = 0
+        self._blocked = 0
+        self._blocked_time = 0.0
+        self._write_time = 0.0
+
+    def submit(self, part, offset, buffer, length, pool=None, extra=None):
+        """
+        Queue the write of buffer[:length] at offset of part, the buffer is
+        released to pool when is written. Block while the queue is full.
+        Raise the error of a previous write of part
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("the writer is closed")
+
+            if not self._workers:
+                self._start()
+
+            state = self._parts.setdefault(part, [0, None])
+
+            if state[1] is not None:
+                if pool is not None:
+                    pool.release(buffer)
+                raise state[1]
+
+            state[0] += 1
+            self._submitted += 1
+
+        item = (part, offset, buffer, length, pool, extra)
+
+        try:
+            self._queue.put_nowait(item)
+        except Full:
+            # the disk is slower than network
+            start = monotonic()
+            self._queue.put(item)
+            elapsed = monotonic() - start
+
+            with self._cond:
+                self._blocked += 1
+                self._blocked_time += elapsed
+
+    def wait(self, part, timeout=None):
+        """
+        Wait until all buffers of part are written. Raise the error of
+        a write of part if fail
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._parts.get(part, (0,))[0] == 0, timeout)
+            state = self._parts.get(part)
+
+            if state is not None and state[0] == 0:
+                del self._parts[part]
+
+        if state is not None and state[1] is not None:
+            raise state[1]
+
+    def _start(self):
+        for i in range(self.threads):
+            t = Thread(target=self._run, daemon=True, name="queuedownloader-writer-%d" % i)
+            t.start()
+            self._workers.append(t)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+
+            if item is None:
+                return
+
+            part, offset, buffer, length, pool, extra = item
+            error = None
+            start = monotonic()
+
+            try:
+                # the buffers of a part that failed are discarded
+                if self._parts[part][1] is None:
+                    part.write(offset, buffer[:length], extra)
+            except Exception as e:
+                error = e
+            finally:
+                if pool is not None:
+                    pool.release(buffer)
+
+            elapsed = monotonic() - start
+
+            with self._cond:
+                state = self._parts[part]
+                state[0] -= 1
+
+                if error is not None and state[1] is None:
+                    state[1] = error
+
+                if error is None:
+                    self._written += length
+
+                self._write_time += elapsed
+                self._cond.notify_all()
+
+    def stats(self):
+        """
+        Return the WriteStats
+        """
+        with self._cond:
+            return WriteStats(self._queue.qsize(), self.max_pending, self._submitted, self._written,
+                              self._blocked, self._blocked_time, self._write_time)
+
+    def close(self):
+        """
+        Stop the writer threads after write the buffers in queue
+        """
+        with self._cond:
+            if self._closed:
+                return
+
+            self._closed = True
+            workers = self._workers
+
+        for _ in workers:
+            self._queue.put(None)
+
+        for t in workers:
+            t.join()
+
+
+_pool = None
+_lock = Lock()
+
+
+def default_pool():
+    """
+    Return the BufferPool shared by the services
+    """
+    global _pool
+
+    with _lock:
+        if _pool is None:
+            _pool = BufferPool()
+
+        return _pool
@@ -0,0 +1,36 @@
+from urllib.parse import urlsplit
+
+# states of task
+QUEUED = "queued"
+RUNNING = "running"
+RETRYING = "retrying"  # waiting the delay before retry
+CANCELLED = "cancelled"
+COALESCED = "coalesced"  # waiting the download of other task with the same file
+
+
+class Task(object):
+    """
+    Record of a task in the queue
+    """
+    __slots__ = ("key", "info", "host", "future", "service", "state", "ticket", "started",
+                 "probing", "attempts", "retry_at", "progress", "digest", "group")
+
+    def __init__(self, key, info):
+        self.key = key
+        self.info = info  # params of task (username, url, service, ...)
+        self.host = urlsplit(info["url"]).hostname or ""
+        self.future = None  # current execution
+        self.service = None  # instance of service while is running
+        self.state = QUEUED
+        self.ticket = None  # entry in scheduler while is queued
+        self.started = None  # time of start of current execution
+        self.probing = False  # the file size is being resolved
+        self.attempts = 0  # number of executions started
+        self.retry_at = None  # time (monotonic) of next retry
+        self.progress = None  # Progress reported by service
+        self.digest = None  # Digest of file if the task have hashes (kept between retries)
+        self.group = None  # key of the file for coalesce the tasks that download it (see coalesce)
+
+    def __repr__(self):
+        return "<Task %s %s>" % (self.key, self.state)
+
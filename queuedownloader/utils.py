@@ -2,17 +2,19 @@ import functools
 
 def memoize_when_activated(fun):
     @functools.wraps(fun)
-    def wrapper(self):
+    def wrapper(self, *args, **kwargs):
+        key = (fun, args, frozenset(kwargs.items()))
+
         try:
             # case 1: we previously entered
-            ret = self._cache[fun]
+            ret = self._cache[key]
         except AttributeError:
             # case 2: we never entered
-            return fun(self)
+            return fun(self, *args, **kwargs)
         except KeyError:
             # case 3: we entered but there's no cache
             # for this entry yet
-            ret = self._cache[fun] = fun(self)
+            ret = self._cache[key] = fun(self, *args, **kwargs)
         return ret
 
     def cache_activate(proc):
@@ -0,0 +1,115 @@
+import hashlib
+import mmap
+import os
+
+import logging
+
+from .cache import HashCache
+
+logger = logging.getLogger("queuedownloader")
+
+# bytes of the mapped file hashed at once
+BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def hash_file(path, algorithms, block_size=BLOCK_SIZE):
+    """
+    Return a dict of algorithm -> hex digest of file. The file is read
+    with a memory map (without copy it to buffers of process)
+    """
+    hashes = {name: hashlib.new(name) for name in algorithms}
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+
+        # an empty file can't be mapped
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if hasattr(m, "madvise"):
+                    m.madvise(mmap.MADV_SEQUENTIAL)
+
+                for offset in range(0, size, block_size):
+                    with memoryview(m)[offset:offset + block_size] as block:
+                        for h in hashes.values():
+                            h.update(block)
+
+    return {name: h.hexdigest() for name, h in hashes.items()}
+
+
+def verify_files(candidates, cache=None, max_workers=None):
+    """
+    Check that the files have the hashes expected. The files are hashed in
+    parallel by a pool of processes, with a HashCache the hashes of files
+    that did not change are not computed again. Return a list of bool in
+    the order of candidates (False if the file don't exist). The processes
+    are not forked (are started by a forkserver or spawn), so the script that
+    call it must start in a `if __name__ == "__main__":` block
+    >>> verify_files([("downloaded/user1/file.zip", {"sha256": "9f86d0..."})])
+
+    :param candidates: list of (path, dict of algorithm -> hex digest expected)
+    :param cache: HashCache of the hashes of files
+    :param max_workers: max processes (number of cpus by default)
+    """
+    known = {}  # path -> (stat, hashes known)
+    missing = {}  # path -> algorithms to compute
+
+    for file, expected in candidates:
+        if file not in known:
+            try:
+                st = os.stat(file)
+            except OSError:
+                continue
+
+            hashes = cache.get(st) if cache is not None else None
+            known[file] = (st, hashes or {})
+
+        algorithms = [name for name in expected if name not in known[file][1]]
+
+        if algorithms:
+            missing.setdefault(file, set()).update(algorithms)
+
+    if missing:
+        # multiprocessing is slow to import, it is only loaded when files must be hashed
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+
+        # a forked child would copy the threads and locks of the manager (held by other threads)
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+            futures = {file: executor.submit(hash_file, file, sorted(algorithms))
+                       for file, algorithms in missing.items()}
+
+            for file, future in futures.items():
+                try:
+                    hashes = future.result()
+                except OSError as e:
+                    logger.warning("Can't hash %s: %s" % (file, e))
+                    del known[file]
+                    continue
+
+                st = known[file][0]
+
+                try:
+                    changed = HashCache.key(os.stat(file)) != HashCache.key(st)
+                except OSError:
+                    changed = True
+
+                # the file was changed while was hashed
+                if changed:
+                    del known[file]
+                    continue
+
+                known[file][1].update(hashes)
+
+                if cache is not None:
+                    cache.put(st, hashes)
+
+    results = []
+
+    for file, expected in candidates:
+        hashes = known.get(file, (None, {}))[1]
+        results.append(all(hashes.get(name) == value.lower() for name, value in expected.items()))
+
+    return results
@@ -0,0 +1,74 @@
+from unittest import mock
+from os import path
+import tempfile
+import unittest
+
+from queuedownloader.cache import ProbeCache
+from queuedownloader.services import ProbeInfo
+
+
+class Service(object):
+    name = "service"
+    probes = 0
+
+    @classmethod
+    def probe(cls, url, authuser=None, authpasswd=None):
+        cls.probes += 1
+        return ProbeInfo(None if url.endswith("unknown") else 100, None, None)
+
+
+class ProbeCacheTest(unittest.TestCase):
+    def setUp(self):
+        Service.probes = 0
+        self.now = 1000.0
+        patcher = mock.patch("queuedownloader.cache.time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hit_until_ttl(self):
+        cache = ProbeCache(ttl=10)
+        self.assertEqual(cache.probe(Service, "https://host/a").size, 100)
+        self.assertEqual(cache.probe(Service, "https://host/a").size, 100)
+        self.assertEqual(Service.probes, 1)
+
+        self.now += 11
+        cache.probe(Service, "https://host/a")
+        self.assertEqual(Service.probes, 2)
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2, "size": 1})
+
+    def test_unknown_size_not_cached(self):
+        cache = ProbeCache()
+        cache.probe(Service, "https://host/unknown")
+        cache.probe(Service, "https://host/unknown")
+        self.assertEqual(Service.probes, 2)
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_evicted(self):
+        cache = ProbeCache(maxsize=2)
+
+        for url in ("a", "b"):
+            cache.put(Service, url, ProbeInfo(1, None, None))
+
+        cache.get(Service, "a")
+        cache.put(Service, "c", ProbeInfo(1, None, None))
+
+        self.assertIsNotNone(cache.get(Service, "a"))
+        self.assertIsNone(cache.get(Service, "b"))
+        self.assertIsNotNone(cache.get(Service, "c"))
+
+    def test_save_and_load_valid_entries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file = path.join(tmp, "probes.json")
+            cache = ProbeCache(ttl=10)
+            cache.put(Service, "old", ProbeInfo(1, None, None), expires=self.now + 1)
+            cache.put(Service, "new", ProbeInfo(2, '"etag"', None))
+            cache.save(file)
+
+            self.now += 5
+            loaded = ProbeCache(path=file)
+            self.assertIsNone(loaded.get(Service, "old"))
+            self.assertEqual(loaded.get(Service, "new"), ProbeInfo(2, '"etag"', None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+from threading import Event
+from os import path
+import tempfile
+import unittest
+import os
+
+from queuedownloader.manager import DownloadQueueManager
+from queuedownloader.coalesce import coalesce_key, normalize_url
+from queuedownloader.services import MegaService, DefaultService
+from queuedownloader.tasks import RUNNING
+
+
+class FakeMega(MegaService):
+    # write the url as content of file, wait the release of test
+    release = Event()
+
+    @classmethod
+    def filename(cls, url):
+        return "file.bin"
+
+    def execute(self):
+        FakeMega.release.wait(5)
+
+        with open(path.join(self.directory, "file.bin"), "w") as f:
+            f.write(self.url)
+
+        return True
+
+
+class CoalesceTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        FakeMega.release.clear()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_normalize_url_keep_fragment(self):
+        self.assertEqual(normalize_url("HTTP://Example.COM:80/a?x=1#frag"), "http://example.com/a?x=1#frag")
+
+    def test_mega_links_with_other_fragment(self):
+        a = coalesce_key({"service": MegaService, "url": "https://mega.nz/#!handle1!key1"})
+        b = coalesce_key({"service": MegaService, "url": "https://mega.nz/#!handle2!key2"})
+        c = coalesce_key({"service": MegaService, "url": "https://mega.co.nz/file/handle1#key1"})
+
+        self.assertNotEqual(a, b)
+        self.assertEqual(a, c)
+
+    def test_default_service_same_url(self):
+        a = coalesce_key({"service": DefaultService, "url": "http://host/file.zip", "retrycount": 2})
+        b = coalesce_key({"service": DefaultService, "url": "HTTP://HOST:80/file.zip"})
+        self.assertEqual(a, b)
+
+    def test_mega_links_with_other_fragment_are_not_coalesced(self):
+        urls = ["https://mega.nz/#!handle1!key1", "https://mega.nz/#!handle2!key2"]
+
+        with DownloadQueueManager(max_threads=2) as m:
+            m.addtask("user1", urls[0], service=FakeMega, filesize=1)
+            m.addtask("user2", urls[1], service=FakeMega, filesize=1)
+
+            # both are downloaded at same time
+            for _ in range(100):
+                if [t.state for t in m._table] == [RUNNING, RUNNING]:
+                    break
+                FakeMega.release.wait(0.01)
+
+            self.assertEqual([t.state for t in m._table], [RUNNING, RUNNING])
+            FakeMega.release.set()
+
+        for user, url in zip(("user1", "user2"), urls):
+            with open(path.join("downloaded", user, "file.bin")) as f:
+                self.assertEqual(f.read(), url)
+
+
+if __name__ == "__main__":
+    unittest.main()
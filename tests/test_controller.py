@@ -0,0 +1,94 @@
+from time import monotonic
+import unittest
+
+from queuedownloader.controller import ConcurrencyController
+
+
+class FakeManager(object):
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.running = 0
+        self._hostrunning = {}
+        self.unparked = []
+
+    def set_max_workers(self, n):
+        self.max_workers = n
+
+    def _unpark(self, host):
+        self.unparked.append(host)
+
+
+class ControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = FakeManager(4)
+        self.controller = ConcurrencyController(min_workers=2, max_workers=8, interval=3600,
+                                                host_limit=4)
+        self.controller.attach(self.manager)
+
+    def tearDown(self):
+        self.controller.stop()
+
+    def sample(self, nbytes, running=None, host="host", latency=None, ok=True):
+        # a sample of one second
+        self.manager.running = self.manager.max_workers if running is None else running
+        self.controller.record(host, nbytes)
+
+        if latency is not None:
+            self.controller.finished(host, latency, ok)
+
+        self.controller._last = monotonic() - 1.0
+        return self.controller.sample()[0]
+
+    def test_increase_while_saturated(self):
+        d = self.sample(1000)
+        self.assertEqual((d.previous, d.limit, d.reason), (4, 5, "saturated"))
+        self.assertEqual(self.manager.max_workers, 5)
+
+        d = self.sample(1000)
+        self.assertEqual(d.limit, 6)
+
+    def test_hold_while_idle(self):
+        d = self.sample(1000, running=1)
+        self.assertEqual((d.limit, d.reason), (4, "idle"))
+
+    def test_decrease_when_throughput_drop(self):
+        self.sample(1000)
+        d = self.sample(500)
+        self.assertEqual((d.previous, d.limit, d.reason), (5, 2, "throughput"))
+        self.assertEqual(self.manager.max_workers, 2)
+
+    def test_decrease_on_errors(self):
+        d = self.sample(1000, latency=1.0, ok=False)
+        self.assertEqual((d.limit, d.reason), (2, "errors"))
+
+        # not less than min_workers
+        d = self.sample(1000, latency=1.0, ok=False)
+        self.assertEqual(d.limit, 2)
+
+    def test_decrease_on_latency(self):
+        self.sample(1000, running=1, latency=1.0)
+        d = self.sample(1000, running=1, latency=3.0)
+        self.assertEqual((d.limit, d.reason), (2, "latency"))
+
+    def test_host_limit(self):
+        self.assertEqual(self.controller.host_limit("host"), 4)
+
+        self.controller.finished("host", 1.0, ok=False)
+        self.controller._last = monotonic() - 1.0
+        decisions = self.controller.sample()
+
+        self.assertEqual([(d.host, d.limit, d.reason) for d in decisions[1:]], [("host", 2, "errors")])
+        self.assertEqual(self.controller.host_limit("host"), 2)
+        self.assertEqual(self.controller.host_limit("other"), 4)
+
+    def test_history_and_subscribers(self):
+        received = []
+        self.controller.subscribe(received.append)
+        d = self.sample(1000)
+
+        self.assertEqual(received[0], d)
+        self.assertEqual(list(self.controller.history)[0], d)
+
+
+if __name__ == "__main__":
+    unittest.main()
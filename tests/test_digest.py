@@ -0,0 +1,85 @@
+from os import path
+import tempfile
+import unittest
+import hashlib
+
+from queuedownloader.digest import Digest
+from queuedownloader.partfile import PartFile
+from queuedownloader.services.errors import IntegrityError
+
+DATA = b"0123456789" * 1000
+SHA256 = hashlib.sha256(DATA).hexdigest()
+MD5 = hashlib.md5(DATA).hexdigest()
+
+
+class DigestTest(unittest.TestCase):
+    def test_match(self):
+        digest = Digest({"sha256": SHA256.upper(), "md5": MD5})
+        digest.update(DATA[:10])
+        digest.update(DATA[10:])
+        digest.verify(len(DATA))
+        self.assertTrue(digest.verified)
+
+    def test_mismatch(self):
+        digest = Digest({"sha256": SHA256, "md5": "0" * 32})
+        digest.update(DATA)
+
+        with self.assertRaises(IntegrityError):
+            digest.verify(len(DATA))
+
+        self.assertFalse(digest.verified)
+
+    def test_bytes_missing(self):
+        digest = Digest({"sha256": SHA256})
+        digest.update(DATA[:100])
+
+        with self.assertRaises(IntegrityError):
+            digest.verify(len(DATA))
+
+    def test_params(self):
+        self.assertIsNone(Digest.fromparams({"url": "https://host/file"}))
+        self.assertEqual(Digest.fromparams({"sha1": "AB", "md5": None}).expected, {"sha1": "ab"})
+
+        with self.assertRaises(ValueError):
+            Digest({"crc32": "00"})
+
+
+class PartFileDigestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = path.join(self.tmp.name, "file.bin")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, digest, data):
+        part = PartFile(self.output, digest=digest)
+        part.open(len(data))
+
+        # the second half is written before the first
+        middle = len(data) // 2
+        part.write(middle, data[middle:])
+        part.write(0, data[:middle])
+        return part
+
+    def test_commit_verified(self):
+        digest = Digest({"sha256": SHA256})
+        self.write(digest, DATA).commit()
+
+        self.assertTrue(digest.verified)
+        self.assertTrue(path.exists(self.output))
+
+    def test_commit_mismatch_discard_file(self):
+        corrupt = DATA[:-1] + b"x"
+        part = self.write(Digest({"sha256": SHA256}), corrupt)
+
+        with self.assertRaises(IntegrityError):
+            part.commit()
+
+        self.assertFalse(path.exists(self.output))
+        self.assertFalse(path.exists(self.output + ".part"))
+        self.assertFalse(path.exists(self.output + ".part.json"))
+
+
+if __name__ == "__main__":
+    unittest.main()
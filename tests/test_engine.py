@@ -0,0 +1,167 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+from time import monotonic
+from os import path
+import tempfile
+import unittest
+import re
+
+from queuedownloader.engine import HTTPEngine, ConnectionPool, _Segment
+from queuedownloader.partfile import PartFile
+from queuedownloader.progress import Progress
+
+DATA = bytes(range(256)) * 4096  # 1 MiB
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serve DATA with support of Range requests
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        self.server.requests.append((self.command, self.headers.get("Range")))
+        start, end = 0, len(DATA) - 1
+        m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+
+        if m:
+            start = int(m.group(1))
+            end = min(int(m.group(2)), end) if m.group(2) else end
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, len(DATA)))
+        else:
+            self.send_response(200)
+
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"data"')
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        if body:
+            self.wfile.write(DATA[start:end + 1])
+
+
+class EngineTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(("127.0.0.1", 0), RangeHandler)
+        self.server.requests = []
+        Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.url = "http://127.0.0.1:%d/file" % self.server.server_address[1]
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = path.join(self.tmp.name, "file.bin")
+        self.engine = HTTPEngine(ConnectionPool(max_per_host=4), preallocate=False)
+
+    def tearDown(self):
+        self.engine.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def ranges(self):
+        return [r for method, r in self.server.requests if method == "GET"]
+
+    def read(self):
+        with open(self.output, "rb") as f:
+            return f.read()
+
+    def partial(self, *ranges):
+        # part file of a download interrupted with the ranges written
+        part = PartFile(self.output)
+        part.validate(len(DATA), '"data"')
+        part.open()
+
+        for start, end in ranges:
+            part.write(start, DATA[start:end])
+
+        part.close()
+
+    def test_download(self):
+        self.assertTrue(self.engine.download(self.url, self.output))
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(self.ranges(), [None])
+        self.assertFalse(path.exists(self.output + ".part"))
+
+    def test_resume_with_range(self):
+        self.partial((0, 300000))
+
+        progress = Progress()
+        self.assertTrue(self.engine.download(self.url, self.output, progress=progress))
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(self.ranges(), ["bytes=300000-"])
+        self.assertEqual(progress.done, len(DATA))
+
+    def requested(self):
+        # union of the ranges [start, end) requested (a split reduce the end of
+        # a range already requested, so they can overlap)
+        ranges = []
+
+        for r in sorted(self.ranges(), key=lambda r: int(r[6:].split("-")[0])):
+            start, end = re.match(r"bytes=(\d+)-(\d+)", r).groups()
+            start, end = int(start), int(end) + 1
+
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+
+        return ranges
+
+    def test_segmented(self):
+        self.assertTrue(self.engine.download(self.url, self.output, segments=4, min_segment_size=65536))
+        self.assertEqual(self.read(), DATA)
+        self.assertGreaterEqual(len(self.ranges()), 4)
+        self.assertEqual(self.requested(), [[0, len(DATA)]])
+
+    def test_segmented_resume_with_holes(self):
+        self.partial((0, 100000), (500000, 600000))
+
+        progress = Progress()
+        self.assertTrue(self.engine.download(self.url, self.output, progress=progress,
+                                             segments=4, min_segment_size=65536))
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(progress.done, len(DATA))
+
+        # only the ranges missing are downloaded
+        self.assertEqual(self.requested(), [[100000, 500000], [600000, len(DATA)]])
+
+    def test_split_slowest_segment(self):
+        fast, slow = _Segment(0, 1000), _Segment(1000, 5000)
+        fast.pos, slow.pos = 500, 1100
+        fast.started = slow.started = monotonic() - 1
+
+        segment = HTTPEngine._split([fast, slow], 100)
+        self.assertEqual((slow.pos, slow.end), (1100, 3050))
+        self.assertEqual((segment.pos, segment.end), (3050, 5000))
+
+        # the ranges are too small
+        self.assertIsNone(HTTPEngine._split([fast], 300))
+
+    def test_probe_dont_wait_downloads(self):
+        engine = HTTPEngine(ConnectionPool(max_per_host=1))
+        key = ("http", "127.0.0.1", self.server.server_address[1])
+
+        # a download use the only connection of host
+        conn, _ = engine.pool.acquire(*key)
+
+        start = monotonic()
+        headers = engine.probe(self.url, wait=0.1)
+        self.assertLess(monotonic() - start, 5)
+        self.assertEqual(headers["content-length"], str(len(DATA)))
+        self.assertEqual(engine.pool._used, {key: 1})
+
+        engine.pool.release(key, conn, reuse=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
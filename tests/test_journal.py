@@ -0,0 +1,65 @@
+from threading import Event
+from uuid import uuid1
+import tempfile
+import unittest
+import os
+
+from queuedownloader.manager import DownloadQueueManager
+from queuedownloader.journal import Journal
+from queuedownloader.services import DownloaderService
+from queuedownloader.services.registry import ServiceRegistry
+
+
+class BlockedService(DownloaderService):
+    name = "BlockedService"
+    release = Event()
+
+    def execute(self):
+        return BlockedService.release.wait(5)
+
+
+class JournalRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.path = os.path.join(self.tmp.name, "queue.journal")
+        self.registry = ServiceRegistry()
+        self.registry.register(BlockedService)
+        BlockedService.release.clear()
+
+    def tearDown(self):
+        BlockedService.release.set()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_checkpoint_is_recovered(self):
+        key = uuid1()
+        journal = Journal(self.path)
+        journal.recover()
+        journal.add(key, {"username": "u", "url": "https://host/file",
+                          "service": BlockedService, "filesize": 1000})
+        journal.start(key, 1)
+        journal.checkpoint(key, 600)
+        journal.close()
+
+        journal = Journal(self.path)
+        self.assertEqual(journal.recover(),
+                         [(str(key), {"username": "u", "url": "https://host/file",
+                                      "service": "BlockedService", "filesize": 1000},
+                           {"attempts": 1, "checkpoint": 600})])
+        journal.close()
+
+        m = DownloadQueueManager(max_threads=1, registry=self.registry, journal=Journal(self.path))
+
+        status = m.status().tasks[0]
+        self.assertEqual(status.id, key)
+        self.assertEqual(status.progress.done, 600)
+        self.assertEqual(status.progress.fraction, 0.6)
+
+        BlockedService.release.set()
+        m.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+from unittest import mock
+from os import path
+import tempfile
+import unittest
+import os
+
+from queuedownloader.partfile import PartFile, FSYNC_COMPLETE, FSYNC_NEVER
+
+
+class PartFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = path.join(self.tmp.name, "file.bin")
+
+        with open(self.output, "wb") as f:
+            f.write(b"OLD" * 10)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_existing_output_is_not_resumed(self):
+        part = PartFile(self.output)
+        self.assertEqual(part.ranges, [])
+        self.assertEqual(part.offset(), 0)
+
+        part.open(6)
+        part.write(0, b"NEWNEW")
+        part.commit()
+
+        with open(self.output, "rb") as f:
+            self.assertEqual(f.read(), b"NEWNEW")
+
+    def test_existing_output_adopted(self):
+        # wget --continue
+        part = PartFile(self.output, adopt=True)
+        self.assertEqual(part.ranges, [[0, 30]])
+        self.assertFalse(path.exists(self.output))
+        part.close()
+
+
+class FsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = path.join(self.tmp.name, "file.bin")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def download(self, policy, close):
+        part = PartFile(self.output, fsync=policy)
+        part.open(6)
+        part.write(0, b"NEWNEW")
+
+        with mock.patch("queuedownloader.partfile.fsync", wraps=os.fsync) as fsync:
+            # the services that close the file before commit it (wget, mega, playstore)
+            if close:
+                part.close()
+
+            part.commit()
+
+        with open(self.output, "rb") as f:
+            self.assertEqual(f.read(), b"NEWNEW")
+
+        return fsync.call_count
+
+    def test_complete_of_open_file(self):
+        self.assertEqual(self.download(FSYNC_COMPLETE, close=False), 1)
+
+    def test_complete_of_closed_file(self):
+        self.assertEqual(self.download(FSYNC_COMPLETE, close=True), 1)
+
+    def test_never(self):
+        self.assertEqual(self.download(FSYNC_NEVER, close=True), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
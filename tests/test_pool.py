@@ -0,0 +1,90 @@
+from threading import Event, Lock
+from time import sleep, monotonic
+import unittest
+
+from queuedownloader.pool import WorkerPool
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(2)
+        self.release = Event()
+        self.lock = Lock()
+        self.running = 0
+        self.peak = 0
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.shutdown()
+
+    def work(self):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+        self.release.wait(5)
+
+        with self.lock:
+            self.running -= 1
+
+    def wait_running(self, n):
+        deadline = monotonic() + 5
+
+        while self.running != n and monotonic() < deadline:
+            sleep(0.01)
+
+        return self.running
+
+    def test_grow(self):
+        futures = [self.pool.submit(self.work) for _ in range(5)]
+        self.assertEqual(self.wait_running(2), 2)
+
+        # the new workers take the works queued
+        self.pool.set_max_workers(4)
+        self.assertEqual(self.wait_running(4), 4)
+        self.assertEqual(len(self.pool), 4)
+
+        self.release.set()
+
+        for f in futures:
+            f.result(5)
+
+        self.assertEqual(self.peak, 4)
+
+    def test_shrink_without_cancel(self):
+        self.pool.set_max_workers(3)
+        futures = [self.pool.submit(self.work) for _ in range(3)]
+        self.assertEqual(self.wait_running(3), 3)
+
+        # the running works end, then the workers retire
+        self.pool.set_max_workers(1)
+        self.assertEqual(self.pool.max_workers, 1)
+        self.assertEqual(self.running, 3)
+
+        self.release.set()
+
+        for f in futures:
+            self.assertIsNone(f.result(5))
+
+        deadline = monotonic() + 5
+
+        while len(self.pool) > 1 and monotonic() < deadline:
+            sleep(0.01)
+
+        self.assertEqual(len(self.pool), 1)
+        self.assertEqual(self.pool.submit(lambda: 42).result(5), 42)
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            self.pool.set_max_workers(0)
+
+    def test_exception_in_future(self):
+        def fail():
+            raise KeyError("x")
+
+        with self.assertRaises(KeyError):
+            self.pool.submit(fail).result(5)
+
+
+if __name__ == "__main__":
+    unittest.main()
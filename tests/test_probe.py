@@ -0,0 +1,107 @@
+from threading import Event
+from time import monotonic, sleep
+import tempfile
+import unittest
+import os
+
+from queuedownloader.manager import DownloadQueueManager
+from queuedownloader.probe import ProbePool
+from queuedownloader.services import DownloaderService, ProbeInfo
+from queuedownloader.tasks import Task
+
+
+class SlowProbeService(DownloaderService):
+    name = "SlowProbeService"
+    hosts = ("host",)
+    probed = Event()
+    release = Event()
+
+    @classmethod
+    def probe(cls, url, authuser=None, authpasswd=None):
+        cls.probed.set()
+        cls.release.wait(5)
+        return ProbeInfo(1234, '"etag"', None)
+
+    def execute(self):
+        return SlowProbeService.release.wait(5)
+
+
+class ProbePipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        SlowProbeService.probed.clear()
+        SlowProbeService.release.clear()
+        self.manager = DownloadQueueManager(max_threads=1)
+
+    def tearDown(self):
+        SlowProbeService.release.set()
+        self.manager.shutdown()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_addtask_dont_wait_probe(self):
+        start = monotonic()
+        key = self.manager.addtask("u", "https://host/file", service=SlowProbeService)
+        self.assertLess(monotonic() - start, 1)
+
+        self.assertTrue(SlowProbeService.probed.wait(5))
+        self.assertTrue(self.manager._status.get(key).probing)
+
+        SlowProbeService.release.set()
+        self.assertTrue(self.manager.waitall(5))
+
+    def test_size_of_probe_saved(self):
+        key = self.manager.addtask("u", "https://host/file", service=SlowProbeService)
+        self.assertTrue(SlowProbeService.probed.wait(5))
+
+        with self.manager._lock:
+            task = self.manager._table.get(key)
+
+        SlowProbeService.release.set()
+        deadline = monotonic() + 5
+
+        while task.probing and monotonic() < deadline:
+            sleep(0.01)
+
+        self.assertFalse(task.probing)
+        self.assertEqual(task.info["filesize"], 1234)
+        self.assertEqual(task.info["etag"], '"etag"')
+
+
+class ProbePoolTest(unittest.TestCase):
+    def test_skip_tasks_not_probing(self):
+        results = []
+        done = Event()
+
+        def callback(task, info):
+            results.append((task.info["url"], info))
+            done.set()
+
+        class Service(object):
+            @staticmethod
+            def probe(url, authuser=None, authpasswd=None):
+                if url.endswith("fail"):
+                    raise OSError("unreachable")
+                return ProbeInfo(10, None, None)
+
+        tasks = [Task(None, {"username": "u", "url": "https://host/%s" % name, "service": Service})
+                 for name in ("skipped", "fail", "ok")]
+
+        for task, probing in zip(tasks, (False, True, True)):
+            task.probing = probing
+
+        pool = ProbePool(callback, max_workers=1)
+        pool.submit_many(tasks)
+        deadline = monotonic() + 5
+
+        while len(results) < 2 and monotonic() < deadline:
+            done.wait(0.1)
+
+        pool.shutdown()
+        self.assertEqual(results, [("https://host/fail", None), ("https://host/ok", ProbeInfo(10, None, None))])
+
+
+if __name__ == "__main__":
+    unittest.main()
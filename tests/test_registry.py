@@ -0,0 +1,67 @@
+import unittest
+
+from queuedownloader.services import DownloaderService, DefaultService
+from queuedownloader.services.registry import ServiceRegistry
+
+
+class VideoService(DownloaderService):
+    name = "video"
+    hosts = ("video.test",)
+
+
+class SecureService(DownloaderService):
+    name = "secure"
+    hosts = ("files.test",)
+    schemes = ("https",)
+
+
+class PackageService(DownloaderService):
+    name = "package"
+    patterns = (r"[a-z]+\.[a-z]+\.[a-z]+",)
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = ServiceRegistry(default=DefaultService, entrypoints=False)
+
+        for service in (VideoService, SecureService, PackageService):
+            self.registry.register(service)
+
+    def test_lookup_host_and_subdomains(self):
+        self.assertIs(self.registry.lookup("https://video.test/watch?v=1"), VideoService)
+        self.assertIs(self.registry.lookup("http://www.VIDEO.test/watch"), VideoService)
+        self.assertIs(self.registry.lookup("https://othervideo.test/file"), DefaultService)
+
+    def test_lookup_scheme(self):
+        self.assertIs(self.registry.lookup("https://files.test/a.zip"), SecureService)
+        self.assertIs(self.registry.lookup("http://files.test/a.zip"), DefaultService)
+
+    def test_lookup_pattern(self):
+        self.assertIs(self.registry.lookup("com.music.app"), PackageService)
+        self.assertIs(self.registry.lookup("com.music"), DefaultService)
+
+    def test_last_registered_win(self):
+        class NewVideoService(VideoService):
+            name = "newvideo"
+
+        self.registry.register(NewVideoService)
+        self.assertIs(self.registry.lookup("https://video.test/1"), NewVideoService)
+        self.assertIs(self.registry.byname("video"), VideoService)
+        self.assertIs(self.registry.byname("newvideo"), NewVideoService)
+        self.assertIsNone(self.registry.byname("unknown"))
+
+    def test_classify(self):
+        urls = ["https://video.test/1", "com.music.app", "https://files.test/a",
+                "https://other.test/b", "https://www.video.test/2"]
+
+        self.assertEqual(self.registry.classify(urls),
+                         [VideoService, PackageService, SecureService, DefaultService, VideoService])
+        self.assertEqual(self.registry.classify(urls), [self.registry.lookup(url) for url in urls])
+
+    def test_lookup_not_str(self):
+        with self.assertRaises(TypeError):
+            self.registry.lookup(None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+from concurrent.futures import Future
+from time import sleep
+import tempfile
+import unittest
+import os
+
+from queuedownloader.manager import DownloadQueueManager
+from queuedownloader.retry import RetryScheduler
+from queuedownloader.services import DownloaderService
+
+
+class NopService(DownloaderService):
+    name = "NopService"
+    hosts = ("host",)
+
+    def execute(self):
+        return True
+
+
+class HalfOpenTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+        self.retry = RetryScheduler(failure_threshold=1, reset_timeout=0.05, recheck=0.05)
+        self.manager = DownloadQueueManager(retry=self.retry)
+
+        # the host is half-open
+        self.retry.failure("host")
+        sleep(0.06)
+
+    def tearDown(self):
+        self.manager.shutdown()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def dispatch_pending(self):
+        # the execution is submitted but never run
+        submit = self.manager._pool.submit
+        self.manager._pool.submit = lambda fn, task: Future()
+
+        try:
+            key = self.manager.addtask("u", "https://host/file", service=NopService, filesize=1)
+        finally:
+            self.manager._pool.submit = submit
+
+        self.assertEqual(self.retry._breakers["host"].trial, key)
+        return key
+
+    def test_cancel_trial_before_run(self):
+        key = self.dispatch_pending()
+
+        self.assertTrue(self.manager.canceltask(key))
+        self.assertEqual(self.retry.blocked("host", reserve=False), 0)
+
+    def test_restart_trial_before_run(self):
+        key = self.dispatch_pending()
+
+        # the task is dispatched again and test the host
+        self.assertTrue(self.manager.restarttask(key))
+        self.assertTrue(self.manager.waitall(5))
+        self.assertEqual(self.retry.state("host"), "closed")
+
+    def test_abort_of_other_task(self):
+        key = self.dispatch_pending()
+
+        self.retry.abort("host", "other")
+        self.assertEqual(self.retry._breakers["host"].trial, key)
+        self.manager.canceltask(key)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+from collections import Counter
+from uuid import uuid1
+import unittest
+
+from queuedownloader.scheduler import FairScheduler, FifoScheduler
+from queuedownloader.tasks import Task
+
+
+def task(username, priority=0):
+    return Task(uuid1(), {"username": username, "url": "https://host/%s" % username,
+                          "priority": priority})
+
+
+def users(tasks):
+    return [t.info["username"] for t in tasks]
+
+
+class FairSchedulerTest(unittest.TestCase):
+    def pop(self, scheduler, n):
+        tasks = [scheduler.pop() for _ in range(n)]
+
+        # the tasks end at once, so only the shares decide
+        for t in tasks:
+            if t is not None:
+                scheduler.done(t)
+
+        return [t for t in tasks if t is not None]
+
+    def test_users_alternate(self):
+        scheduler = FairScheduler()
+
+        # a user queue many tasks before other
+        for _ in range(100):
+            scheduler.push(task("a"))
+        for _ in range(3):
+            scheduler.push(task("b"))
+
+        self.assertEqual(users(self.pop(scheduler, 6)), ["a", "b", "a", "b", "a", "b"])
+        self.assertEqual(len(scheduler), 97)
+
+    def test_weights(self):
+        scheduler = FairScheduler(weights={"a": 3})
+
+        for _ in range(40):
+            scheduler.push(task("a"))
+            scheduler.push(task("b"))
+
+        self.assertEqual(Counter(users(self.pop(scheduler, 40))), {"a": 30, "b": 10})
+
+    def test_priority_first(self):
+        scheduler = FairScheduler()
+        scheduler.push(task("a"))
+        scheduler.push(task("b"))
+        urgent = task("a", priority=5)
+        scheduler.push(urgent)
+
+        self.assertIs(scheduler.pop(), urgent)
+
+    def test_max_running_per_user(self):
+        scheduler = FairScheduler(max_running_per_user=2)
+
+        for _ in range(5):
+            scheduler.push(task("a"))
+
+        running = [scheduler.pop(), scheduler.pop()]
+        self.assertIsNone(scheduler.pop())
+
+        # a running task end, other of user can start
+        scheduler.done(running[0])
+        self.assertIsNotNone(scheduler.pop())
+        self.assertIsNone(scheduler.pop())
+
+        scheduler.set_max_running_per_user(None)
+        self.assertEqual(len(self.pop(scheduler, 5)), 2)
+
+    def test_discard_and_push_again(self):
+        scheduler = FairScheduler()
+        tasks = [task("a") for _ in range(3)]
+
+        for t in tasks:
+            scheduler.push(t)
+
+        scheduler.discard(tasks[0])
+        scheduler.push(tasks[1])  # moved to back
+
+        self.assertEqual(len(scheduler), 2)
+        self.assertEqual(self.pop(scheduler, 3), [tasks[2], tasks[1]])
+
+
+class FifoSchedulerTest(unittest.TestCase):
+    def test_order(self):
+        scheduler = FifoScheduler()
+        tasks = [task("a"), task("b"), task("a")]
+
+        for t in tasks:
+            scheduler.push(t)
+
+        scheduler.discard(tasks[1])
+        self.assertEqual([scheduler.pop(), scheduler.pop(), scheduler.pop()], [tasks[0], tasks[2], None])
+
+
+if __name__ == "__main__":
+    unittest.main()
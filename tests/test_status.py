@@ -0,0 +1,100 @@
+from threading import Event
+from time import sleep
+from uuid import uuid1
+import tempfile
+import unittest
+import os
+
+from queuedownloader import manager
+from queuedownloader.manager import DownloadQueueManager
+from queuedownloader.status import StatusView
+from queuedownloader.progress import Progress, ProgressInfo
+from queuedownloader.services import DefaultService, DownloaderService
+from queuedownloader.tasks import Task
+
+
+def task(url):
+    t = Task(uuid1(), {"username": "u", "url": url, "service": DefaultService, "filesize": 100})
+    t.progress = Progress(100)
+    return t
+
+
+class StatusViewTest(unittest.TestCase):
+    def setUp(self):
+        self.view = StatusView()
+        self.tasks = [task("http://host/%d" % i) for i in range(3)]
+
+        for t in self.tasks:
+            self.view.update(t)
+
+    def test_move_to_end_is_a_change(self):
+        s = self.view.snapshot()
+        self.view.move_to_end(self.tasks[0].key)
+
+        changes = self.view.changes_since(s.generation)
+        self.assertGreater(changes.generation, s.generation)
+        self.assertEqual([c.id for c in changes.updated], [self.tasks[0].key])
+
+        order = [t.id for t in self.view.snapshot().tasks]
+        self.assertEqual(order, [self.tasks[1].key, self.tasks[2].key, self.tasks[0].key])
+
+    def test_snapshot_is_immutable(self):
+        s = self.view.snapshot()
+        self.tasks[0].progress.add(50)
+
+        self.assertIsInstance(s.tasks[0].progress, ProgressInfo)
+        self.assertEqual(s.tasks[0].progress.done, 0)
+
+    def test_progress_is_a_change(self):
+        s = self.view.snapshot()
+        self.tasks[1].progress.add(50)
+        self.view.progress(self.tasks[1])
+
+        changes = self.view.changes_since(s.generation)
+        self.assertEqual([(c.id, c.progress.done) for c in changes.updated], [(self.tasks[1].key, 50)])
+        self.assertEqual(self.view.snapshot().tasks[1].progress.done, 50)
+        self.assertEqual(self.view.get(self.tasks[1].key).progress.done, 50)
+        self.assertEqual(s.tasks[1].progress.done, 0)
+
+
+class Downloading(DownloaderService):
+    name = "Downloading"
+    hosts = ("host",)
+    release = Event()
+
+    def execute(self):
+        while not Downloading.release.wait(0.01):
+            self.progress.add(100)
+
+        return True
+
+
+class ManagerStatusTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        Downloading.release.clear()
+        self.manager = DownloadQueueManager(max_threads=1)
+
+    def tearDown(self):
+        Downloading.release.set()
+        self.manager.shutdown()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_status_of_running_task_progress(self):
+        key = self.manager.addtask("u", "https://host/file", service=Downloading, filesize=10 ** 6)
+        sleep(0.3)
+        s = self.manager.status()
+        sleep(manager.STATUS_PROGRESS_INTERVAL + 0.3)
+
+        changes = self.manager.changes_since(s.generation)
+        self.assertEqual([c.id for c in changes.updated], [key])
+        self.assertGreater(changes.updated[0].progress.done, s.tasks[0].progress.done)
+        self.assertGreater(self.manager.status().generation, s.generation)
+        self.assertEqual(self.manager.status().tasks[0].progress, changes.updated[0].progress)
+
+
+if __name__ == "__main__":
+    unittest.main()
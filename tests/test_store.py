@@ -0,0 +1,160 @@
+from threading import Event
+from uuid import uuid1
+import tempfile
+import unittest
+import sqlite3
+import os
+
+from queuedownloader.manager import DownloadQueueManager
+from queuedownloader.store import MemoryTaskStore, SQLiteTaskStore
+from queuedownloader.services import DownloaderService
+from queuedownloader.services.registry import ServiceRegistry
+from queuedownloader.tasks import Task, QUEUED, RUNNING
+
+
+class BlockedService(DownloaderService):
+    name = "BlockedService"
+    release = Event()
+
+    def execute(self):
+        return BlockedService.release.wait(5)
+
+
+class MemoryTaskStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryTaskStore()
+        self.tasks = [Task(uuid1(), {"username": user, "url": "https://host/%s" % user,
+                                     "service": BlockedService}) for user in ("a", "b")]
+
+        for task in self.tasks:
+            task.state = QUEUED
+
+        self.store.add_many(self.tasks)
+
+    def test_state_change_keeps_indexes(self):
+        task = self.tasks[1]
+        task.state = RUNNING
+        self.store.update(task)
+
+        self.assertEqual(self.store.scan(username="b"), [(2, task)])
+        self.assertEqual(self.store.query(username="b"), [task])
+        self.assertEqual(self.store.query(service="BlockedService"), self.tasks)
+        self.assertEqual(self.store.query(status=RUNNING), [task])
+        self.assertEqual(self.store.query(status=QUEUED), [self.tasks[0]])
+        self.assertEqual(self.store.query(), self.tasks)
+        self.assertEqual(self.store.counts("b"), {RUNNING: 1})
+        self.assertEqual(self.store.counts(), {QUEUED: 1, RUNNING: 1})
+        self.assertEqual(self.store.count(username="b"), 1)
+
+    def test_state_change_of_only_task(self):
+        self.store.remove(self.tasks[0].key)
+        task = self.tasks[1]
+
+        for state in (RUNNING, QUEUED, RUNNING):
+            task.state = state
+            self.store.update(task)
+
+        self.assertEqual(self.store.query(), [task])
+        self.assertEqual(self.store.query(status=RUNNING), [task])
+        self.assertEqual(self.store.query(status=QUEUED), [])
+        self.assertEqual(self.store.counts(), {RUNNING: 1})
+
+    def test_status_index_keeps_queue_order(self):
+        tasks = [Task(uuid1(), {"username": "c", "url": "https://host/c%d" % i,
+                                "service": BlockedService}) for i in range(200)]
+        self.store.add_many(tasks)
+
+        # the tasks start in other order than the queue
+        for task in reversed(tasks[::2]):
+            task.state = RUNNING
+            self.store.update(task)
+
+        tasks[0].state = QUEUED
+        self.store.update(tasks[0])
+
+        self.assertEqual(self.store.query(status=RUNNING), tasks[2::2])
+        self.assertEqual(self.store.query(username="c", status=QUEUED), [tasks[0]] + tasks[1::2])
+        [(cursor, first)] = self.store.scan(status=RUNNING, count=1)
+        self.assertIs(first, tasks[2])
+        self.assertEqual([task for _, task in self.store.scan(status=RUNNING, after=cursor, count=2)],
+                         [tasks[4], tasks[6]])
+
+
+class SQLiteRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.db = os.path.join(self.tmp.name, "queue.db")
+        self.registry = ServiceRegistry()
+        self.registry.register(BlockedService)
+        BlockedService.release.clear()
+
+        store = SQLiteTaskStore(self.db)
+        store.add_many([Task(uuid1(), {"username": "u", "url": "https://host/%d" % i,
+                                       "service": BlockedService, "filesize": 1})
+                        for i in range(3)])
+        store.close()
+
+    def tearDown(self):
+        BlockedService.release.set()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def rows(self):
+        # read by other connection, as after a crash
+        with sqlite3.connect(self.db) as db:
+            return [key for (key,) in db.execute("SELECT key FROM tasks ORDER BY seq")]
+
+    def test_rows_kept_before_first_flush(self):
+        keys = self.rows()
+        m = DownloadQueueManager(max_threads=1, registry=self.registry,
+                                 store=SQLiteTaskStore(self.db, flush_interval=60))
+
+        self.assertEqual(self.rows(), keys)
+        self.assertEqual([str(t.key) for t in m._table], keys)
+
+        BlockedService.release.set()
+        m.shutdown()
+        self.assertEqual(self.rows(), [])
+
+    def test_clear_is_written_with_new_rows(self):
+        keys = self.rows()
+        store = SQLiteTaskStore(self.db, flush_interval=60)
+        store.clear()
+        self.assertEqual(self.rows(), keys)
+
+        task = Task(uuid1(), {"username": "u", "url": "https://host/new", "service": BlockedService})
+        store.add(task)
+        store.flush()
+        self.assertEqual(self.rows(), [str(task.key)])
+        store.close()
+
+    def test_full_batch_written_by_other_thread(self):
+        store = SQLiteTaskStore(self.db, batch_size=2, flush_interval=60)
+        write = store._write
+        writing, release = Event(), Event()
+
+        def blocked(pending, reset):
+            writing.set()
+            release.wait(5)
+            write(pending, reset)
+
+        store._write = blocked
+        tasks = [Task(uuid1(), {"username": "u", "url": "https://host/new%d" % i,
+                                "service": BlockedService}) for i in range(2)]
+        store.add_many(tasks)
+
+        # the changes don't wait the disk
+        self.assertTrue(writing.wait(5))
+        tasks[0].state = RUNNING
+        store.update(tasks[0])
+        self.assertEqual(store.count(status=RUNNING), 1)
+
+        release.set()
+        store.close()
+        self.assertEqual(self.rows()[-2:], [str(task.key) for task in tasks])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+from threading import Event, Lock, Timer
+import unittest
+
+from queuedownloader.stream import WriteBehind
+
+
+class FakePart(object):
+    def __init__(self, fail_at=None, gate=None):
+        self.fail_at = fail_at
+        self.gate = gate
+        self.data = {}
+        self.lock = Lock()
+        self.writing = Event()
+
+    def write(self, offset, data, extra=None):
+        self.writing.set()
+
+        if self.gate is not None:
+            self.gate.wait(5)
+
+        if offset == self.fail_at:
+            raise OSError(28, "No space left on device")
+
+        with self.lock:
+            self.data[offset] = bytes(data)
+
+
+class FakePool(object):
+    def __init__(self):
+        self.released = []
+
+    def release(self, buffer):
+        self.released.append(buffer)
+
+
+class WriteBehindTest(unittest.TestCase):
+    def setUp(self):
+        self.writer = WriteBehind(threads=2, max_pending=4)
+
+    def tearDown(self):
+        self.writer.close()
+
+    def test_write_and_wait(self):
+        part, pool = FakePart(), FakePool()
+
+        for i in range(10):
+            self.writer.submit(part, i * 3, bytearray(b"abcdef"), 3, pool)
+
+        self.writer.wait(part)
+        self.assertEqual(part.data, {i * 3: b"abc" for i in range(10)})
+        self.assertEqual(len(pool.released), 10)
+        self.assertEqual(self.writer.stats().written, 30)
+
+    def test_error_raised_by_wait(self):
+        part, pool = FakePart(fail_at=6), FakePool()
+
+        for i in range(5):
+            self.writer.submit(part, i * 3, bytearray(b"abc"), 3, pool)
+
+        with self.assertRaises(OSError) as cm:
+            self.writer.wait(part)
+
+        self.assertEqual(cm.exception.errno, 28)
+        self.assertNotIn(6, part.data)
+
+        # the buffers of the failed part are returned to pool
+        self.assertEqual(len(pool.released), 5)
+
+    def test_error_raised_by_next_submit(self):
+        part, pool = FakePart(fail_at=0), FakePool()
+        self.writer.submit(part, 0, bytearray(b"abc"), 3, pool)
+
+        with self.writer._cond:
+            self.writer._cond.wait_for(lambda: self.writer._parts[part][1] is not None, 5)
+
+        with self.assertRaises(OSError):
+            self.writer.submit(part, 3, bytearray(b"abc"), 3, pool)
+
+        self.assertEqual(len(pool.released), 2)
+
+    def test_other_parts_not_affected(self):
+        bad, good = FakePart(fail_at=0), FakePart()
+        self.writer.submit(bad, 0, b"abc", 3)
+        self.writer.submit(good, 0, b"abc", 3)
+
+        self.writer.wait(good)
+        self.assertEqual(good.data, {0: b"abc"})
+
+        with self.assertRaises(OSError):
+            self.writer.wait(bad)
+
+    def test_backpressure_measured(self):
+        gate = Event()
+        writer = WriteBehind(threads=1, max_pending=1)
+        part = FakePart(gate=gate)
+
+        # the write is blocked, the queue is full and the next submit wait
+        writer.submit(part, 0, b"a", 1)
+        self.assertTrue(part.writing.wait(5))
+        writer.submit(part, 1, b"a", 1)
+
+        Timer(0.1, gate.set).start()
+        writer.submit(part, 2, b"a", 1)
+        writer.wait(part)
+        stats = writer.stats()
+        writer.close()
+
+        self.assertEqual(stats.blocked, 1)
+        self.assertGreater(stats.blocked_time, 0.05)
+        self.assertEqual(stats.written, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()